@@ -0,0 +1,380 @@
+"""Архив ответов обхода для повторного разбора без сети
+
+С AUTOSPOT_ARCHIVE_FILE (run_spider.py --record) ArchiveMiddleware
+дописывает в архив каждый ответ, пришедший из загрузчика: адрес запроса,
+статус, заголовки и тело. Архив - один файл, в который только дописывают
+(как WARC): запись - заголовок фиксированной длины, метаданные JSON и
+тело, сжатое zstd (или zlib, если zstandard не установлен). Как и в
+SqliteCacheStorage, первое большое тело каждого типа запроса (list,
+detail, token) становится словарем zstd для остальных: страницы SPA
+почти целиком совпадают разметкой. Рядом ведется индекс <архив>.idx -
+строка на запись со смещением, длиной, типом, статусом и адресом; если
+его нет или процесс упал на середине, индекс восстанавливается по архиву.
+
+Повторный разбор (run_spider.py --replay) - обычный обход, в котором
+ArchiveDownloadHandler отдает ответы из архива вместо сети: без
+задержек, троттлинга и кэша, с тем же кодом паука, конвейерами и
+форматами выгрузки. Параллельно разбирает пул процессов
+(--parse-workers); пропускная способность - в статистике replay/...
+
+    python run_spider.py --record data/autospot.archive
+    python run_spider.py --replay data/autospot.archive --format jsonl --parse-workers 4
+
+    python -m autospot_scrapy.archive stats data/autospot.archive
+    python -m autospot_scrapy.archive get data/autospot.archive https://autospot.ru/...
+    python -m autospot_scrapy.archive reindex data/autospot.archive
+"""
+
+import argparse
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers, Response
+from scrapy.responsetypes import responsetypes
+from twisted.internet import defer
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+from autospot_scrapy.httpcache import MIN_DICTIONARY_SIZE, decode_body
+from autospot_scrapy.utils import request_kind
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Заголовок записи: метка формата, длина метаданных, длина тела
+RECORD = struct.Struct('>4sII')
+MAGIC = b'ASA1'
+# Тип записи-словаря в индексе: dict:<тип запроса>
+DICT_PREFIX = 'dict:'
+
+
+class ResponseArchive:
+    """Файл записей ответов, в который только дописывают, и его индекс по адресу"""
+
+    def __init__(self, path, writable=False, codec='zstd', commit_every=200):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.writable = writable
+        self.codec = 'zlib' if codec == 'zstd' and zstandard is None else codec
+        self.commit_every = commit_every
+        self._pending = 0
+        # Адрес -> (смещение, длина) последней записи; тип запроса -> смещение словаря
+        self.index = {}
+        self.dictionaries = {}
+        self.records = 0
+        self.kinds = {}
+        self.size = 0
+        self._compressors = {}
+        self._decompressors = {}
+        if writable:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(path, 'ab')
+        self.fd = os.open(path, os.O_RDONLY)
+        self._load_index()
+        if writable:
+            self.index_file = open(self.index_path, 'a', encoding='utf-8')
+
+    def _load_index(self):
+        """Читает индекс и дочитывает по архиву записи, которые в него не попали"""
+        indexed_end = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t', 4)
+                    if len(fields) < 5:
+                        break
+                    offset, length = int(fields[0]), int(fields[1])
+                    self._add(offset, length, fields[2], fields[3], fields[4])
+                    indexed_end = max(indexed_end, offset + length)
+        file_size = os.fstat(self.fd).st_size
+        if indexed_end > file_size:
+            # Индекс от другого (или обрезанного) архива
+            logger.warning("Index %s does not match the archive, rebuilding", self.index_path)
+            self.index, self.dictionaries, self.records, self.kinds = {}, {}, 0, {}
+            indexed_end = 0
+            if self.writable:
+                open(self.index_path, 'w').close()
+        self.size = indexed_end
+        if indexed_end < file_size:
+            self._scan(indexed_end, file_size)
+
+    def _scan(self, offset, file_size):
+        """Индексирует записи с offset; недописанный хвост отрезается (при записи)"""
+        lines = []
+        while offset + RECORD.size <= file_size:
+            magic, meta_length, body_length = RECORD.unpack(os.pread(self.fd, RECORD.size, offset))
+            length = RECORD.size + meta_length + body_length
+            if magic != MAGIC or offset + length > file_size:
+                break
+            meta = json.loads(os.pread(self.fd, meta_length, offset + RECORD.size))
+            self._add(offset, length, meta['kind'], meta.get('status', 0), meta['url'])
+            lines.append(self._index_line(offset, length, meta))
+            offset += length
+        self.size = offset
+        if offset < file_size:
+            logger.warning("Archive %s has a truncated record at %d", self.path, offset)
+            if self.writable:
+                self.file.truncate(offset)
+        if self.writable and lines:
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+        return len(lines)
+
+    def _add(self, offset, length, kind, status, url):
+        if kind.startswith(DICT_PREFIX):
+            self.dictionaries[kind[len(DICT_PREFIX):]] = offset
+        else:
+            self.index[url] = (offset, length)
+            self.records += 1
+        entry = self.kinds.setdefault(kind, {'records': 0, 'bytes': 0, 'statuses': {}})
+        entry['records'] += 1
+        entry['bytes'] += length
+        entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+
+    @staticmethod
+    def _index_line(offset, length, meta):
+        return f"{offset}\t{length}\t{meta['kind']}\t{meta.get('status', 0)}\t{meta['url']}\n"
+
+    def append(self, url, status, headers, body, kind='detail', method='GET'):
+        """Дописывает ответ (тело без Content-Encoding); возвращает размер записи"""
+        dict_offset = self.dictionaries.get(kind)
+        if self.codec == 'zstd' and dict_offset is None and len(body) >= MIN_DICTIONARY_SIZE:
+            dict_offset = self._write({'url': url, 'kind': DICT_PREFIX + kind, 'codec': 'zstd'},
+                                      self._compressor(None).compress(body))
+        meta = {
+            'url': url,
+            'method': method,
+            'status': status,
+            'headers': headers_dict_to_raw(headers).decode('latin-1'),
+            'kind': kind,
+            'codec': self.codec,
+            'dict': dict_offset if self.codec == 'zstd' else None,
+            'size': len(body),
+            'time': time.time(),
+        }
+        length_before = self.size
+        self._write(meta, self._compress(body, meta['dict']))
+        self._maybe_flush()
+        return self.size - length_before
+
+    def _write(self, meta, data):
+        raw_meta = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        offset = self.size
+        self.file.write(RECORD.pack(MAGIC, len(raw_meta), len(data)) + raw_meta + data)
+        length = RECORD.size + len(raw_meta) + len(data)
+        self.size += length
+        self._add(offset, length, meta['kind'], meta.get('status', 0), meta['url'])
+        self.index_file.write(self._index_line(offset, length, meta))
+        return offset
+
+    def read(self, offset, length=None):
+        """(метаданные, тело) записи по смещению"""
+        if length is None:
+            _, meta_length, body_length = RECORD.unpack(os.pread(self.fd, RECORD.size, offset))
+            length = RECORD.size + meta_length + body_length
+        data = os.pread(self.fd, length, offset)
+        magic, meta_length, _ = RECORD.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"No archive record at offset {offset}")
+        meta = json.loads(data[RECORD.size:RECORD.size + meta_length])
+        body = self._decompress(data[RECORD.size + meta_length:], meta['codec'], meta.get('dict'))
+        return meta, body
+
+    def get(self, url):
+        """(метаданные, тело) последнего ответа на url или None"""
+        entry = self.index.get(url)
+        return self.read(*entry) if entry else None
+
+    def response(self, url, request=None):
+        """Response Scrapy из архива или None"""
+        found = self.get(url)
+        if found is None:
+            return None
+        meta, body = found
+        headers = Headers(headers_raw_to_dict(meta['headers'].encode('latin-1')))
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, status=meta['status'], headers=headers, body=body, request=request,
+                       flags=['archive'])
+
+    def stats(self):
+        return {
+            'records': self.records,
+            'urls': len(self.index),
+            'file_bytes': self.size,
+            'codec': self.codec,
+            'kinds': self.kinds,
+        }
+
+    def flush(self):
+        if self.writable:
+            self.file.flush()
+            self.index_file.flush()
+        self._pending = 0
+
+    def close(self):
+        if self.writable:
+            self.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.index_file.close()
+            self.writable = False
+        os.close(self.fd)
+
+    def _maybe_flush(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.flush()
+
+    def _compress(self, body, dict_offset):
+        if self.codec == 'zlib':
+            return zlib.compress(body, 6)
+        if self.codec != 'zstd':
+            return body
+        return self._compressor(dict_offset).compress(body)
+
+    def _decompress(self, data, codec, dict_offset=None):
+        if codec == 'zlib':
+            return zlib.decompress(data)
+        if codec != 'zstd':
+            return data
+        if zstandard is None:
+            raise ValueError("zstandard is required to read this archive")
+        if dict_offset not in self._decompressors:
+            zdict = self._dictionary(dict_offset)
+            self._decompressors[dict_offset] = zstandard.ZstdDecompressor(dict_data=zdict) if zdict \
+                else zstandard.ZstdDecompressor()
+        return self._decompressors[dict_offset].decompress(data)
+
+    def _compressor(self, dict_offset):
+        if dict_offset not in self._compressors:
+            zdict = self._dictionary(dict_offset)
+            self._compressors[dict_offset] = zstandard.ZstdCompressor(level=3, dict_data=zdict) if zdict \
+                else zstandard.ZstdCompressor(level=3)
+        return self._compressors[dict_offset]
+
+    def _dictionary(self, dict_offset):
+        if dict_offset is None:
+            return None
+        if self.writable:
+            self.file.flush()
+        _, body = self.read(dict_offset)
+        return zstandard.ZstdCompressionDict(body, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+
+
+class ArchiveMiddleware:
+    """Дописывает ответы загрузчика в архив AUTOSPOT_ARCHIVE_FILE
+
+    Стоит между RedirectMiddleware и CookiesMiddleware: пишет ответ как
+    он пришел (редиректы, ошибки, повторы - каждый своей записью), а при
+    повторном разборе те же middleware обрабатывают его заново.
+    """
+
+    def __init__(self, crawler, path, codec='zstd'):
+        self.crawler = crawler
+        self.archive = ResponseArchive(path, writable=True, codec=codec)
+        logger.info("Recording responses to %s (%d already there)", path, self.archive.records)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('AUTOSPOT_ARCHIVE_FILE')
+        if not path:
+            raise NotConfigured
+        return cls(crawler, path, codec=crawler.settings.get('AUTOSPOT_ARCHIVE_COMPRESSION', 'zstd'))
+
+    def process_response(self, request, response, spider):
+        if 'archive' in response.flags or not request.url.startswith(('http://', 'https://')):
+            return response
+        headers, body = decode_body(response.headers, response.body)
+        size = self.archive.append(request.url, response.status, headers, body,
+                                   kind=request_kind(request), method=request.method)
+        stats = self.crawler.stats
+        stats.inc_value('archive/records')
+        stats.inc_value('archive/body_bytes', len(body))
+        stats.inc_value('archive/bytes', size)
+        return response
+
+    def spider_closed(self, spider):
+        self.archive.close()
+
+
+class ArchiveDownloadHandler:
+    """Обработчик http/https, отдающий ответы из архива AUTOSPOT_REPLAY_ARCHIVE вместо сети"""
+
+    def __init__(self, crawler, path):
+        self.crawler = crawler
+        self.archive = ResponseArchive(path)
+        self.started = time.perf_counter()
+        logger.info("Replaying %d responses from %s", self.archive.records, path)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('AUTOSPOT_REPLAY_ARCHIVE')
+        if not path:
+            raise NotConfigured
+        return cls(crawler, path)
+
+    def download_request(self, request, spider):
+        stats = self.crawler.stats
+        response = self.archive.response(request.url, request)
+        if response is None:
+            stats.inc_value('replay/missing')
+            logger.debug("Not in archive: %s", request.url)
+            return defer.succeed(Response(request.url, status=404, request=request, flags=['archive']))
+        stats.inc_value('replay/responses')
+        stats.inc_value('replay/bytes', len(response.body))
+        return defer.succeed(response)
+
+    def spider_closed(self, spider, reason):
+        # Обработчик создается при первом запросе своей схемы, почти сразу после начала обхода
+        stats = self.crawler.stats
+        seconds = time.perf_counter() - self.started
+        responses = stats.get_value('replay/responses', 0)
+        items = stats.get_value('item_scraped_count', 0)
+        stats.set_value('replay/seconds', round(seconds, 3))
+        stats.set_value('replay/responses_per_second', round(responses / seconds, 1))
+        stats.set_value('replay/items_per_second', round(items / seconds, 1))
+        logger.info("Replayed %d responses (%d missing) in %.1fs: %.1f responses/s, %.1f items/s",
+                    responses, stats.get_value('replay/missing', 0), seconds, responses / seconds, items / seconds)
+
+    def close(self):
+        self.archive.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect a response archive')
+    parser.add_argument('command', choices=('stats', 'get', 'reindex'))
+    parser.add_argument('archive', help='Archive file')
+    parser.add_argument('url', nargs='*', help='Request URLs (for get)')
+    args = parser.parse_args()
+
+    if args.command == 'reindex':
+        if os.path.exists(args.archive + '.idx'):
+            os.remove(args.archive + '.idx')
+        archive = ResponseArchive(args.archive, writable=True)
+        print(f'Indexed {archive.records} records')
+    else:
+        archive = ResponseArchive(args.archive)
+    if args.command == 'stats':
+        print(json.dumps(archive.stats(), indent=2))
+    elif args.command == 'get':
+        for url in args.url:
+            found = archive.get(url)
+            if found is None:
+                print(f'{url}\tnot found')
+                continue
+            meta, body = found
+            print(f"{url}\t{meta['status']}\t{meta['kind']}\t{len(body)} bytes")
+    archive.close()
@@ -0,0 +1,225 @@
+"""Бюджеты обхода и стратифицированная выборка
+
+Обход можно ограничить по каждому типу машин (used, new):
+
+    pages     страниц списков (первая страница считается)
+    requests  загрузок (списки, объявления, части API; с повторами)
+    bytes     байт тел ответов
+    seconds   секунд от начала обхода
+
+AUTOSPOT_CRAWL_BUDGETS = {'used': {'pages': 20}, '*': {'requests': 2000}}:
+ключ '*' действует на типы, для которых бюджет не задан отдельно.
+AUTOSPOT_CRAWL_SECONDS ограничивает весь обход. Когда бюджет типа
+исчерпан, Frontier больше не выдает его страницы списков, а
+BudgetMiddleware отбрасывает его запросы из очереди; когда исчерпаны все
+типы (или общее время), паук закрывается с причиной budget_<бюджет>, и
+конвейеры дописывают выгрузку как при обычном завершении.
+
+Выборка (AUTOSPOT_SAMPLE_PER_STRATUM = N): из списков берется не больше
+N объявлений на страту - марку из адреса объявления и, если задано в
+AUTOSPOT_SAMPLE_STRATA, город из карточки. С бюджетом страниц страницы
+списков при выборке берутся равномерно по всей пагинации, а не первые
+подряд, поэтому в выборку попадают и дорогие, и дешевые предложения:
+
+    python run_spider.py --sample 3 --max-pages 30 --format jsonl
+
+Ограниченный обход видит не все объявления, поэтому пропавшие
+объявления (инкрементальный режим) после него не ищутся.
+"""
+
+import logging
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+LIMITS = ('pages', 'requests', 'bytes', 'seconds')
+CAR_TYPES = ('used', 'new')
+
+
+def spread_pages(max_page, count):
+    """count страниц из 1..max_page, равномерно по пагинации, первая - всегда 1"""
+    if count >= max_page:
+        return list(range(1, max_page + 1))
+    if count <= 1:
+        return [1]
+    return sorted({1 + round(i * (max_page - 1) / (count - 1)) for i in range(count)})
+
+
+def stratum(url, card, strata):
+    """Ключ страты объявления: марка из адреса (/brands/<марка>/...) и поля карточки"""
+    key = []
+    for name in strata:
+        if name == 'brand':
+            parts = urlparse(url).path.strip('/').split('/')
+            key.append(parts[1] if len(parts) > 1 and parts[0] == 'brands' else '')
+        else:
+            key.append(str((card or {}).get(f'{name}_name') or (card or {}).get(name) or ''))
+    return tuple(key)
+
+
+class CrawlBudget:
+    """Учет расхода бюджетов по типам машин и квоты выборки по стратам"""
+
+    def __init__(self, crawler, budgets=None, seconds=0, sample=0, strata=('brand',), frontier=None):
+        self.crawler = crawler
+        budgets = budgets or {}
+        default = budgets.get('*', {})
+        self.budgets = {car_type: dict(default, **budgets.get(car_type, {})) for car_type in CAR_TYPES}
+        for budget in self.budgets.values():
+            unknown = set(budget) - set(LIMITS)
+            if unknown:
+                raise ValueError(f"Unknown crawl budget: {', '.join(sorted(unknown))}")
+        self.seconds = seconds
+        self.sample = sample
+        self.strata = tuple(strata)
+        self.frontier = frontier
+        self.spent = {car_type: Counter() for car_type in CAR_TYPES}
+        # Тип машин -> бюджет, который кончился
+        self.exhausted = {}
+        self.taken = Counter()
+        self.started = None
+        self._clock = None
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.response_downloaded, signal=signals.response_downloaded)
+
+    @classmethod
+    def from_crawler(cls, crawler, max_pages=None, frontier=None):
+        settings = crawler.settings
+        budgets = {car_type: dict(budget) for car_type, budget in settings.getdict('AUTOSPOT_CRAWL_BUDGETS').items()}
+        if max_pages:
+            # Аргумент паука max_pages (run_spider.py --max-pages) - страниц каждого типа
+            budgets.setdefault('*', {})['pages'] = int(max_pages)
+        return cls(
+            crawler,
+            budgets,
+            seconds=settings.getfloat('AUTOSPOT_CRAWL_SECONDS'),
+            sample=settings.getint('AUTOSPOT_SAMPLE_PER_STRATUM'),
+            strata=settings.getlist('AUTOSPOT_SAMPLE_STRATA') or ['brand'],
+            frontier=frontier
+        )
+
+    @property
+    def stats(self):
+        # crawler.stats появляется после создания паука
+        return self.crawler.stats
+
+    @property
+    def limited(self):
+        """Обход может пройти не все объявления"""
+        return bool(self.seconds or self.sample or any(self.budgets.values()))
+
+    @property
+    def needs_cards(self):
+        """Страты берутся не только из адреса, нужны карточки списков"""
+        return bool(self.sample) and any(name != 'brand' for name in self.strata)
+
+    def listing_pages(self, car_type, max_page):
+        """Страницы списка после первой в пределах бюджета страниц (None - все)"""
+        pages = self.budgets[car_type].get('pages')
+        if not pages:
+            return None
+        if self.sample:
+            selected = spread_pages(max_page, pages)
+        else:
+            selected = list(range(1, min(pages, max_page) + 1))
+        if len(selected) < max_page:
+            self.stats.set_value(f'budget/{car_type}/pages_skipped', max_page - len(selected))
+        return selected[1:]
+
+    def take(self, car_type, url, card=None):
+        """Брать ли объявление из списка: нет, если бюджет типа исчерпан или квота страты занята"""
+        if car_type in self.exhausted:
+            return False
+        if not self.sample:
+            return True
+        key = (car_type,) + stratum(url, card, self.strata)
+        if self.taken[key] >= self.sample:
+            self.stats.inc_value('sample/skipped')
+            return False
+        self.taken[key] += 1
+        self.stats.inc_value('sample/taken')
+        self.stats.set_value('sample/strata', len(self.taken))
+        return True
+
+    def allows(self, request):
+        car_type = request.meta.get('car_type')
+        return car_type not in self.exhausted
+
+    def response_downloaded(self, response, request, spider):
+        car_type = request.meta.get('car_type')
+        if car_type not in self.spent:
+            return
+        spent = self.spent[car_type]
+        spent['requests'] += 1
+        spent['bytes'] += len(response.body)
+        budget = self.budgets[car_type]
+        for limit in ('requests', 'bytes'):
+            if budget.get(limit) and spent[limit] >= budget[limit]:
+                self.exhaust(car_type, limit)
+
+    def exhaust(self, car_type, limit):
+        if car_type in self.exhausted:
+            return
+        self.exhausted[car_type] = limit
+        self.stats.set_value(f'budget/{car_type}/exhausted', limit)
+        logger.info("Crawl budget for %s cars exhausted: %s", car_type, limit)
+        if self.frontier is not None:
+            self.frontier.stop_streams(f'{car_type}:')
+        if all(car_type in self.exhausted for car_type in CAR_TYPES):
+            self.close(f'budget_{limit}')
+
+    def close(self, reason):
+        engine = self.crawler.engine
+        if engine is not None and engine.spider is not None:
+            engine.close_spider(engine.spider, reason)
+
+    def spider_opened(self, spider):
+        self.started = time.monotonic()
+        if self.seconds or any(budget.get('seconds') for budget in self.budgets.values()):
+            self._clock = task.LoopingCall(self.check_time)
+            self._clock.start(1.0, now=False)
+
+    def check_time(self):
+        elapsed = time.monotonic() - self.started
+        if self.seconds and elapsed >= self.seconds:
+            self._clock.stop()
+            self._clock = None
+            logger.info("Crawl time budget of %.0fs exhausted", self.seconds)
+            self.close('budget_seconds')
+            return
+        for car_type, budget in self.budgets.items():
+            if budget.get('seconds') and elapsed >= budget['seconds']:
+                self.exhaust(car_type, 'seconds')
+
+    def spider_closed(self, spider, reason):
+        if self._clock is not None and self._clock.running:
+            self._clock.stop()
+        for car_type, spent in self.spent.items():
+            for limit, value in spent.items():
+                self.stats.set_value(f'budget/{car_type}/{limit}', value)
+
+
+class BudgetMiddleware:
+    """Отбрасывает запросы типов машин, бюджет которых исчерпан (бюджет - spider.budget)"""
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        budget = getattr(spider, 'budget', None)
+        if budget is None or budget.allows(request):
+            return None
+        self.crawler.stats.inc_value('budget/dropped')
+        request.meta['budget_dropped'] = True
+        raise IgnoreRequest(f"Crawl budget exhausted for {request.meta.get('car_type')} cars")
@@ -0,0 +1,288 @@
+"""Справочник опций и характеристик с постоянными id и индекс для запросов
+
+Одни и те же несколько тысяч строк (группы опций, названия опций,
+названия характеристик) повторяются в каждом объявлении. Справочник
+присваивает им id при первой встрече и хранит их в SQLite
+(AUTOSPOT_CATALOG_FILE), так что id не меняются между обходами.
+CatalogPipeline заменяет в объявлениях:
+
+    options          -> отсортированный список id опций ('ids')
+                        или битовая маска в base64 ('bitmap')
+    characteristics  -> [[id характеристики, значение], ...]
+
+а в конце обхода выгружает справочник в AUTOSPOT_CATALOG_OUTPUT, чтобы
+объявления можно было раскодировать (Catalog.decode_options и
+Catalog.decode_characteristics).
+
+Заодно в том же файле ведется индекс: объявление -> город и опции, по
+которому отвечают на запросы без перечитывания выгрузки:
+
+    python -m autospot_scrapy.catalog query --option Климат-контроль --city Москва
+    python -m autospot_scrapy.catalog stats
+    python -m autospot_scrapy.catalog export -o catalog.json
+"""
+
+import argparse
+import base64
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS option_groups (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS options (
+        id INTEGER PRIMARY KEY,
+        group_id INTEGER,
+        name TEXT,
+        UNIQUE (group_id, name)
+    );
+    CREATE TABLE IF NOT EXISTS characteristic_keys (
+        id INTEGER PRIMARY KEY,
+        group_name TEXT,
+        name TEXT,
+        UNIQUE (group_name, name)
+    );
+    CREATE TABLE IF NOT EXISTS cars (
+        id INTEGER PRIMARY KEY,
+        url TEXT UNIQUE,
+        city TEXT,
+        brand TEXT,
+        model TEXT,
+        price INTEGER,
+        indexed_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS cars_city ON cars (city);
+    CREATE TABLE IF NOT EXISTS car_options (
+        option_id INTEGER,
+        car_id INTEGER,
+        PRIMARY KEY (option_id, car_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS car_options_car ON car_options (car_id);
+"""
+
+
+def encode_bitmap(ids):
+    """Множество id -> битовая маска (бит i - id i) в base64"""
+    mask = 0
+    for value in ids:
+        mask |= 1 << value
+    return base64.b64encode(mask.to_bytes((mask.bit_length() + 7) // 8, 'little')).decode('ascii')
+
+
+def decode_bitmap(text):
+    """Битовая маска в base64 -> отсортированный список id"""
+    mask = int.from_bytes(base64.b64decode(text), 'little')
+    ids = []
+    index = 0
+    while mask:
+        if mask & 1:
+            ids.append(index)
+        mask >>= 1
+        index += 1
+    return ids
+
+
+class Catalog:
+    """Словари групп опций, опций и характеристик плюс индекс объявлений"""
+
+    def __init__(self, path, commit_every=500):
+        self.path = path
+        self.commit_every = commit_every
+        self._pending = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.groups = dict(self.conn.execute("SELECT name, id FROM option_groups"))
+        self.options = {
+            (group_id, name): option_id
+            for option_id, group_id, name in self.conn.execute("SELECT id, group_id, name FROM options")
+        }
+        self.characteristics = {
+            (group_name, name): key_id
+            for key_id, group_name, name in self.conn.execute(
+                "SELECT id, group_name, name FROM characteristic_keys"
+            )
+        }
+        self.added = 0
+
+    def group_id(self, name):
+        group_id = self.groups.get(name)
+        if group_id is None:
+            group_id = self.groups[name] = self._insert(
+                "INSERT INTO option_groups (name) VALUES (?)", (name,)
+            )
+        return group_id
+
+    def option_id(self, group_name, name):
+        key = (self.group_id(group_name), name)
+        option_id = self.options.get(key)
+        if option_id is None:
+            option_id = self.options[key] = self._insert(
+                "INSERT INTO options (group_id, name) VALUES (?, ?)", key
+            )
+        return option_id
+
+    def characteristic_id(self, group_name, name):
+        key = (group_name, name)
+        key_id = self.characteristics.get(key)
+        if key_id is None:
+            key_id = self.characteristics[key] = self._insert(
+                "INSERT INTO characteristic_keys (group_name, name) VALUES (?, ?)", key
+            )
+        return key_id
+
+    def encode_options(self, options):
+        """[{'name': группа, 'list': [опция, ...]}, ...] -> отсортированные id опций"""
+        return sorted({
+            self.option_id(group.get('name', ''), name)
+            for group in options or ()
+            for name in group.get('list') or ()
+        })
+
+    def encode_characteristics(self, characteristics):
+        """[{'name': группа, 'list': [{'name', 'value'}, ...]}, ...] -> [[id, значение], ...]"""
+        return [
+            [self.characteristic_id(group.get('name', ''), entry.get('name', '')), entry.get('value')]
+            for group in characteristics or ()
+            for entry in group.get('list') or ()
+        ]
+
+    def decode_options(self, ids):
+        """Обратно к группам опций (в порядке id групп)"""
+        names = {option_id: key for key, option_id in self.options.items()}
+        group_names = {group_id: name for name, group_id in self.groups.items()}
+        groups = {}
+        for option_id in ids:
+            group_id, name = names[option_id]
+            groups.setdefault(group_id, []).append(name)
+        return [{'name': group_names[group_id], 'list': groups[group_id]} for group_id in sorted(groups)]
+
+    def decode_characteristics(self, pairs):
+        keys = {key_id: key for key, key_id in self.characteristics.items()}
+        groups = {}
+        for key_id, value in pairs:
+            group_name, name = keys[key_id]
+            groups.setdefault(group_name, []).append({'name': name, 'value': value})
+        return [{'name': name, 'list': entries} for name, entries in groups.items()]
+
+    def index_car(self, url, city, brand, model, price, option_ids, now=None):
+        """Запоминает город и опции объявления (заменяя прежние)"""
+        car_id = self.conn.execute("""
+            INSERT INTO cars (url, city, brand, model, price, indexed_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                city = excluded.city, brand = excluded.brand, model = excluded.model,
+                price = excluded.price, indexed_at = excluded.indexed_at
+            RETURNING id
+        """, (url, city, brand, model, price, now or time.time())).fetchone()[0]
+        self.conn.execute("DELETE FROM car_options WHERE car_id = ?", (car_id,))
+        self.conn.executemany(
+            "INSERT INTO car_options (option_id, car_id) VALUES (?, ?)",
+            [(option_id, car_id) for option_id in option_ids]
+        )
+        self._maybe_commit()
+
+    def remove_car(self, url):
+        row = self.conn.execute("DELETE FROM cars WHERE url = ? RETURNING id", (url,)).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM car_options WHERE car_id = ?", (row[0],))
+        self._maybe_commit()
+
+    def option_ids_by_name(self, name):
+        """Все id опций с таким названием (одно название бывает в разных группах)"""
+        return [option_id for (_, option_name), option_id in self.options.items() if option_name == name]
+
+    def query(self, options=(), city=None):
+        """Объявления, у которых есть все опции options (названия или id), в городе city"""
+        sql = "SELECT url, city, brand, model, price FROM cars"
+        conditions = []
+        params = []
+        for option in options:
+            ids = [option] if isinstance(option, int) else self.option_ids_by_name(option)
+            if not ids:
+                return []
+            conditions.append(
+                "id IN (SELECT car_id FROM car_options WHERE option_id IN (%s))" % ','.join('?' * len(ids))
+            )
+            params.extend(ids)
+        if city is not None:
+            conditions.append("city = ?")
+            params.append(city)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return self.conn.execute(sql + " ORDER BY url", params).fetchall()
+
+    def export(self):
+        """Справочник целиком, для выгрузки рядом с объявлениями"""
+        return {
+            'option_groups': {group_id: name for name, group_id in sorted(self.groups.items(), key=lambda x: x[1])},
+            'options': {
+                option_id: {'group_id': group_id, 'name': name}
+                for (group_id, name), option_id in sorted(self.options.items(), key=lambda x: x[1])
+            },
+            'characteristics': {
+                key_id: {'group': group_name, 'name': name}
+                for (group_name, name), key_id in sorted(self.characteristics.items(), key=lambda x: x[1])
+            },
+        }
+
+    def stats(self):
+        return {
+            'option_groups': len(self.groups),
+            'options': len(self.options),
+            'characteristics': len(self.characteristics),
+            'cars': self.conn.execute("SELECT COUNT(*) FROM cars").fetchone()[0],
+            'car_options': self.conn.execute("SELECT COUNT(*) FROM car_options").fetchone()[0],
+            'cities': dict(self.conn.execute(
+                "SELECT city, COUNT(*) FROM cars GROUP BY city ORDER BY COUNT(*) DESC"
+            ).fetchall()),
+        }
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def _insert(self, sql, params):
+        row_id = self.conn.execute(sql, params).lastrowid
+        self.added += 1
+        self._maybe_commit()
+        return row_id
+
+    def _maybe_commit(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.conn.commit()
+            self._pending = 0
+
+
+if __name__ == '__main__':
+    import json
+    from scrapy.utils.project import get_project_settings
+
+    from autospot_scrapy.utils import data_file
+
+    parser = argparse.ArgumentParser(description='Query the option catalog and car index')
+    parser.add_argument('command', choices=('query', 'stats', 'export'))
+    parser.add_argument('--option', action='append', default=[], help='Option name or id (repeat for AND)')
+    parser.add_argument('--city', help='City name')
+    parser.add_argument('--output', '-o', help='Export file (default: stdout)')
+    parser.add_argument('--file', help='Catalog file (default: AUTOSPOT_CATALOG_FILE)')
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    catalog = Catalog(data_file(args.file or settings.get('AUTOSPOT_CATALOG_FILE')))
+    if args.command == 'query':
+        options = [int(option) if option.isdigit() else option for option in args.option]
+        for url, city, brand, model, price in catalog.query(options, args.city):
+            print(f'{url}\t{city}\t{brand} {model}\t{price}')
+    elif args.command == 'stats':
+        print(json.dumps(catalog.stats(), ensure_ascii=False, indent=2))
+    elif args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(catalog.export(), f, ensure_ascii=False)
+    else:
+        print(json.dumps(catalog.export(), ensure_ascii=False, indent=2))
+    catalog.close()
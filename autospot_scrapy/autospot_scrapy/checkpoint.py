@@ -0,0 +1,211 @@
+"""Возобновляемый обход: состояние в каталоге задания
+
+Обход с DOWNLOAD_DELAY = 2 идет часами, и падение (OOM, kill,
+перезагрузка) раньше означало новый обход с нуля, а массив JSON в FEEDS
+оставался обрезанным. С AUTOSPOT_RESUME_DIR (run_spider.py --resume DIR)
+обход ведет в DIR/checkpoint.sqlite:
+
+    streams        пагинация каждого типа машин: страницы списков по порядку
+    listing_pages  страницы списков, разобранные целиком
+    cars           все объявления (путь страницы), уже выданные в загрузку:
+                   общий для запусков набор дедупликации и, пока done = 0,
+                   очередь незагруженных объявлений
+    chunks         зафиксированные шарды выгрузки
+
+Выгрузка идет шардами ShardedFeedPipeline по AUTOSPOT_RESUME_CHUNK_ITEMS
+объявлений (если размер шарда не задан иначе). Шард фиксируется так:
+файл .part дописан и сброшен на диск (fsync), затем одной транзакцией
+в checkpoint.sqlite записываются шард и его объявления (done = 1), и
+только потом .part переименовывается. Если процесс упал между
+транзакцией и переименованием, recover_chunks при следующем запуске
+доделает переименование; .part, которого нет в chunks, удаляется - его
+объявления не помечены и будут загружены снова. Так каждое объявление
+попадает в выгрузку ровно один раз.
+
+Повторный запуск с тем же каталогом продолжает задание: первые
+страницы списков - только если они не были разобраны, затем оставшиеся
+страницы каждого потока и все объявления с done = 0. Объявления из
+набора дедупликации со страниц списков второй раз не загружаются.
+Выгрузка продолжается под тем же префиксом и с теми же номерами шардов,
+токен лежит в DIR/token.json (TokenMiddleware сохраняет его сам).
+
+Объявления, которые не дали записи (304 инкрементального обхода, ошибка
+разбора), остаются с done = 0 и загружаются при каждом возобновлении.
+Задание, закончившееся с finish_reason = finished, не продолжается.
+
+    python run_spider.py --resume data/job --format jsonl
+    # ... kill ...
+    python run_spider.py --resume data/job --format jsonl
+"""
+
+import glob
+import json
+import logging
+import os
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    CREATE TABLE IF NOT EXISTS streams (
+        car_type TEXT PRIMARY KEY,
+        callback TEXT,
+        pages TEXT
+    );
+    CREATE TABLE IF NOT EXISTS listing_pages (
+        car_type TEXT,
+        page INTEGER,
+        PRIMARY KEY (car_type, page)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS cars (
+        url TEXT PRIMARY KEY,
+        car_type TEXT,
+        callback TEXT,
+        card_fingerprint TEXT,
+        done INTEGER DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS cars_pending ON cars (done);
+    CREATE TABLE IF NOT EXISTS chunks (
+        number INTEGER PRIMARY KEY,
+        path TEXT UNIQUE,
+        items INTEGER,
+        committed REAL
+    );
+"""
+
+
+def car_key(url):
+    """Ключ объявления в задании: путь и query, без домена (стаб или сайт)"""
+    parsed = urlparse(url)
+    return parsed.path + ('?' + parsed.query if parsed.query else '')
+
+
+class CrawlCheckpoint:
+    """Фронтир, набор дедупликации и зафиксированные шарды одного задания"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'checkpoint.sqlite')
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SCHEMA)
+        self.known = {url for url, in self.conn.execute("SELECT url FROM cars")}
+        # Задание уже запускалось: разобрана хотя бы одна страница списка
+        self.resumed = self.conn.execute("SELECT 1 FROM listing_pages LIMIT 1").fetchone() is not None
+
+    def __contains__(self, url):
+        return car_key(url) in self.known
+
+    def get_value(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_value(self, key, value):
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value))
+        )
+        self.conn.commit()
+
+    def output_path(self, path):
+        """Префикс шардов задания: сохраненный при первом запуске или path"""
+        saved = self.get_value('output_path')
+        if saved is None:
+            self.set_value('output_path', path)
+            return path
+        return saved
+
+    def add_stream(self, car_type, callback, pages):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO streams (car_type, callback, pages) VALUES (?, ?, ?)",
+            (car_type, callback, json.dumps(list(pages)))
+        )
+
+    def streams(self):
+        """(тип машин, колбэк, неразобранные страницы) каждого потока"""
+        done = {}
+        for car_type, page in self.conn.execute("SELECT car_type, page FROM listing_pages"):
+            done.setdefault(car_type, set()).add(page)
+        for car_type, callback, pages in self.conn.execute("SELECT car_type, callback, pages FROM streams"):
+            remaining = [page for page in json.loads(pages) if page not in done.get(car_type, ())]
+            yield car_type, callback, remaining
+
+    def listing_done(self, car_type, page):
+        """Страница списка разобрана: ее объявления уже в cars"""
+        self.conn.execute("INSERT OR IGNORE INTO listing_pages (car_type, page) VALUES (?, ?)", (car_type, page))
+        self.conn.commit()
+
+    def listing_is_done(self, car_type, page):
+        return self.conn.execute(
+            "SELECT 1 FROM listing_pages WHERE car_type = ? AND page = ?", (car_type, page)
+        ).fetchone() is not None
+
+    def add_car(self, url, car_type, callback, card_fingerprint=None):
+        """Запоминает объявление перед загрузкой (фиксируется вместе со страницей списка)"""
+        key = car_key(url)
+        self.known.add(key)
+        self.conn.execute(
+            "INSERT OR IGNORE INTO cars (url, car_type, callback, card_fingerprint) VALUES (?, ?, ?, ?)",
+            (key, car_type, callback, card_fingerprint)
+        )
+
+    def pending_cars(self):
+        """Объявления (путь, тип, колбэк, отпечаток карточки), еще не попавшие в зафиксированный шард"""
+        return self.conn.execute(
+            "SELECT url, car_type, callback, card_fingerprint FROM cars WHERE done = 0 ORDER BY rowid"
+        ).fetchall()
+
+    def counts(self):
+        done, total = self.conn.execute("SELECT COALESCE(SUM(done), 0), COUNT(*) FROM cars").fetchone()
+        return {
+            'cars': total,
+            'done': done,
+            'pending': total - done,
+            'listing_pages': self.conn.execute("SELECT COUNT(*) FROM listing_pages").fetchone()[0],
+            'chunks': self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0],
+        }
+
+    def last_chunk(self):
+        """Номер последнего зафиксированного шарда (0 - шардов нет)"""
+        return self.conn.execute("SELECT COALESCE(MAX(number), 0) FROM chunks").fetchone()[0]
+
+    def commit_chunk(self, number, path, urls, items, now=None):
+        """Фиксирует сброшенный на диск .part шарда вместе с его объявлениями"""
+        keys = [car_key(url) for url in urls]
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO chunks (number, path, items, committed) VALUES (?, ?, ?, ?)",
+                (number, path, items, now or time.time())
+            )
+            self.conn.executemany(
+                "INSERT INTO cars (url, done) VALUES (?, 1) ON CONFLICT (url) DO UPDATE SET done = 1",
+                [(key,) for key in keys]
+            )
+        self.known.update(keys)
+
+    def recover_chunks(self, prefix):
+        """Доделывает переименование зафиксированных шардов и удаляет незафиксированные .part"""
+        committed = {path for path, in self.conn.execute("SELECT path FROM chunks")}
+        renamed = removed = 0
+        for path in committed:
+            if not os.path.exists(path) and os.path.exists(path + '.part'):
+                os.replace(path + '.part', path)
+                renamed += 1
+        for part in glob.glob(glob.escape(prefix) + '-*.part'):
+            if part[:-len('.part')] not in committed:
+                os.remove(part)
+                removed += 1
+        if renamed or removed:
+            logger.info("Recovered output chunks: %d renamed, %d uncommitted removed", renamed, removed)
+        return renamed, removed
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,158 @@
+"""Кэш конфигураций: общие характеристики и опции объявлений
+
+Одна и та же модель в одной комплектации продается многими дилерами, и у
+всех этих объявлений одинаковые тела car/all-characteristics и
+car/all-options-two-column (у подержанных - used-car/options-two-column).
+ConfigurationCache обрабатывает каждое такое тело один раз: повторное
+объявление получает уже готовые (для CarRecord - уже упакованные) списки,
+общие для всех объявлений этой конфигурации.
+
+Ключ тела - хэш его содержимого, что всегда безопасно. Если для эндпоинта
+заданы поля-идентификаторы (AUTOSPOT_CONFIG_KEY_FIELDS, например
+{'car/all-characteristics': ['model_id', 'complectation_id']}) и все они
+есть в основных данных объявления (car/base-info, v2/used-car/cars),
+ключом становятся они: хэшировать тело не нужно, а в режиме API уже
+известную часть объявления можно не загружать. Идентификаторы должны
+однозначно определять тело: у записанных подержанных машин кузов,
+двигатель и год определяют характеристики (кроме единичных случаев), но
+не опции.
+
+Кэш включается AUTOSPOT_CONFIG_CACHE_ENABLED (run_spider.py --config-cache):
+хэш тела стоит дороже, чем разбор опций, и окупается только на повторах.
+Память ограничена: AUTOSPOT_CONFIG_CACHE_SIZE последних тел каждого
+эндпоинта (LRU). С AUTOSPOT_CONFIG_REFS объявление вместо характеристик
+и опций хранит id конфигурации (поле configuration), а сама конфигурация
+выгружается один раз отдельной записью AutospotConfigurationItem.
+
+В статистике обхода: configs/hits, configs/misses, configs/hit_rate,
+configs/evictions, configs/skipped_fetches, configs/records (выгружено
+записей конфигураций) и configs/saved_seconds - время обработки,
+сэкономленное попаданиями, за вычетом затрат на ключи.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from scrapy import signals
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def payload_digest(body):
+    """Хэш тела ответа (128 бит): ключ конфигурации по содержимому"""
+    if orjson is not None:
+        data = orjson.dumps(body)
+    else:
+        data = json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class ConfigurationCache:
+    """LRU обработанных тел конфигураций по эндпоинтам"""
+
+    def __init__(self, crawler=None, max_entries=2048, key_fields=None):
+        self.crawler = crawler
+        self.max_entries = max_entries
+        self.key_fields = {path: tuple(fields) for path, fields in (key_fields or {}).items() if fields}
+        # Эндпоинт -> OrderedDict ключ -> (id, обработанное тело)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped_fetches = 0
+        self.build_seconds = 0.0
+        self.key_seconds = 0.0
+        if crawler is not None:
+            crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            crawler,
+            max_entries=settings.getint('AUTOSPOT_CONFIG_CACHE_SIZE'),
+            key_fields=settings.getdict('AUTOSPOT_CONFIG_KEY_FIELDS')
+        )
+
+    def _id_key(self, path, car_data):
+        fields = self.key_fields.get(path)
+        if not fields or not car_data:
+            return None
+        values = tuple(car_data.get(field) for field in fields)
+        if any(value is None for value in values):
+            return None
+        return values
+
+    def get(self, path, body, car_data, build):
+        """(id, build(body)) - из кэша, если такое тело уже встречалось"""
+        started = time.perf_counter()
+        key = self._id_key(path, car_data)
+        if key is None:
+            key = payload_digest(body)
+        entries = self.entries.setdefault(path, OrderedDict())
+        entry = entries.get(key)
+        self.key_seconds += time.perf_counter() - started
+        if entry is not None:
+            entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        started = time.perf_counter()
+        value = build(body)
+        self.build_seconds += time.perf_counter() - started
+        self.misses += 1
+        entry = entries[key] = (self._entry_id(key), value)
+        if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def cached(self, path, car_data):
+        """Запись эндпоинта по идентификаторам объявления или None (тело тогда не нужно)"""
+        key = self._id_key(path, car_data)
+        entry = self.entries.get(path, {}).get(key) if key is not None else None
+        if entry is not None:
+            self.entries[path].move_to_end(key)
+            self.hits += 1
+            self.skipped_fetches += 1
+        return entry
+
+    def _entry_id(self, key):
+        if isinstance(key, bytes):
+            return key[:8].hex()
+        return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).hexdigest()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def saved_seconds(self):
+        """Обработка, которой избежали попадания, минус время на вычисление ключей"""
+        if not self.misses:
+            return 0.0
+        return self.hits * self.build_seconds / self.misses - self.key_seconds
+
+    def spider_closed(self, spider, reason):
+        stats = self.crawler.stats
+        stats.set_value('configs/hits', self.hits)
+        stats.set_value('configs/misses', self.misses)
+        stats.set_value('configs/hit_rate', round(self.hit_rate, 3))
+        stats.set_value('configs/evictions', self.evictions)
+        stats.set_value('configs/skipped_fetches', self.skipped_fetches)
+        stats.set_value('configs/saved_seconds', round(self.saved_seconds, 3))
+        if getattr(spider, 'emitted_configurations', None):
+            stats.set_value('configs/records', len(spider.emitted_configurations))
+        logger.info(
+            "Configuration cache: %d hits, %d misses (%.0f%% hit rate), saved %.2fs",
+            self.hits, self.misses, self.hit_rate * 100, self.saved_seconds
+        )
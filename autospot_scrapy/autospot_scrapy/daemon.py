@@ -0,0 +1,306 @@
+"""Режим службы: обходы по расписанию в одном долгоживущем процессе
+
+Запуск run_spider.py из cron каждый раз платит за старт интерпретатора и
+импорт Scrapy, а обход начинается с холодными соединениями и DNS. Реактор
+Twisted нельзя перезапустить, поэтому CrawlDaemon запускает циклы через
+CrawlerRunner внутри одного реактора:
+
+    python run_spider.py --daemon --interval 3600 --control-port 6080 --format jsonl
+
+Между циклами остаются теплыми импортированный код, кэш DNS (CrawlerRunner
+сам резолвер не ставит, его ставит run_spider.run_daemon через
+transport.install_dns_cache), пул HTTP-соединений
+(WarmHTTP11DownloadHandler: загрузчик каждого цикла берет общий пул и не
+закрывает его), токен (TokenMiddleware перечитывает файл
+токена, а не главную страницу), страницы SQLite-файлов кэша, справочника и
+SeenStore в памяти ОС. Каждый цикл пишет свою выгрузку и свой лог: в
+именах подставляется время начала цикла.
+
+Управление - HTTP на AUTOSPOT_DAEMON_CONTROL_PORT (только localhost):
+
+    curl localhost:6080/status
+    curl -X POST localhost:6080/trigger     # цикл сейчас
+    curl -X POST localhost:6080/pause       # пропускать циклы по расписанию
+    curl -X POST localhost:6080/resume
+    curl -X POST localhost:6080/stop        # остановить цикл и службу
+"""
+
+import json
+import logging
+import signal
+import time
+from datetime import datetime
+
+from scrapy.crawler import Crawler, CrawlerRunner
+from scrapy.utils.ossignal import install_shutdown_handlers, signal_names
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from autospot_scrapy.transport import PooledHTTP11DownloadHandler
+
+logger = logging.getLogger(__name__)
+
+WARM_HANDLER = 'autospot_scrapy.daemon.WarmHTTP11DownloadHandler'
+# Сколько последних циклов показывать в /status
+HISTORY_SIZE = 20
+
+
+class WarmHTTP11DownloadHandler(PooledHTTP11DownloadHandler):
+    """HTTP(S)-загрузчик с одним пулом соединений на все циклы процесса"""
+
+    pool = None
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        if WarmHTTP11DownloadHandler.pool is None:
+            WarmHTTP11DownloadHandler.pool = self._pool
+        # Новый пул еще пуст, его можно просто бросить
+        self._pool = WarmHTTP11DownloadHandler.pool
+        # Новые соединения считаются в статистике текущего цикла
+        self._pool.stats = self.stats
+
+    def close(self):
+        self.record_stats()
+        if self.h2 is not None:
+            self.h2.close()
+        # Соединения ждут следующего цикла; пул закрывает close_pool при остановке службы
+        return defer.succeed(None)
+
+    @classmethod
+    def cached_connections(cls):
+        if cls.pool is None:
+            return 0
+        return sum(len(connections) for connections in cls.pool._connections.values())
+
+    @classmethod
+    def close_pool(cls):
+        if cls.pool is None:
+            return defer.succeed(None)
+        pool, cls.pool = cls.pool, None
+        return pool.closeCachedConnections()
+
+
+class CrawlDaemon:
+    """Циклы обхода по расписанию в одном реакторе
+
+    settings_factory(stamp) возвращает настройки цикла, начатого в stamp
+    (выгрузка и лог с этим временем в имени); spider_kwargs передаются пауку.
+    """
+
+    def __init__(self, spidercls, settings_factory, interval=3600, control_port=0, control_host='127.0.0.1',
+                 max_cycles=0, warm_pool=True, spider_kwargs=None):
+        self.spidercls = spidercls
+        self.settings_factory = settings_factory
+        self.interval = interval
+        self.control_port = control_port
+        self.control_host = control_host
+        self.max_cycles = max_cycles
+        self.warm_pool = warm_pool
+        self.spider_kwargs = spider_kwargs or {}
+        self.runner = CrawlerRunner()
+        self.cycle = 0
+        self.paused = False
+        self.stopping = False
+        self.crawler = None
+        self.current = None
+        self.history = []
+        self._next_call = None
+        self._listening = None
+
+    @property
+    def state(self):
+        if self.stopping:
+            return 'stopping'
+        if self.crawler is not None:
+            return 'running'
+        return 'paused' if self.paused else 'idle'
+
+    def run(self):
+        """Запускает реактор: первый цикл сразу, дальше каждые interval секунд"""
+        from twisted.internet import reactor
+
+        install_shutdown_handlers(self._signal_shutdown)
+        if self.control_port:
+            self._listening = reactor.listenTCP(
+                self.control_port, Site(ControlResource(self)), interface=self.control_host
+            )
+            logger.info("Daemon control endpoint on http://%s:%d/status",
+                        self.control_host, self._listening.getHost().port)
+        reactor.callWhenRunning(self.start_cycle, 'startup')
+        reactor.run(installSignalHandlers=False)
+
+    def start_cycle(self, reason='schedule'):
+        """Начинает цикл; False, если цикл уже идет или служба останавливается"""
+        self._next_call = None
+        if self.crawler is not None or self.stopping:
+            return False
+        if self.paused and reason == 'schedule':
+            logger.info("Daemon is paused, skipping scheduled cycle")
+            self._schedule(time.time())
+            return False
+        self._cancel_next()
+        self.cycle += 1
+        started = time.time()
+        stamp = datetime.fromtimestamp(started).strftime('%Y-%m-%d_%H-%M-%S')
+        settings = self.settings_factory(stamp)
+        if self.warm_pool:
+            settings.set('DOWNLOAD_HANDLERS', {'http': WARM_HANDLER, 'https': WARM_HANDLER}, priority='cmdline')
+        self.current = {
+            'cycle': self.cycle,
+            'reason': reason,
+            'started_at': started,
+            'log': settings.get('LOG_FILE'),
+            'output': next(iter(settings.getdict('FEEDS')), None) or settings.get('AUTOSPOT_OUTPUT_PATH'),
+        }
+        logger.info("Starting cycle %d (%s), log %s", self.cycle, reason, self.current['log'])
+        self.crawler = Crawler(self.spidercls, settings)
+        deferred = self.runner.crawl(self.crawler, **self.spider_kwargs)
+        deferred.addBoth(self._cycle_finished)
+        return True
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        if self.crawler is None and self._next_call is None and not self.stopping:
+            self._schedule(self.history[-1]['started_at'] if self.history else time.time())
+
+    def stop(self):
+        """Останавливает текущий цикл (как по Ctrl-C) и службу"""
+        if self.stopping:
+            return
+        self.stopping = True
+        self._cancel_next()
+        if self.crawler is not None:
+            logger.info("Stopping cycle %d", self.cycle)
+            self.crawler.stop()
+        else:
+            self._shutdown()
+
+    def status(self):
+        current = None
+        if self.crawler is not None:
+            stats = self.crawler.stats.get_stats() if self.crawler.stats else {}
+            current = dict(
+                self.current,
+                seconds=round(time.time() - self.current['started_at'], 1),
+                items=stats.get('item_scraped_count', 0),
+                requests=stats.get('downloader/request_count', 0),
+            )
+        return {
+            'state': self.state,
+            'cycles': self.cycle,
+            'interval': self.interval,
+            'current': current,
+            'next_run_in': round(self._next_call.getTime() - time.time(), 1) if self._next_call else None,
+            'cached_connections': WarmHTTP11DownloadHandler.cached_connections(),
+            'history': self.history,
+        }
+
+    def control(self, action):
+        """Команда управления: (HTTP-код, ответ)"""
+        if action == 'trigger':
+            if not self.start_cycle('trigger'):
+                return 409, {'error': f'cannot start a cycle while {self.state}'}
+        elif action == 'pause':
+            self.pause()
+        elif action == 'resume':
+            self.resume()
+        elif action == 'stop':
+            self.stop()
+        else:
+            return 404, {'error': f'unknown action: {action}'}
+        return 200, {'state': self.state, 'cycles': self.cycle}
+
+    def _cycle_finished(self, result):
+        crawler, self.crawler = self.crawler, None
+        stats = crawler.stats.get_stats() if crawler.stats else {}
+        finished = time.time()
+        summary = dict(
+            self.current,
+            finished_at=finished,
+            seconds=round(finished - self.current['started_at'], 1),
+            finish_reason=stats.get('finish_reason'),
+            items=stats.get('item_scraped_count', 0),
+            requests=stats.get('downloader/request_count', 0),
+            token_fetches=stats.get('token/fetch_count', 0),
+        )
+        if isinstance(result, Failure):
+            summary['error'] = result.getErrorMessage()
+            logger.error("Cycle %d failed: %s", self.cycle, summary['error'],
+                         exc_info=(result.type, result.value, result.getTracebackObject()))
+        self.history = (self.history + [summary])[-HISTORY_SIZE:]
+        self.current = None
+        logger.info("Cycle %d finished in %.1fs: %s, %d items",
+                    summary['cycle'], summary['seconds'], summary['finish_reason'], summary['items'])
+        if self.max_cycles and self.cycle >= self.max_cycles:
+            self.stopping = True
+        if self.stopping:
+            self._shutdown()
+        elif self._next_call is None:
+            self._schedule(summary['started_at'])
+
+    def _schedule(self, last_started):
+        """Следующий цикл через interval после начала предыдущего (сразу, если цикл затянулся)"""
+        from twisted.internet import reactor
+
+        delay = max(0.0, last_started + self.interval - time.time())
+        self._next_call = reactor.callLater(delay, self.start_cycle, 'schedule')
+        logger.info("Next cycle in %.0fs", delay)
+
+    def _cancel_next(self):
+        if self._next_call is not None and self._next_call.active():
+            self._next_call.cancel()
+        self._next_call = None
+
+    def _shutdown(self):
+        from twisted.internet import reactor
+
+        if self._listening is not None:
+            self._listening.stopListening()
+            self._listening = None
+        deferred = WarmHTTP11DownloadHandler.close_pool()
+        deferred.addBoth(lambda _: reactor.stop())
+        logger.info("Daemon stopped after %d cycles", self.cycle)
+
+    def _signal_shutdown(self, signum, _):
+        from twisted.internet import reactor
+
+        install_shutdown_handlers(self._signal_kill)
+        logger.info("Received %s, stopping daemon", signal_names[signum])
+        reactor.callFromThread(self.stop)
+
+    def _signal_kill(self, signum, _):
+        from twisted.internet import reactor
+
+        install_shutdown_handlers(signal.SIG_IGN)
+        logger.info("Received %s twice, forcing unclean shutdown", signal_names[signum])
+        reactor.callFromThread(reactor.stop)
+
+
+class ControlResource(Resource):
+    """GET /status - состояние службы, POST /trigger|pause|resume|stop - команды"""
+
+    isLeaf = True
+
+    def __init__(self, daemon):
+        super().__init__()
+        self.daemon = daemon
+
+    def render_GET(self, request):
+        if request.path.strip(b'/') not in (b'', b'status'):
+            return self._json(request, 404, {'error': 'not found'})
+        return self._json(request, 200, self.daemon.status())
+
+    def render_POST(self, request):
+        code, body = self.daemon.control(request.path.strip(b'/').decode('ascii', 'replace'))
+        return self._json(request, code, body)
+
+    @staticmethod
+    def _json(request, code, body):
+        request.setResponseCode(code)
+        request.setHeader(b'Content-Type', b'application/json; charset=utf-8')
+        return json.dumps(body, ensure_ascii=False, default=str).encode('utf-8')
@@ -0,0 +1,489 @@
+"""Распределенный обход: общая очередь запросов для нескольких процессов
+
+Общая очередь - файл SQLite (WAL), доступный всем воркерам (на одной
+машине или на общем диске). SharedQueueScheduler подменяет планировщик
+Scrapy: страницы списков и объявлений, которые выдает паук, уходят в
+очередь с дедупликацией по отпечатку запроса, а воркер берет из нее
+задачи в аренду (lease) пачками по AUTOSPOT_QUEUE_LEASE_BATCH. Задача
+считается выполненной, когда колбэк отдал все результаты
+(DistributedMiddleware); при ошибке или если аренда истекла (воркер
+упал), задача возвращается в очередь, но не больше
+AUTOSPOT_QUEUE_MAX_ATTEMPTS раз. Токен, повторы и цепочки запросов к API
+с накопленным состоянием остаются в памяти воркера.
+
+Каждый воркер - обычный run_spider.py со своими шардами JSON Lines;
+координатор запускает воркеры, ждет их и сводит шарды и статистику:
+
+    python -m autospot_scrapy.distributed crawl --workers 4 --dir data/distributed
+    python -m autospot_scrapy.distributed status --dir data/distributed
+    python -m autospot_scrapy.distributed merge --dir data/distributed
+    python -m autospot_scrapy.distributed recover --dir data/distributed
+
+Воркеры на других машинах запускаются вручную:
+
+    python run_spider.py --queue /shared/queue.sqlite --worker host2 --format jsonl -o /shared/host2
+"""
+
+import argparse
+import glob
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from scrapy import signals
+from scrapy.core.scheduler import BaseScheduler
+from scrapy.exceptions import NotConfigured
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.request import request_from_dict
+
+from autospot_scrapy.utils import request_kind
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# Типы запросов, которые делятся между воркерами
+SHARED_KINDS = ('list', 'detail')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY,
+        key TEXT UNIQUE,
+        kind TEXT,
+        priority INTEGER,
+        request BLOB,
+        state TEXT DEFAULT 'pending',
+        worker TEXT,
+        lease_until REAL,
+        attempts INTEGER DEFAULT 0,
+        added_at REAL,
+        done_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, priority DESC, id);
+    CREATE TABLE IF NOT EXISTS workers (
+        name TEXT PRIMARY KEY,
+        started_at REAL,
+        finished_at REAL,
+        stats TEXT
+    );
+"""
+
+
+class SharedQueue:
+    """Очередь задач в SQLite: дедупликация по ключу, аренда с истечением"""
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Автокоммит: каждая запись сразу видна другим воркерам
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def push(self, key, kind, priority, request, now=None):
+        """Добавляет задачу; False, если задача с таким ключом уже была"""
+        cursor = self.conn.execute("""
+            INSERT OR IGNORE INTO tasks (key, kind, priority, request, added_at) VALUES (?, ?, ?, ?, ?)
+        """, (key, kind, priority, request, now or time.time()))
+        return cursor.rowcount > 0
+
+    def lease(self, worker, limit, now=None):
+        """Берет в аренду до limit задач с наибольшим приоритетом: [(ключ, запрос)]"""
+        now = now or time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Аренды упавших воркеров возвращаются в очередь
+            self.conn.execute("""
+                UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, worker = NULL
+                WHERE state = 'leased' AND lease_until < ?
+            """, (self.max_attempts, now))
+            rows = self.conn.execute("""
+                SELECT id, key, request FROM tasks WHERE state = 'pending'
+                ORDER BY priority DESC, id LIMIT ?
+            """, (limit,)).fetchall()
+            self.conn.executemany("""
+                UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1
+                WHERE id = ?
+            """, [(worker, now + self.lease_seconds, row[0]) for row in rows])
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return [(key, request) for _, key, request in rows]
+
+    def complete(self, key, now=None):
+        # worker остается в строке: по нему requeue_worker находит задачи упавшего воркера
+        self.conn.execute(
+            "UPDATE tasks SET state = 'done', done_at = ?, lease_until = NULL WHERE key = ?",
+            (now or time.time(), key)
+        )
+
+    def fail(self, key, final=False):
+        """Возвращает задачу в очередь (или помечает failed после max_attempts попыток)"""
+        self.conn.execute("""
+            UPDATE tasks SET state = CASE WHEN ? OR attempts >= ? THEN 'failed' ELSE 'pending' END,
+                             worker = NULL, lease_until = NULL
+            WHERE key = ? AND state = 'leased'
+        """, (final, self.max_attempts, key))
+
+    def release(self, worker):
+        """Возвращает в очередь задачи, которые воркер взял, но не выполнил (остановка по лимиту)"""
+        cursor = self.conn.execute("""
+            UPDATE tasks SET state = 'pending', worker = NULL, lease_until = NULL, attempts = attempts - 1
+            WHERE state = 'leased' AND worker = ?
+        """, (worker,))
+        return cursor.rowcount
+
+    def requeue_worker(self, worker):
+        """Возвращает в очередь все задачи упавшего воркера, включая выполненные
+
+        Объявления выполненных задач могли остаться в недописанном шарде
+        (.part), поэтому такие страницы загружаются заново; повторы url в
+        готовых шардах убирает merge.
+        """
+        cursor = self.conn.execute("""
+            UPDATE tasks SET state = 'pending', worker = NULL, lease_until = NULL, attempts = 0, done_at = NULL
+            WHERE worker = ? AND state IN ('leased', 'done')
+        """, (worker,))
+        self.conn.execute("DELETE FROM workers WHERE name = ?", (worker,))
+        return cursor.rowcount
+
+    def crashed_workers(self):
+        """Воркеры, которые начали обход и не записали статистику"""
+        return [row[0] for row in self.conn.execute("SELECT name FROM workers WHERE finished_at IS NULL")]
+
+    def unfinished(self):
+        """Задачи, которые еще ждут или выполняются"""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE state IN ('pending', 'leased')"
+        ).fetchone()[0]
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def register_worker(self, name, now=None):
+        self.conn.execute("""
+            INSERT INTO workers (name, started_at) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET started_at = excluded.started_at, finished_at = NULL
+        """, (name, now or time.time()))
+
+    def finish_worker(self, name, stats, now=None):
+        self.conn.execute(
+            "UPDATE workers SET finished_at = ?, stats = ? WHERE name = ?",
+            (now or time.time(), json.dumps(stats, default=str), name)
+        )
+
+    def workers(self):
+        return {
+            name: {'started_at': started, 'finished_at': finished, 'stats': json.loads(stats) if stats else None}
+            for name, started, finished, stats in self.conn.execute(
+                "SELECT name, started_at, finished_at, stats FROM workers ORDER BY name"
+            )
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+class SharedQueueScheduler(BaseScheduler):
+    """Планировщик Scrapy поверх SharedQueue
+
+    Запросы списков и объявлений уходят в общую очередь, остальные
+    (токен, повторы арендованных задач, продолжения цепочек API)
+    остаются в локальной очереди с приоритетами.
+    """
+
+    def __init__(self, crawler, queue, worker, lease_batch=4, poll_interval=1.0):
+        self.crawler = crawler
+        self.queue = queue
+        self.worker = worker
+        self.lease_batch = lease_batch
+        self.poll_interval = poll_interval
+        self.spider = None
+        self.local = []
+        self._order = itertools.count()
+        self._unfinished = True
+        self._checked_at = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        path = settings.get('AUTOSPOT_QUEUE_FILE')
+        if not path:
+            raise ValueError("SharedQueueScheduler needs AUTOSPOT_QUEUE_FILE")
+        queue = SharedQueue(
+            path,
+            lease_seconds=settings.getint('AUTOSPOT_QUEUE_LEASE_SECONDS', 300),
+            max_attempts=settings.getint('AUTOSPOT_QUEUE_MAX_ATTEMPTS', 3)
+        )
+        worker = settings.get('AUTOSPOT_WORKER_NAME') or f'{socket.gethostname()}-{os.getpid()}'
+        return cls(crawler, queue, worker, lease_batch=settings.getint('AUTOSPOT_QUEUE_LEASE_BATCH', 4))
+
+    def open(self, spider):
+        self.spider = spider
+        self.queue.register_worker(self.worker)
+        self.crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        logger.info("Worker %s uses shared queue %s", self.worker, self.queue.path)
+
+    def close(self, reason):
+        released = self.queue.release(self.worker)
+        if released:
+            self.crawler.stats.set_value('distributed/released', released)
+        logger.info("Worker %s finished (%s), queue: %s", self.worker, reason, self.queue.counts())
+
+    def spider_closed(self, spider, reason):
+        # Обработчик подключен позже статистики Scrapy - finish_reason уже записан
+        self.queue.finish_worker(self.worker, self.crawler.stats.get_stats())
+        self.queue.close()
+
+    def __len__(self):
+        return len(self.local)
+
+    def has_pending_requests(self):
+        if self.local:
+            return True
+        # Пока в очереди есть задачи (и аренды других воркеров, которые могут
+        # вернуться), воркер не закрывается; COUNT не чаще poll_interval
+        now = time.monotonic()
+        if now - self._checked_at >= self.poll_interval:
+            self._checked_at = now
+            self._unfinished = self.queue.unfinished() > 0
+        return self._unfinished
+
+    def enqueue_request(self, request):
+        stats = self.crawler.stats
+        if self._is_shared(request):
+            key = self.crawler.request_fingerprinter.fingerprint(request).hex()
+            data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+            if not self.queue.push(key, request_kind(request), request.priority, data):
+                stats.inc_value('distributed/duplicates')
+                return False
+            self._unfinished = True
+            stats.inc_value('distributed/pushed')
+            return True
+        heapq.heappush(self.local, (-request.priority, next(self._order), request))
+        stats.inc_value('distributed/local')
+        return True
+
+    def next_request(self):
+        if not self.local:
+            leased = self.queue.lease(self.worker, self.lease_batch)
+            for key, data in leased:
+                request = request_from_dict(pickle.loads(data), spider=self.spider)
+                request.meta['queue_key'] = key
+                heapq.heappush(self.local, (-request.priority, next(self._order), request))
+            if leased:
+                self.crawler.stats.inc_value('distributed/leased', len(leased))
+        if not self.local:
+            return None
+        return heapq.heappop(self.local)[2]
+
+    def complete(self, request):
+        key = request.meta.get('queue_key')
+        if key:
+            self.queue.complete(key)
+            self.crawler.stats.inc_value('distributed/completed')
+
+    def fail(self, request, final=False):
+        key = request.meta.get('queue_key')
+        if key:
+            self.queue.fail(key, final=final)
+            self.crawler.stats.inc_value('distributed/failed')
+
+    def _is_shared(self, request):
+        # Арендованная задача (повтор, редирект) остается у этого воркера;
+        # продолжения цепочки API несут накопленное состояние в cb_kwargs
+        if 'queue_key' in request.meta or request.cb_kwargs.get('state'):
+            return False
+        return request_kind(request) in SHARED_KINDS
+
+
+class DistributedMiddleware:
+    """Отмечает задачи общей очереди выполненными или неудачными
+
+    Подключается и как middleware паука (колбэк отработал или упал), и как
+    middleware загрузчика (ошибка загрузки после всех повторов).
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get('AUTOSPOT_QUEUE_FILE'):
+            raise NotConfigured
+        return cls(crawler)
+
+    @property
+    def scheduler(self):
+        scheduler = self.crawler.engine.slot.scheduler
+        return scheduler if isinstance(scheduler, SharedQueueScheduler) else None
+
+    def process_spider_output(self, response, result, spider):
+        yield from result
+        self._complete(response.request)
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for output in result:
+            yield output
+        self._complete(response.request)
+
+    def process_spider_exception(self, response, exception, spider):
+        if self.scheduler is not None:
+            # Ответ с кодом ошибки повторять незачем - RetryMiddleware уже пробовал
+            self.scheduler.fail(response.request, final=isinstance(exception, HttpError))
+
+    def process_exception(self, request, exception, spider):
+        if self.scheduler is not None:
+            self.scheduler.fail(request)
+
+    def _complete(self, request):
+        if self.scheduler is not None and request is not None:
+            self.scheduler.complete(request)
+
+
+def _read_lines(path):
+    if path.endswith('.zst'):
+        with open(path, 'rb') as f:
+            data = zstandard.ZstdDecompressor().stream_reader(f).read()
+    elif path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            data = f.read()
+    else:
+        with open(path, 'rb') as f:
+            data = f.read()
+    return data.splitlines()
+
+
+def merge_stats(workers):
+    """Суммы счетчиков по воркерам; пики, максимумы и время - максимум"""
+    totals = {}
+    for worker in workers.values():
+        for key, value in (worker['stats'] or {}).items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or key.endswith('/avg_ms'):
+                continue
+            if 'max' in key or 'peak' in key or key.endswith('_ms') or key.endswith('seconds'):
+                totals[key] = max(totals.get(key, value), value)
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return dict(sorted(totals.items()))
+
+
+def merge(directory, queue_path=None, output='merged.jsonl'):
+    """Сводит шарды воркеров в один JSON Lines (без повторов по url) и статистику в stats.json"""
+    queue_path = queue_path or os.path.join(directory, 'queue.sqlite')
+    shards = sorted(
+        path for path in glob.glob(os.path.join(directory, '*-[0-9][0-9][0-9][0-9][0-9].jsonl*'))
+        if not path.endswith('.part')
+    )
+    seen = set()
+    items = duplicates = 0
+    merged_path = os.path.join(directory, output)
+    with open(merged_path + '.part', 'wb') as f:
+        for shard in shards:
+            for line in _read_lines(shard):
+                url = json.loads(line).get('url')
+                if url in seen:
+                    duplicates += 1
+                    continue
+                seen.add(url)
+                f.write(line + b'\n')
+                items += 1
+    os.replace(merged_path + '.part', merged_path)
+
+    queue = SharedQueue(queue_path)
+    workers = queue.workers()
+    report = {
+        'items': items,
+        'duplicates': duplicates,
+        'shards': len(shards),
+        'queue': queue.counts(),
+        'totals': merge_stats(workers),
+        'workers': workers,
+    }
+    queue.close()
+    with open(os.path.join(directory, 'stats.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    logger.info("Merged %d items from %d shards into %s (%d duplicates)", items, len(shards), merged_path, duplicates)
+    return report
+
+
+def recover(queue_path):
+    """Возвращает в очередь задачи воркеров, не завершивших обход; воркеры должны быть остановлены"""
+    queue = SharedQueue(queue_path)
+    for worker in queue.crashed_workers():
+        logger.warning("Worker %s did not finish, requeued %d tasks", worker, queue.requeue_worker(worker))
+    queue.close()
+
+
+def crawl(workers, directory, extra_args=()):
+    """Запускает workers воркеров run_spider.py на общей очереди и сводит результат
+
+    Если каталог уже использовался, обход продолжается: выполненные задачи
+    не повторяются, а задачи упавших в прошлый раз воркеров перезапускаются.
+    """
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    queue_path = os.path.join(directory, 'queue.sqlite')
+    recover(queue_path)
+    processes = []
+    for number in range(1, workers + 1):
+        name = f'w{number}'
+        processes.append(subprocess.Popen([
+            sys.executable, str(PROJECT_DIR / 'run_spider.py'),
+            '--queue', queue_path, '--worker', name,
+            '--format', 'jsonl', '--compression', 'zstd',
+            '--output', os.path.join(directory, name),
+            '--log', os.path.join(directory, f'{name}.log'),
+            *extra_args
+        ], cwd=PROJECT_DIR))
+    codes = [process.wait() for process in processes]
+    if any(codes):
+        logger.warning("Some workers failed: %s", codes)
+    return merge(directory, queue_path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(name)s] %(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description='Distributed crawl over a shared SQLite queue')
+    parser.add_argument('command', choices=('crawl', 'status', 'merge', 'recover'))
+    parser.add_argument('--dir', required=True, help='Run directory: queue, shards, logs and merged output')
+    parser.add_argument('--workers', type=int, default=2, help='Number of local workers (for crawl)')
+    parser.add_argument('--set', '-s', action='append', default=[], metavar='NAME=VALUE',
+                        help='Setting passed to every worker')
+    args = parser.parse_args()
+
+    if args.command == 'crawl':
+        extra = [arg for setting in args.set for arg in ('--set', setting)]
+        report = crawl(args.workers, args.dir, extra)
+    elif args.command == 'merge':
+        report = merge(args.dir)
+    elif args.command == 'recover':
+        recover(os.path.join(args.dir, 'queue.sqlite'))
+        sys.exit(0)
+    else:
+        queue = SharedQueue(os.path.join(args.dir, 'queue.sqlite'))
+        report = {'queue': queue.counts(), 'workers': {
+            name: {key: value for key, value in worker.items() if key != 'stats'}
+            for name, worker in queue.workers().items()
+        }}
+        queue.close()
+    print(json.dumps({key: value for key, value in report.items() if key != 'workers'} if args.command != 'status'
+                     else report, ensure_ascii=False, indent=2, default=str))
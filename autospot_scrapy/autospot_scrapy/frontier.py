@@ -0,0 +1,124 @@
+"""Ленивая подача страниц списков в планировщик
+
+Раньше после первой страницы списка в планировщик сразу ставились все
+остальные страницы, а объявления с них копились в очереди за ними.
+Frontier выдает следующие страницы списков только когда очередь
+(планировщик плюс загрузчик) опускается ниже AUTOSPOT_FRONTIER_MAX_PENDING
+и держит в работе не больше AUTOSPOT_FRONTIER_LISTINGS_IN_FLIGHT страниц
+каждого списка. Объявления идут с более высоким приоритетом, чем списки.
+"""
+
+import logging
+import time
+
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов в планировщике: объявления раньше новых страниц списков
+DETAIL_PRIORITY = 10
+LISTING_PRIORITY = 0
+
+
+class Frontier:
+    """Очереди страниц списков, которые подаются в планировщик по мере разбора объявлений"""
+
+    def __init__(self, crawler, max_pending=100, listings_in_flight=4):
+        self.crawler = crawler
+        self.max_pending = max_pending
+        self.listings_in_flight = listings_in_flight
+        # Имя списка -> номера страниц, сколько из них выдано, фабрика запросов, страниц в работе
+        self.streams = {}
+        self.started = None
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler,
+            max_pending=crawler.settings.getint('AUTOSPOT_FRONTIER_MAX_PENDING', 100),
+            listings_in_flight=crawler.settings.getint('AUTOSPOT_FRONTIER_LISTINGS_IN_FLIGHT', 4)
+        )
+
+    @property
+    def exhausted(self):
+        """Все страницы всех списков выданы и разобраны"""
+        return all(
+            stream['position'] >= len(stream['pages']) and not stream['in_flight']
+            for stream in self.streams.values()
+        )
+
+    def add_stream(self, name, max_page, make_request, first_page=2, pages=None):
+        """Регистрирует список: make_request(page) строит запрос страницы
+
+        pages - номера страниц по порядку выдачи, если нужны не все с first_page
+        по max_page (бюджет страниц, выборка по пагинации).
+        """
+        self.streams[name] = {
+            'pages': range(first_page, max_page + 1) if pages is None else list(pages),
+            'position': 0,
+            'make_request': make_request,
+            'in_flight': 0,
+        }
+        self.feed()
+
+    def stop_streams(self, prefix):
+        """Больше не выдавать страницы списков, имя которых начинается с prefix"""
+        for name, stream in self.streams.items():
+            if name.startswith(prefix):
+                stream['position'] = len(stream['pages'])
+
+    def page_done(self, request):
+        """Страница списка разобрана (или не загрузилась) - можно выдать следующую"""
+        stream = self.streams.get(request.meta.get('frontier_stream'))
+        if stream is not None and stream['in_flight']:
+            stream['in_flight'] -= 1
+        self.feed()
+
+    def pending(self):
+        """Запросы в планировщике и в загрузчике"""
+        engine = self.crawler.engine
+        if engine is None or engine.slot is None:
+            return 0
+        return len(engine.slot.scheduler) + len(engine.downloader.active)
+
+    def feed(self):
+        """Выдает страницы списков, пока очередь не заполнена"""
+        scheduled = 0
+        for name, stream in self.streams.items():
+            while (
+                stream['position'] < len(stream['pages'])
+                and stream['in_flight'] < self.listings_in_flight
+                and self.pending() < self.max_pending
+            ):
+                request = stream['make_request'](stream['pages'][stream['position']])
+                request.meta['frontier_stream'] = name
+                stream['position'] += 1
+                stream['in_flight'] += 1
+                self.crawler.engine.crawl(request)
+                scheduled += 1
+        if scheduled:
+            self.crawler.stats.inc_value('frontier/listing_pages', scheduled)
+        return scheduled
+
+    def spider_opened(self, spider):
+        self.started = time.monotonic()
+
+    def request_scheduled(self, request, spider):
+        self.crawler.stats.max_value('frontier/peak_pending', self.pending() + 1)
+
+    def item_scraped(self, item, response, spider):
+        if self.crawler.stats.get_value('frontier/first_item_seconds') is None and self.started is not None:
+            self.crawler.stats.set_value('frontier/first_item_seconds', round(time.monotonic() - self.started, 3))
+
+    def spider_idle(self, spider):
+        # Паук простаивает - значит, страниц в работе нет, даже если
+        # какая-то из них не дошла до page_done (например, отброшена)
+        for stream in self.streams.values():
+            stream['in_flight'] = 0
+        if self.feed():
+            raise DontCloseSpider
@@ -0,0 +1,314 @@
+"""История цен, пробега и наличия объявлений между обходами
+
+Каждый обход пишет свою выгрузку, и вопрос "как менялась цена этой
+машины за месяц" требует склеивать десятки выгрузок. С
+AUTOSPOT_HISTORY_ENABLED (run_spider.py --history) HistoryPipeline
+складывает объявления в SQLite-файл AUTOSPOT_HISTORY_FILE:
+
+    runs       обходы: время начала и конца, объявлений и изменений
+    cars       объявление (ключ - путь страницы, не зависящий от домена):
+               марка, модель, город и текущие цена, пробег и наличие
+    snapshots  история: строка на каждое изменение цены, пробега или
+               наличия объявления, с номером обхода, в котором его увидели
+
+В snapshots только дописывают, и только изменения: объявление, которое
+обход увидел прежним, истории не прибавляет. Снятое с продажи
+(AutospotRemovedCarItem инкрементального обхода) получает строку с
+available = 0, вернувшееся - с available = 1. Индексы: путь объявления
+(и первичный ключ snapshots по объявлению и обходу), марка с моделью,
+город и обход последнего изменения - для выгрузки изменений.
+
+Текущее состояние объявлений держится в памяти (десятки байт на
+объявление), поэтому для сравнения с прошлым обходом не нужно читать
+базу, а записи идут пачками по commit_every. По той же причине писать
+в файл истории может только один процесс за раз.
+
+    python -m autospot_scrapy.history runs
+    python -m autospot_scrapy.history history /used-car/bmw/x5/12345/
+    python -m autospot_scrapy.history cars --brand BMW --model X5 --city Москва
+    python -m autospot_scrapy.history delta --since 12 -o data/changes.jsonl
+    python -m autospot_scrapy.history stats
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        started REAL,
+        finished REAL,
+        items INTEGER,
+        changes INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS cars (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE,
+        brand TEXT,
+        model TEXT,
+        city TEXT,
+        price INTEGER,
+        mileage INTEGER,
+        available INTEGER,
+        first_run INTEGER,
+        last_run INTEGER,
+        changed_run INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS cars_brand_model ON cars (brand, model);
+    CREATE INDEX IF NOT EXISTS cars_city ON cars (city);
+    CREATE INDEX IF NOT EXISTS cars_changed_run ON cars (changed_run);
+    CREATE TABLE IF NOT EXISTS snapshots (
+        car_id INTEGER,
+        run_id INTEGER,
+        price INTEGER,
+        mileage INTEGER,
+        available INTEGER,
+        PRIMARY KEY (car_id, run_id)
+    ) WITHOUT ROWID;
+"""
+
+CAR_COLUMNS = ('id', 'path', 'brand', 'model', 'city', 'price', 'mileage', 'available',
+               'first_run', 'last_run', 'changed_run')
+# Положение полей в записи объявления в памяти (list в порядке CAR_COLUMNS)
+ID, PATH, BRAND, MODEL, CITY, PRICE, MILEAGE, AVAILABLE, FIRST_RUN, LAST_RUN, CHANGED_RUN = range(len(CAR_COLUMNS))
+
+
+def car_path(url):
+    """Ключ объявления: путь страницы, как в SeenStore"""
+    return urlparse(url).path if '://' in url else url
+
+
+class HistoryStore:
+    """SQLite-история объявлений: текущее состояние плюс строки изменений"""
+
+    def __init__(self, path, commit_every=2000):
+        self.path = path
+        self.commit_every = commit_every
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.cars = {}
+        self.next_id = 1
+        for row in self.conn.execute("SELECT %s FROM cars" % ', '.join(CAR_COLUMNS)):
+            self.cars[row[PATH]] = list(row)
+            self.next_id = max(self.next_id, row[ID] + 1)
+        self.run_id = None
+        # Изменившиеся с последней записи объявления (id -> запись) и новые строки истории
+        self._dirty = {}
+        self._snapshots = []
+        self.observed = 0
+        self.changes = 0
+        self.new = 0
+
+    def begin_run(self, now=None):
+        self.run_id = self.conn.execute(
+            "INSERT INTO runs (started) VALUES (?) RETURNING id", (now or time.time(),)
+        ).fetchone()[0]
+        self.conn.commit()
+        self.observed = self.changes = self.new = 0
+        return self.run_id
+
+    def end_run(self, now=None):
+        self.flush()
+        self.conn.execute(
+            "UPDATE runs SET finished = ?, items = ?, changes = ? WHERE id = ?",
+            (now or time.time(), self.observed, self.changes, self.run_id)
+        )
+        self.conn.commit()
+
+    def observe(self, url, brand, model, city, price, mileage, available=True):
+        """Объявление в текущем обходе; True, если у него новая строка истории"""
+        path = car_path(url)
+        available = int(available)
+        car = self.cars.get(path)
+        self.observed += 1
+        if car is None:
+            car = self.cars[path] = [self.next_id, path, brand, model, city, price, mileage, available,
+                                     self.run_id, self.run_id, self.run_id]
+            self.next_id += 1
+            self.new += 1
+            changed = True
+        else:
+            # Снятое с продажи приходит без марки и цены - прежние значения остаются
+            if brand is not None:
+                car[BRAND], car[MODEL], car[CITY] = brand, model, city
+            if price is None and not available:
+                price, mileage = car[PRICE], car[MILEAGE]
+            changed = (car[PRICE], car[MILEAGE], car[AVAILABLE]) != (price, mileage, available)
+            if changed:
+                car[PRICE], car[MILEAGE], car[AVAILABLE] = price, mileage, available
+                car[CHANGED_RUN] = self.run_id
+            car[LAST_RUN] = self.run_id
+        self._dirty[car[ID]] = car
+        if changed:
+            self.changes += 1
+            self._snapshots.append((car[ID], self.run_id, price, mileage, available))
+        if len(self._dirty) >= self.commit_every:
+            self.flush()
+        return changed
+
+    def remove(self, url):
+        """Объявление снято с продажи; известно только ранее виденное"""
+        if car_path(url) not in self.cars:
+            return False
+        return self.observe(url, None, None, None, None, None, available=False)
+
+    def flush(self):
+        if self._dirty:
+            self.conn.executemany("""
+                INSERT INTO cars (%s) VALUES (%s)
+                ON CONFLICT (id) DO UPDATE SET
+                    brand = excluded.brand, model = excluded.model, city = excluded.city,
+                    price = excluded.price, mileage = excluded.mileage, available = excluded.available,
+                    last_run = excluded.last_run, changed_run = excluded.changed_run
+            """ % (', '.join(CAR_COLUMNS), ', '.join('?' * len(CAR_COLUMNS))), self._dirty.values())
+        if self._snapshots:
+            # Второе изменение в том же обходе заменяет первое
+            self.conn.executemany("""
+                INSERT INTO snapshots (car_id, run_id, price, mileage, available) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (car_id, run_id) DO UPDATE SET
+                    price = excluded.price, mileage = excluded.mileage, available = excluded.available
+            """, self._snapshots)
+        self.conn.commit()
+        self._dirty = {}
+        self._snapshots = []
+
+    def history(self, url):
+        """Строки истории объявления: (обход, время обхода, цена, пробег, наличие)"""
+        car = self.cars.get(car_path(url))
+        if car is None:
+            return []
+        return self.conn.execute("""
+            SELECT s.run_id, r.started, s.price, s.mileage, s.available
+            FROM snapshots s JOIN runs r ON r.id = s.run_id
+            WHERE s.car_id = ? ORDER BY s.run_id
+        """, (car[ID],)).fetchall()
+
+    def find(self, brand=None, model=None, city=None, available=None, limit=None):
+        """Текущее состояние объявлений по марке, модели, городу и наличию"""
+        conditions = []
+        params = []
+        for column, value in (('brand', brand), ('model', model), ('city', city)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if available is not None:
+            conditions.append("available = ?")
+            params.append(int(available))
+        sql = "SELECT path, brand, model, city, price, mileage, available, last_run FROM cars"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY path"
+        if limit:
+            sql += " LIMIT %d" % limit
+        return self.conn.execute(sql, params).fetchall()
+
+    def changed_since(self, run_id):
+        """Объявления, изменившиеся после обхода run_id: текущее состояние и состояние на run_id"""
+        cursor = self.conn.execute("""
+            SELECT c.path, c.brand, c.model, c.city, c.price, c.mileage, c.available, c.changed_run,
+                   p.price, p.mileage, p.available
+            FROM cars c LEFT JOIN snapshots p ON p.car_id = c.id AND p.run_id = (
+                SELECT MAX(run_id) FROM snapshots WHERE car_id = c.id AND run_id <= ?
+            )
+            WHERE c.changed_run > ?
+            ORDER BY c.path
+        """, (run_id, run_id))
+        for row in cursor:
+            record = {
+                'path': row[0], 'brand': row[1], 'model': row[2], 'city': row[3],
+                'price': row[4], 'mileage': row[5], 'available': bool(row[6]), 'run': row[7],
+            }
+            # Объявления, которых на run_id еще не было, - без previous
+            if row[10] is not None:
+                record['previous'] = {'price': row[8], 'mileage': row[9], 'available': bool(row[10])}
+            yield record
+
+    def export_delta(self, run_id, output):
+        """Пишет изменения после обхода run_id в JSON Lines (через .part); возвращает число строк"""
+        self.flush()
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        count = 0
+        with open(output + '.part', 'w', encoding='utf-8') as f:
+            for record in self.changed_since(run_id):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+        os.replace(output + '.part', output)
+        return count
+
+    def runs(self):
+        return self.conn.execute("SELECT id, started, finished, items, changes FROM runs ORDER BY id").fetchall()
+
+    def stats(self):
+        return {
+            'runs': self.conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0],
+            'cars': len(self.cars),
+            'available': sum(1 for car in self.cars.values() if car[AVAILABLE]),
+            'snapshots': self.conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0],
+            'file_bytes': os.path.getsize(self.path),
+        }
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def _time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp)) if timestamp else '-'
+
+
+if __name__ == '__main__':
+    from scrapy.utils.project import get_project_settings
+
+    from autospot_scrapy.utils import data_file
+
+    parser = argparse.ArgumentParser(description='Query the car price history store')
+    parser.add_argument('command', choices=('runs', 'history', 'cars', 'delta', 'stats'))
+    parser.add_argument('car', nargs='?', help='Car URL or page path (history)')
+    parser.add_argument('--brand')
+    parser.add_argument('--model')
+    parser.add_argument('--city')
+    parser.add_argument('--available', choices=('yes', 'no'), help='Only cars on sale (yes) or removed (no)')
+    parser.add_argument('--limit', type=int, help='Maximum cars to print')
+    parser.add_argument('--since', type=int, help='Run id: export cars changed after it (delta)')
+    parser.add_argument('--output', '-o', help='Delta file (JSON Lines; default: stdout)')
+    parser.add_argument('--file', help='History file (default: AUTOSPOT_HISTORY_FILE)')
+    args = parser.parse_args()
+    if args.command == 'history' and not args.car:
+        parser.error('history needs a car URL or path')
+    if args.command == 'delta' and args.since is None:
+        parser.error('delta needs --since RUN')
+
+    settings = get_project_settings()
+    store = HistoryStore(data_file(args.file or settings.get('AUTOSPOT_HISTORY_FILE')))
+    if args.command == 'runs':
+        for run_id, started, finished, items, changes in store.runs():
+            print(f'{run_id}\t{_time(started)}\t{_time(finished)}\t{items or 0} items\t{changes or 0} changes')
+    elif args.command == 'history':
+        for run_id, started, price, mileage, available in store.history(args.car):
+            print(f'{run_id}\t{_time(started)}\t{price}\t{mileage}\t{"on sale" if available else "removed"}')
+    elif args.command == 'cars':
+        available = None if args.available is None else args.available == 'yes'
+        for path, brand, model, city, price, mileage, on_sale, last_run in store.find(
+            args.brand, args.model, args.city, available, args.limit
+        ):
+            print(f'{path}\t{brand} {model}\t{city}\t{price}\t{mileage}\t{"on sale" if on_sale else "removed"}')
+    elif args.command == 'delta' and args.output:
+        count = store.export_delta(args.since, args.output)
+        print(f'Wrote {count} changed cars to {args.output}')
+    elif args.command == 'delta':
+        for record in store.changed_since(args.since):
+            print(json.dumps(record, ensure_ascii=False))
+    else:
+        print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+    store.close()
@@ -0,0 +1,361 @@
+"""Хранилище HTTP-кэша Scrapy в одном файле SQLite
+
+В отличие от FilesystemCacheStorage (шесть файлов на ответ, тела как
+пришли с сервера) тела хранятся раскодированными и сжатыми zstd (или
+zlib, если zstandard не установлен), одинаковые тела - один раз по
+SHA-1. Страницы SPA почти целиком совпадают разметкой, поэтому для zstd
+первое тело каждого типа запроса становится словарем для остальных.
+Срок жизни ответа задается по типу запроса (list, detail, token),
+а при превышении AUTOSPOT_HTTPCACHE_MAX_BYTES вытесняются давно не
+читавшиеся ответы.
+
+Просмотр и обслуживание файла кэша:
+
+    python -m autospot_scrapy.httpcache stats
+    python -m autospot_scrapy.httpcache compact
+    python -m autospot_scrapy.httpcache import .scrapy/httpcache/autospot
+"""
+
+import argparse
+import gzip
+import hashlib
+import logging
+import pickle
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+from autospot_scrapy.utils import data_file, request_kind
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Тела меньше этого не годятся в словари (ответы API, пустые страницы)
+MIN_DICTIONARY_SIZE = 16 * 1024
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS dictionaries (
+        id INTEGER PRIMARY KEY,
+        kind TEXT UNIQUE,
+        data BLOB
+    );
+    CREATE TABLE IF NOT EXISTS bodies (
+        hash TEXT PRIMARY KEY,
+        codec TEXT,
+        dict_id INTEGER,
+        size INTEGER,
+        data BLOB
+    );
+    CREATE TABLE IF NOT EXISTS responses (
+        fingerprint TEXT PRIMARY KEY,
+        url TEXT,
+        kind TEXT,
+        status INTEGER,
+        headers BLOB,
+        body_hash TEXT,
+        stored_at REAL,
+        accessed_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+    CREATE INDEX IF NOT EXISTS responses_body ON responses (body_hash);
+"""
+
+
+def decode_body(headers, body):
+    """Снимает gzip с тела ответа, чтобы одинаковые страницы совпадали байт в байт
+
+    Возвращает (headers, body); если снять кодирование не удалось,
+    ответ остается как есть.
+    """
+    encoding = headers.get('Content-Encoding', b'').lower()
+    if encoding not in (b'gzip', b'x-gzip'):
+        return headers, body
+    try:
+        body = gzip.decompress(body)
+    except (OSError, EOFError, zlib.error):
+        return headers, body
+    headers = headers.copy()
+    headers.pop('Content-Encoding', None)
+    headers.pop('Content-Length', None)
+    return headers, body
+
+
+class SqliteCacheStorage:
+    """HTTPCACHE_STORAGE с дедупликацией тел, сроками по типу запроса и LRU"""
+
+    def __init__(self, settings):
+        self.path = settings.get('AUTOSPOT_HTTPCACHE_FILE', 'httpcache.sqlite')
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.ttls = settings.getdict('AUTOSPOT_HTTPCACHE_TTLS')
+        self.max_bytes = settings.getint('AUTOSPOT_HTTPCACHE_MAX_BYTES')
+        self.codec = settings.get('AUTOSPOT_HTTPCACHE_COMPRESSION', 'zstd')
+        if self.codec == 'zstd' and zstandard is None:
+            self.codec = 'zlib'
+        self.commit_every = settings.getint('AUTOSPOT_HTTPCACHE_COMMIT_EVERY', 200)
+        self.conn = None
+        self._pending = 0
+        self._total_bytes = 0
+        # id словаря -> (ZstdCompressor, ZstdDecompressor)
+        self._zstd = {}
+        self._dict_ids = {}
+
+    def open_spider(self, spider):
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        self.open(data_file(self.path))
+        logger.debug("Using SQLite cache storage in %s", self.path)
+
+    def open(self, path):
+        # Кэш может быть общим у нескольких воркеров: ждем блокировку записи
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._dict_ids = dict(self.conn.execute("SELECT kind, id FROM dictionaries").fetchall())
+        self._total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+
+    def close_spider(self, spider):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def ttl(self, kind):
+        """Срок жизни ответа: None - не кэшировать, 0 - бессрочно"""
+        return self.ttls.get(kind, self.expiration_secs)
+
+    def retrieve_response(self, spider, request):
+        """Ответ из кэша или None, если его нет или он устарел"""
+        fp = self._fingerprinter.fingerprint(request).hex()
+        row = self.conn.execute("""
+            SELECT r.url, r.kind, r.status, r.headers, r.stored_at, b.codec, b.dict_id, b.data
+            FROM responses r JOIN bodies b ON b.hash = r.body_hash
+            WHERE r.fingerprint = ?
+        """, (fp,)).fetchone()
+        if row is None:
+            return None
+        url, kind, status, raw_headers, stored_at, codec, dict_id, data = row
+        ttl = self.ttl(kind)
+        if ttl is None or 0 < ttl < time.time() - stored_at:
+            return None
+        try:
+            body = self.decompress(data, codec, dict_id)
+        except (ValueError, zlib.error) as e:
+            logger.warning("Unreadable cache entry for %s: %s", url, e)
+            return None
+
+        self.conn.execute("UPDATE responses SET accessed_at = ? WHERE fingerprint = ?", (time.time(), fp))
+        self._maybe_commit()
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        kind = request_kind(request)
+        if self.ttl(kind) is None:
+            return
+        fp = self._fingerprinter.fingerprint(request).hex()
+        headers, body = decode_body(response.headers, response.body)
+        self.store(fp, response.url, kind, response.status, headers_dict_to_raw(headers), body)
+
+    def store(self, fp, url, kind, status, raw_headers, body, stored_at=None):
+        """Записывает ответ с уже раскодированным телом"""
+        now = stored_at or time.time()
+        body_hash = hashlib.sha1(body).hexdigest()
+        if self.conn.execute("SELECT 1 FROM bodies WHERE hash = ?", (body_hash,)).fetchone() is None:
+            dict_id, data = self.compress(body, kind)
+            self.conn.execute(
+                "INSERT INTO bodies (hash, codec, dict_id, size, data) VALUES (?, ?, ?, ?, ?)",
+                (body_hash, self.codec, dict_id, len(data), data)
+            )
+            self._total_bytes += len(data)
+        self.conn.execute("""
+            INSERT OR REPLACE INTO responses
+                (fingerprint, url, kind, status, headers, body_hash, stored_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (fp, url, kind, status, raw_headers, body_hash, now, now))
+        self._maybe_commit()
+        if self.max_bytes and self._total_bytes > self.max_bytes:
+            self.evict(int(self.max_bytes * 0.9))
+
+    def compress(self, body, kind):
+        """(id словаря или None, сжатое тело)"""
+        if self.codec == 'zlib':
+            return None, zlib.compress(body, 6)
+        if self.codec != 'zstd':
+            return None, body
+        dict_id = self._dict_ids.get(kind)
+        if dict_id is None and len(body) >= MIN_DICTIONARY_SIZE:
+            cursor = self.conn.execute(
+                "INSERT INTO dictionaries (kind, data) VALUES (?, ?)",
+                (kind, zstandard.ZstdCompressor(level=19).compress(body))
+            )
+            dict_id = self._dict_ids[kind] = cursor.lastrowid
+        return dict_id, self._zstd_pair(dict_id)[0].compress(body)
+
+    def decompress(self, data, codec, dict_id=None):
+        if codec == 'zlib':
+            return zlib.decompress(data)
+        if codec != 'zstd':
+            return data
+        if zstandard is None:
+            raise ValueError("zstandard is required to read this cache entry")
+        return self._zstd_pair(dict_id)[1].decompress(data)
+
+    def _zstd_pair(self, dict_id):
+        if dict_id not in self._zstd:
+            if dict_id is None:
+                self._zstd[dict_id] = (zstandard.ZstdCompressor(level=3), zstandard.ZstdDecompressor())
+            else:
+                raw = self.conn.execute("SELECT data FROM dictionaries WHERE id = ?", (dict_id,)).fetchone()[0]
+                zdict = zstandard.ZstdCompressionDict(
+                    zstandard.ZstdDecompressor().decompress(raw), dict_type=zstandard.DICT_TYPE_RAWCONTENT
+                )
+                self._zstd[dict_id] = (
+                    zstandard.ZstdCompressor(level=3, dict_data=zdict),
+                    zstandard.ZstdDecompressor(dict_data=zdict)
+                )
+        return self._zstd[dict_id]
+
+    def evict(self, target_bytes):
+        """Удаляет давно не читавшиеся ответы, пока тела не займут меньше target_bytes"""
+        evicted = 0
+        while self._total_bytes > target_bytes:
+            rows = self.conn.execute(
+                "SELECT fingerprint FROM responses ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            self.conn.executemany("DELETE FROM responses WHERE fingerprint = ?", rows)
+            evicted += len(rows)
+            self._collect_bodies()
+        if evicted:
+            self.conn.commit()
+            logger.debug("Evicted %d cached responses", evicted)
+        return evicted
+
+    def expire(self, now=None):
+        """Удаляет устаревшие ответы; возвращает их число"""
+        now = now or time.time()
+        expired = 0
+        for kind, in self.conn.execute("SELECT DISTINCT kind FROM responses").fetchall():
+            ttl = self.ttl(kind)
+            if ttl == 0:
+                continue
+            if ttl is None:
+                cursor = self.conn.execute("DELETE FROM responses WHERE kind = ?", (kind,))
+            else:
+                cursor = self.conn.execute(
+                    "DELETE FROM responses WHERE kind = ? AND stored_at < ?", (kind, now - ttl)
+                )
+            expired += cursor.rowcount
+        self._collect_bodies()
+        self.conn.commit()
+        return expired
+
+    def _collect_bodies(self):
+        self.conn.execute("DELETE FROM bodies WHERE hash NOT IN (SELECT body_hash FROM responses)")
+        self._total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+
+    def _maybe_commit(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.conn.commit()
+            self._pending = 0
+
+
+def guess_kind(url):
+    """Тип запроса по адресу - для ответов, импортированных без meta"""
+    path, _, query = url.partition('?')
+    if path.rstrip('/').count('/') <= 2:
+        return 'token'
+    if 'page=' in query:
+        return 'list'
+    return 'detail'
+
+
+def import_filesystem_cache(storage, cache_dir, limit=None):
+    """Переносит ответы из каталога FilesystemCacheStorage (одного паука)"""
+    imported = 0
+    for meta_path in sorted(Path(cache_dir).glob('*/*/pickled_meta'))[:limit]:
+        entry = meta_path.parent
+        with open(meta_path, 'rb') as f:
+            meta = pickle.load(f)
+        headers = Headers(headers_raw_to_dict((entry / 'response_headers').read_bytes()))
+        headers, body = decode_body(headers, (entry / 'response_body').read_bytes())
+        storage.store(
+            entry.name, meta['response_url'], guess_kind(meta['url']), meta['status'],
+            headers_dict_to_raw(headers), body, stored_at=meta.get('timestamp')
+        )
+        imported += 1
+    storage.conn.commit()
+    return imported
+
+
+def cache_stats(storage):
+    conn = storage.conn
+    bodies, stored_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM bodies").fetchone()
+    report = {
+        'responses': conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0],
+        'bodies': bodies,
+        'stored_body_bytes': stored_bytes,
+        'codecs': dict(conn.execute("SELECT codec, COUNT(*) FROM bodies GROUP BY codec").fetchall()),
+        'kinds': {},
+    }
+    now = time.time()
+    for kind, count, oldest in conn.execute(
+        "SELECT kind, COUNT(*), MIN(stored_at) FROM responses GROUP BY kind"
+    ).fetchall():
+        ttl = storage.ttl(kind)
+        expired = 0
+        if ttl is None:
+            expired = count
+        elif ttl:
+            expired = conn.execute(
+                "SELECT COUNT(*) FROM responses WHERE kind = ? AND stored_at < ?", (kind, now - ttl)
+            ).fetchone()[0]
+        report['kinds'][kind] = {'responses': count, 'expired': expired, 'oldest_age_secs': int(now - oldest)}
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    report['file_bytes'] = conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+    report['free_bytes'] = conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size
+    return report
+
+
+if __name__ == '__main__':
+    import json
+    from scrapy.utils.project import get_project_settings
+
+    parser = argparse.ArgumentParser(description='Inspect and maintain the SQLite HTTP cache')
+    parser.add_argument('command', choices=('stats', 'compact', 'import'))
+    parser.add_argument('source', nargs='?', help='FilesystemCacheStorage spider directory (for import)')
+    parser.add_argument('--file', help='Cache file (default: AUTOSPOT_HTTPCACHE_FILE)')
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    storage = SqliteCacheStorage(settings)
+    storage.open(data_file(args.file or storage.path))
+    if args.command == 'import':
+        if not args.source:
+            parser.error('import needs the source cache directory')
+        print(f'Imported {import_filesystem_cache(storage, args.source)} responses')
+    elif args.command == 'compact':
+        expired = storage.expire()
+        if storage.max_bytes:
+            storage.evict(storage.max_bytes)
+        storage.conn.commit()
+        storage.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        storage.conn.execute("VACUUM")
+        print(f'Removed {expired} expired responses')
+    print(json.dumps(cache_stats(storage), indent=2))
+    storage.close()
@@ -25,3 +25,15 @@ class AutospotCarItem(scrapy.Item):
     city = scrapy.Field()
     dealer = scrapy.Field()
     options = scrapy.Field()
+    # id общей конфигурации вместо characteristics и options (AUTOSPOT_CONFIG_REFS)
+    configuration = scrapy.Field()
+
+class AutospotConfigurationItem(scrapy.Item):
+    configuration = scrapy.Field()
+    characteristics = scrapy.Field()
+    options = scrapy.Field()
+
+class AutospotRemovedCarItem(scrapy.Item):
+    url = scrapy.Field()
+    car_type = scrapy.Field()
+    last_seen = scrapy.Field()
@@ -0,0 +1,211 @@
+"""Замеры этапов обработки, гистограммы задержек и HTTP-эндпоинт метрик
+
+Паук оборачивает этапы разбора объявления в metrics.stage(), загрузки
+попадают в гистограмму по типу запроса и коду ответа, TokenMiddleware
+отмечает получение токена и ожидание его запросами. Итоги пишутся в
+статистику Scrapy (metrics/...), а при AUTOSPOT_METRICS_PORT текущие
+значения отдаются в формате Prometheus по адресу /metrics.
+
+С AUTOSPOT_PROFILE_FRACTION > 0 указанная доля колбэков выполняется под
+cProfile, дампы складываются в AUTOSPOT_PROFILE_DIR:
+
+    python -m pstats .scrapy/profiles/parse_used_car_info-1.prof
+"""
+
+import cProfile
+import logging
+import os
+import random
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from scrapy import signals
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from autospot_scrapy.utils import data_file, request_kind
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограмм, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, как в Prometheus"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Верхняя граница корзины, в которую попадает квантиль q"""
+        if not self.count:
+            return 0.0
+        threshold = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= threshold:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """Реестр гистограмм: имя метрики -> метки -> Histogram"""
+
+    def __init__(self, crawler=None, port=0, host='127.0.0.1', profile_fraction=0.0, profile_dir=None):
+        self.crawler = crawler
+        self.port = port
+        self.host = host
+        self.profile_fraction = profile_fraction
+        self.profile_dir = profile_dir
+        self.histograms = {}
+        self._profiles = 0
+        self._listening = None
+        self._item_started = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        metrics = cls(
+            crawler,
+            port=settings.getint('AUTOSPOT_METRICS_PORT', 0),
+            host=settings.get('AUTOSPOT_METRICS_HOST', '127.0.0.1'),
+            profile_fraction=settings.getfloat('AUTOSPOT_PROFILE_FRACTION', 0.0),
+            profile_dir=settings.get('AUTOSPOT_PROFILE_DIR', 'profiles')
+        )
+        if not settings.getbool('AUTOSPOT_METRICS_ENABLED', True):
+            return metrics
+        crawler.signals.connect(metrics.response_received, signal=signals.response_received)
+        # Паук создается раньше расширений, так что этот обработчик
+        # item_scraped срабатывает до FeedExporter, а item_exported,
+        # подключенный на engine_started, - после него
+        crawler.signals.connect(metrics.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(metrics.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(metrics.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(metrics.spider_closed, signal=signals.spider_closed)
+        return metrics
+
+    def observe(self, name, value, **labels):
+        key = tuple(labels.items())
+        series = self.histograms.setdefault(name, {})
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    @contextmanager
+    def stage(self, name, car_type=None):
+        """Время этапа обработки в stage_seconds{stage, car_type}"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - started, stage=name, car_type=car_type or '')
+
+    @contextmanager
+    def profile(self, name):
+        """Выполняет блок под cProfile для доли AUTOSPOT_PROFILE_FRACTION вызовов"""
+        if not self.profile_fraction or random.random() >= self.profile_fraction:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._profiles += 1
+            path = data_file(os.path.join(self.profile_dir, f'{name}-{self._profiles}.prof'))
+            profiler.dump_stats(path)
+            logger.debug("Saved profile %s", path)
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is None or 'cached' in response.flags:
+            return
+        self.observe('download_seconds', latency, kind=request_kind(request), status=str(response.status))
+
+    def item_scraped(self, item, response, spider):
+        self._item_started = time.perf_counter()
+
+    def item_exported(self, item, response, spider):
+        if self._item_started is not None:
+            self.observe('stage_seconds', time.perf_counter() - self._item_started, stage='export', car_type='')
+            self._item_started = None
+
+    def engine_started(self):
+        self.crawler.signals.connect(self.item_exported, signal=signals.item_scraped)
+
+    def spider_opened(self, spider):
+        if not self.port:
+            return
+        from twisted.internet import reactor
+
+        self._listening = reactor.listenTCP(self.port, Site(MetricsResource(self)), interface=self.host)
+        logger.info("Metrics endpoint on http://%s:%d/metrics", self.host, self._listening.getHost().port)
+
+    def spider_closed(self, spider, reason):
+        self.export_stats(self.crawler.stats)
+        if self._listening is not None:
+            self._listening.stopListening()
+            self._listening = None
+
+    def export_stats(self, stats):
+        """Итоги гистограмм в статистику Scrapy: metrics/<имя>/<метки>/..."""
+        for name, series in self.histograms.items():
+            for labels, histogram in series.items():
+                prefix = '/'.join(['metrics', name] + [value for _, value in labels if value])
+                stats.set_value(f'{prefix}/count', histogram.count)
+                stats.set_value(f'{prefix}/avg_ms', round(histogram.sum / histogram.count * 1000, 3))
+                stats.set_value(f'{prefix}/p95_ms', round(histogram.quantile(0.95) * 1000, 3))
+                stats.set_value(f'{prefix}/max_ms', round(histogram.max * 1000, 3))
+
+    def render(self):
+        """Текущие гистограммы и числовая статистика Scrapy в текстовом формате Prometheus"""
+        lines = []
+        for name, series in sorted(self.histograms.items()):
+            metric = f'autospot_{name}'
+            lines.append(f'# TYPE {metric} histogram')
+            for labels, histogram in sorted(series.items()):
+                label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    sep = ',' if label_text else ''
+                    lines.append(f'{metric}_bucket{{{label_text}{sep}le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label_text}}} {histogram.sum}')
+                lines.append(f'{metric}_count{{{label_text}}} {histogram.count}')
+        if self.crawler is not None and self.crawler.stats is not None:
+            lines.append('# TYPE scrapy_stat gauge')
+            for key, value in sorted(self.crawler.stats.get_stats().items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'scrapy_stat{{name="{key}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsResource(Resource):
+    """GET /metrics - текущие значения Metrics.render()"""
+
+    isLeaf = True
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.metrics.render().encode('utf-8')
@@ -4,96 +4,365 @@
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
 from scrapy import signals
+from scrapy.core.downloader import Slot
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import defer
+from autospot_scrapy.scanner import find_state_json
+from autospot_scrapy.state import ServerState, json_loads
+from autospot_scrapy.utils import data_file, request_kind
+from email.utils import parsedate_to_datetime
 import logging
 import json
-import re
+import os
+import time
 import datetime
-import requests
 
 logger = logging.getLogger(__name__)
 
 class TokenMiddleware:
+    """Добавляет Bearer-токен к запросам с meta['needs_token']
+
+    Токен берется из serverApp-state главной страницы, которая скачивается
+    через загрузчик Scrapy без блокировки реактора. Одновременно идет не
+    больше одного запроса за токеном: остальные запросы ждут его результата.
+    """
+
     token_info = {
         "token": None,
         "timestamp": None
     }
-    
+
+    def __init__(self, crawler, base_url='https://autospot.ru', token_file=None,
+                 refresh_after=22 * 3600, max_age=23 * 3600):
+        self.crawler = crawler
+        self.base_url = base_url.rstrip('/') + '/'
+        self.token_file = data_file(token_file) if token_file else None
+        self.refresh_after = refresh_after
+        self.max_age = max_age
+        self._waiters = []
+        self._fetching = False
+        self._fetch_started = None
+
     @classmethod
     def from_crawler(cls, crawler):
-        middleware = cls()
+        settings = crawler.settings
+        middleware = cls(
+            crawler,
+            base_url=settings.get('AUTOSPOT_BASE_URL', 'https://autospot.ru'),
+            token_file=settings.get('AUTOSPOT_TOKEN_FILE'),
+            refresh_after=settings.getint('AUTOSPOT_TOKEN_REFRESH_AFTER', 22 * 3600),
+            max_age=settings.getint('AUTOSPOT_TOKEN_MAX_AGE', 23 * 3600)
+        )
         crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
         return middleware
-    
+
     def spider_opened(self, spider):
+        if not self.token_info["token"]:
+            self._load_token()
         logger.info("TokenMiddleware initialized")
-    
+
     def process_request(self, request, spider):
         if 'dont_process_token' in request.meta:
             return None
-            
+
         if not request.meta.get('needs_token'):
             return None
-            
-        token = self.get_bearer_token(spider)
+
+        return self.get_bearer_token(spider).addCallback(self._authorize, request, spider, time.perf_counter())
+
+    def process_response(self, request, response, spider):
+        if response.status not in (401, 403) or not request.meta.get('needs_token'):
+            return response
+        if 'dont_process_token' in request.meta:
+            return response
+        if request.meta.get('token_retried'):
+            logger.error("Request rejected with a fresh token (%d): %s", response.status, request.url)
+            return response
+
+        # Сбрасываем токен, только если его еще не обновил другой запрос
+        if request.meta.get('token') == self.token_info["token"]:
+            self.token_info["token"] = None
+            self.token_info["timestamp"] = None
+        logger.warning("Token rejected (%d), re-authorizing: %s", response.status, request.url)
+        self.crawler.stats.inc_value('token/rejected')
+
+        retry = request.replace(dont_filter=True)
+        retry.meta['token_retried'] = True
+        del retry.headers['Authorization']
+        return retry
+
+    def _authorize(self, token, request, spider, waited_since):
+        spider.metrics.observe('token_wait_seconds', time.perf_counter() - waited_since)
         if not token:
             logger.error("Failed to get token for request")
             return None
-            
+
         request.headers['Authorization'] = f'Bearer {token}'
-        logger.info("Added token to request: %s", request.url)
+        request.meta['token'] = token
+        logger.debug("Added token to request: %s", request.url)
         return None
-    
+
     def get_bearer_token(self, spider, force_refresh=False):
+        """Возвращает Deferred с токеном (или None, если получить его не удалось)"""
         current_time = datetime.datetime.now()
-        
+
         if not force_refresh and self.token_info["token"] and self.token_info["timestamp"]:
-            token_age = current_time - self.token_info["timestamp"]
-            if token_age.total_seconds() < 23 * 3600:
-                return self.token_info["token"]
-        
+            token_age = (current_time - self.token_info["timestamp"]).total_seconds()
+            if token_age < self.max_age:
+                # Обновляем заранее, продолжая пользоваться текущим токеном
+                if token_age >= self.refresh_after:
+                    self._fetch_token()
+                return defer.succeed(self.token_info["token"])
+
+        waiter = defer.Deferred()
+        self._waiters.append(waiter)
+        self._fetch_token()
+        return waiter
+
+    def _fetch_token(self):
+        if self._fetching:
+            return
+        self._fetching = True
+        self._fetch_started = time.perf_counter()
+        self.crawler.stats.inc_value('token/fetch_count')
+
+        request = Request(
+            self.base_url,
+            headers={
+                'Accept': 'application/json, text/plain, */*',
+                'Origin': self.base_url.rstrip('/'),
+                'Referer': self.base_url
+            },
+            meta={'request_kind': 'token', 'dont_process_token': True, 'dont_cache': True},
+            priority=100,
+            dont_filter=True
+        )
+        d = self.crawler.engine.download(request)
+        d.addCallback(self._parse_token)
+        d.addErrback(self._token_failed)
+        d.addBoth(self._release_waiters)
+
+    def _parse_token(self, response):
+        if response.status != 200:
+            logger.error("Failed to get page for token extraction: %s", response.status)
+            return None
+
+        script = find_state_json(response.body)
+        if script is None:
+            logger.warning("Script serverApp-state not found on page")
+            return None
+
+        access_token = ServerState(json_loads(script)).get('oauth2/token')
+        if not access_token:
+            logger.warning("Token not found in data")
+            return None
+
+        self.token_info["token"] = access_token
+        self.token_info["timestamp"] = datetime.datetime.now()
+        self._save_token()
+        logger.info("Received new token")
+        return access_token
+
+    def _token_failed(self, failure):
+        logger.error("Error getting token: %s", failure.getErrorMessage())
+        return None
+
+    def _release_waiters(self, token):
+        self._fetching = False
+        self.crawler.spider.metrics.observe(
+            'stage_seconds', time.perf_counter() - self._fetch_started, stage='token_fetch', car_type=''
+        )
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            waiter.callback(token)
+
+    def _load_token(self):
+        if not self.token_file or not os.path.exists(self.token_file):
+            return
+        try:
+            with open(self.token_file, encoding='utf-8') as f:
+                saved = json.load(f)
+            self.token_info["token"] = saved["token"]
+            self.token_info["timestamp"] = datetime.datetime.fromisoformat(saved["timestamp"])
+            logger.info("Loaded saved token from %s", self.token_file)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable token file %s: %s", self.token_file, e)
+
+    def _save_token(self):
+        if not self.token_file:
+            return
+        # Свой временный файл у каждого процесса: токен могут сохранять несколько воркеров
+        tmp_path = f'{self.token_file}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "token": self.token_info["token"],
+                "timestamp": self.token_info["timestamp"].isoformat()
+            }, f)
+        os.replace(tmp_path, self.token_file)
+
+
+class AdaptiveThrottleMiddleware:
+    """AIMD-регулятор задержки и параллельности по типам запросов
+
+    Списки, объявления и запрос за токеном идут через отдельные слоты
+    загрузчика ('<host>:<kind>') со своими бюджетами. Пока сайт отвечает
+    быстрее AUTOSPOT_THROTTLE_TARGET_LATENCY, задержка слота уменьшается на
+    шаг, а параллельность растет на единицу после каждого "окна" успешных
+    ответов. На 429/503 и таймауты параллельность делится пополам, задержка
+    удваивается и не опускается ниже Retry-After.
+
+    Стоит ближе к загрузчику, чем RetryMiddleware, чтобы видеть 429/503
+    до повтора запроса.
+    """
+
+    DEFAULT_BUDGET = {
+        'start_delay': 1.0,
+        'min_delay': 0.0,
+        'max_delay': 60.0,
+        'delay_step': 0.1,
+        'start_concurrency': 1,
+        'max_concurrency': 4,
+    }
+    THROTTLE_CODES = (429, 503)
+
+    def __init__(self, crawler, budgets, target_latency=2.0, randomize_delay=True):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.budgets = {
+            kind: dict(self.DEFAULT_BUDGET, **budget) for kind, budget in budgets.items()
+        }
+        self.target_latency = target_latency
+        self.randomize_delay = randomize_delay
+        # Ключ слота -> текущие delay, concurrency и число успехов подряд
+        self.slots = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('AUTOSPOT_THROTTLE_ENABLED'):
+            raise NotConfigured
+        if settings.getbool('AUTOTHROTTLE_ENABLED'):
+            logger.warning("AUTOTHROTTLE_ENABLED is set: it will fight AdaptiveThrottleMiddleware over slot delays")
+        return cls(
+            crawler,
+            budgets=settings.getdict('AUTOSPOT_THROTTLE_BUDGETS'),
+            target_latency=settings.getfloat('AUTOSPOT_THROTTLE_TARGET_LATENCY', 2.0),
+            randomize_delay=settings.getbool('RANDOMIZE_DOWNLOAD_DELAY', True)
+        )
+
+    def process_request(self, request, spider):
+        kind = request_kind(request)
+        if kind not in self.budgets:
+            return None
+        if 'download_slot' not in request.meta:
+            host = urlparse_cached(request).hostname or ''
+            request.meta['download_slot'] = f'{host}:{kind}'
+        self._apply(request.meta['download_slot'], kind)
+        return None
+
+    def process_response(self, request, response, spider):
+        key = request.meta.get('download_slot')
+        if key not in self.slots or 'cached' in response.flags:
+            return response
+
+        if response.status in self.THROTTLE_CODES:
+            self._decrease(key, self._retry_after(response))
+        elif response.status < 500:
+            self._success(key, request.meta.get('download_latency'))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        key = request.meta.get('download_slot')
+        if key in self.slots:
+            self._decrease(key)
+        return None
+
+    def _apply(self, key, kind):
+        """Переносит состояние регулятора в слот загрузчика, создавая оба при необходимости"""
+        state = self.slots.get(key)
+        if state is None:
+            budget = self.budgets[kind]
+            state = self.slots[key] = {
+                'kind': kind,
+                'delay': budget['start_delay'],
+                'concurrency': budget['start_concurrency'],
+                'successes': 0,
+            }
+            self._export(state)
+
+        downloader_slots = self.crawler.engine.downloader.slots
+        slot = downloader_slots.get(key)
+        if slot is None:
+            downloader_slots[key] = Slot(state['concurrency'], state['delay'], self.randomize_delay)
+        else:
+            slot.delay = state['delay']
+            slot.concurrency = state['concurrency']
+
+    def _success(self, key, latency):
+        state = self.slots[key]
+        budget = self.budgets[state['kind']]
+        if latency is not None and latency > self.target_latency:
+            # Сайт замедляется: не разгоняемся, а чуть отпускаем параллельность
+            state['successes'] = 0
+            if state['concurrency'] > 1:
+                state['concurrency'] -= 1
+                self._changed(key, state, 'decrease')
+            return
+
+        state['successes'] += 1
+        changed = False
+        if state['delay'] > budget['min_delay']:
+            state['delay'] = max(budget['min_delay'], state['delay'] - budget['delay_step'])
+            changed = True
+        if state['successes'] >= state['concurrency'] and state['concurrency'] < budget['max_concurrency']:
+            state['concurrency'] += 1
+            state['successes'] = 0
+            changed = True
+        if changed:
+            self._changed(key, state, 'increase')
+
+    def _decrease(self, key, retry_after=None):
+        state = self.slots[key]
+        budget = self.budgets[state['kind']]
+        state['successes'] = 0
+        state['concurrency'] = max(1, state['concurrency'] // 2)
+        delay = max(state['delay'] * 2, budget['delay_step'])
+        if retry_after is not None:
+            self.stats.inc_value(f"throttle/{state['kind']}/retry_after")
+            delay = max(delay, retry_after)
+        state['delay'] = min(delay, budget['max_delay'])
+        self._changed(key, state, 'decrease')
+        logger.debug("Throttled %s: delay=%.2f concurrency=%d", key, state['delay'], state['concurrency'])
+
+    def _changed(self, key, state, direction):
+        self.stats.inc_value(f"throttle/{state['kind']}/{direction}")
+        self._export(state)
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            slot.delay = state['delay']
+            slot.concurrency = state['concurrency']
+
+    def _export(self, state):
+        kind = state['kind']
+        self.stats.set_value(f'throttle/{kind}/delay', round(state['delay'], 3))
+        self.stats.set_value(f'throttle/{kind}/concurrency', state['concurrency'])
+        self.stats.max_value(f'throttle/{kind}/max_delay', round(state['delay'], 3))
+        self.stats.max_value(f'throttle/{kind}/max_concurrency', state['concurrency'])
+
+    @staticmethod
+    def _retry_after(response):
+        """Retry-After в секундах (число или HTTP-дата) или None"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        value = value.decode('latin-1').strip()
+        if value.isdigit():
+            return float(value)
         try:
-            response = requests.get(
-                'https://autospot.ru/',
-                headers={
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    'Accept': 'application/json, text/plain, */*',
-                    'Origin': 'https://autospot.ru',
-                    'Referer': 'https://autospot.ru/'
-                },
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                logger.error("Failed to get page for token extraction: %s", response.status_code)
-                return None
-                
-            pattern = r'<script id="serverApp-state" type="application/json">(.*?)</script>'
-            match = re.search(pattern, response.text)
-            if not match:
-                logger.warning("Script serverApp-state not found on page")
-                return None
-                
-            data = json.loads(match.group(1))
-            token_key = next(
-                (key for key in data.keys() 
-                if 'api.autospot.ru/rest/oauth2/token' in key),
-                None
-            )
-            
-            if not token_key or 'body' not in data[token_key]:
-                logger.warning("Token key not found or 'body' missing")
-                return None
-                
-            access_token = data[token_key]['body'].get('access_token')
-            if not access_token:
-                logger.warning("Token not found in data")
-                return None
-                
-            self.token_info["token"] = access_token
-            self.token_info["timestamp"] = current_time
-            logger.info("Received new token")
-            return access_token
-                
-        except Exception as e:
-            logger.exception("Error getting token: %s", e)
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
             return None
+        now = datetime.datetime.now(when.tzinfo)
+        return max(0.0, (when - now).total_seconds())
@@ -0,0 +1,90 @@
+"""Разбор страниц объявлений в пуле процессов
+
+Когда задержки загрузки малы, потолок обхода - разбор serverApp-state и
+сборка объявлений в единственном потоке реактора. При
+AUTOSPOT_PARSE_WORKERS > 0 паук отдает тело страницы объявления в пул
+процессов, где тот же код паука (_extract_script_data, _extract_photos,
+_build_used_item/_build_new_item) собирает объявление и возвращает его
+словарем; в основном процессе остаются только запись в SeenStore и выдача.
+
+Одновременно в пуле не больше AUTOSPOT_PARSE_MAX_IN_FLIGHT задач:
+остальные ответы ждут своей очереди в колбэке, занимая место в слоте
+скрапера (SCRAPER_SLOT_MAX_ACTIVE_SIZE), и движок перестает брать новые
+ответы из загрузчика.
+"""
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy import signals
+from scrapy.http import HtmlResponse
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import defer
+
+from autospot_scrapy.utils import deferred_from_future
+
+logger = logging.getLogger(__name__)
+
+# Паук в процессе пула: создается при первой задаче
+_worker_spider = None
+
+
+def parse_detail(car_type, url, body, encoding):
+    """Объявление со страницы словарем (или None без serverApp-state); выполняется в пуле"""
+    global _worker_spider
+    if _worker_spider is None:
+        from autospot_scrapy.spiders.autospot_spider import AutospotSpider
+        _worker_spider = AutospotSpider()
+    spider = _worker_spider
+    response = HtmlResponse(url, body=body, encoding=encoding)
+    script_data = spider._extract_script_data(response)
+    if not script_data:
+        return None
+    photos = spider._extract_photos(response)
+    build = spider._build_used_item if car_type == 'used' else spider._build_new_item
+    return dict(build(url, script_data, photos))
+
+
+class ParsePool:
+    """Пул процессов разбора с ограничением числа задач в работе"""
+
+    def __init__(self, crawler, workers, max_in_flight=None):
+        self.crawler = crawler
+        self.workers = workers
+        self.max_in_flight = max_in_flight or workers * 2
+        self.semaphore = defer.DeferredSemaphore(self.max_in_flight)
+        # spawn, а не fork: процесс с запущенным реактором и потоками
+        # загрузчика копировать небезопасно
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler,
+            crawler.settings.getint('AUTOSPOT_PARSE_WORKERS'),
+            max_in_flight=crawler.settings.getint('AUTOSPOT_PARSE_MAX_IN_FLIGHT') or None
+        )
+
+    @property
+    def in_flight(self):
+        return self.max_in_flight - self.semaphore.tokens
+
+    async def parse(self, car_type, response):
+        """Словарь объявления со страницы response, собранный в пуле"""
+        stats = self.crawler.stats
+        if not self.semaphore.tokens:
+            stats.inc_value('parse_pool/waits')
+        await maybe_deferred_to_future(self.semaphore.acquire())
+        try:
+            stats.max_value('parse_pool/peak_in_flight', self.in_flight)
+            future = self.executor.submit(parse_detail, car_type, response.url, response.body, response.encoding)
+            values = await maybe_deferred_to_future(deferred_from_future(future))
+        finally:
+            self.semaphore.release()
+        stats.inc_value('parse_pool/jobs')
+        return values
+
+    def spider_closed(self, spider, reason):
+        self.executor.shutdown(wait=False, cancel_futures=True)
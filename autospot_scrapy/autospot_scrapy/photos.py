@@ -0,0 +1,175 @@
+"""Хранилище фотографий объявлений с адресацией по содержимому
+
+PhotosPipeline (autospot_scrapy.pipelines) загружает фотографии из поля
+photos через загрузчик Scrapy, а PhotoStore кладет каждую под именем
+sha256 содержимого:
+
+    <AUTOSPOT_PHOTOS_STORE>/full/ab/ab12...ef.png
+    <AUTOSPOT_PHOTOS_STORE>/thumbs/<имя>/ab/ab12...ef.jpg
+
+Одинаковые фотографии под разными url (стоковые фото дилеров) хранятся
+один раз. Индекс url -> хэш лежит в том же каталоге (index.sqlite): по
+нему при следующем обходе уже сохраненные фотографии не загружаются
+заново, и по нему же находится файл фотографии из объявления:
+
+    python -m autospot_scrapy.photos path https://image-server.autospot.ru/.../15530700.png
+    python -m autospot_scrapy.photos stats
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS blobs (
+        digest TEXT PRIMARY KEY,
+        path TEXT,
+        size INTEGER,
+        stored_at REAL
+    );
+    CREATE TABLE IF NOT EXISTS photos (
+        url TEXT PRIMARY KEY,
+        digest TEXT,
+        fetched_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS photos_digest ON photos (digest);
+"""
+
+
+def make_thumbnails(source, targets, quality=85):
+    """Уменьшенные копии source в JPEG: targets - [(путь, (ширина, высота))]; выполняется в пуле потоков
+
+    Pillow отпускает GIL на декодировании, масштабировании и сжатии, так
+    что потоки пула работают параллельно и тела фотографий не копируются
+    между процессами.
+    """
+    with Image.open(source) as image:
+        image = image.convert('RGB')
+        for path, size in targets:
+            thumbnail = image.copy()
+            thumbnail.thumbnail(size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            thumbnail.save(tmp_path, 'JPEG', quality=quality)
+            os.replace(tmp_path, path)
+    return len(targets)
+
+
+class PhotoStore:
+    """Файлы фотографий по sha256 содержимого и индекс url -> хэш в SQLite"""
+
+    def __init__(self, basedir, commit_every=200):
+        self.basedir = basedir
+        self.commit_every = commit_every
+        self._pending = 0
+        os.makedirs(basedir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(basedir, 'index.sqlite'))
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SCHEMA)
+
+    @staticmethod
+    def blob_path(digest, ext):
+        return f'full/{digest[:2]}/{digest}{ext}'
+
+    @staticmethod
+    def thumb_path(digest, name):
+        return f'thumbs/{name}/{digest[:2]}/{digest}.jpg'
+
+    def full_path(self, path):
+        return os.path.join(self.basedir, path)
+
+    def lookup(self, url, max_age=None, now=None):
+        """(хэш, путь) сохраненной фотографии url или None, если ее нет или она старше max_age секунд"""
+        row = self.conn.execute("""
+            SELECT photos.digest, blobs.path, photos.fetched_at FROM photos
+            JOIN blobs ON blobs.digest = photos.digest WHERE photos.url = ?
+        """, (url,)).fetchone()
+        if row is None:
+            return None
+        digest, path, fetched_at = row
+        if max_age and (now or time.time()) - fetched_at > max_age:
+            return None
+        if not os.path.exists(self.full_path(path)):
+            return None
+        return digest, path
+
+    def put(self, url, body, ext, now=None):
+        """Сохраняет фотографию url: (хэш, путь, True - новый файл или False - такая уже была)"""
+        now = now or time.time()
+        digest = hashlib.sha256(body).hexdigest()
+        row = self.conn.execute("SELECT path FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if row is not None and os.path.exists(self.full_path(row[0])):
+            path, new = row[0], False
+        else:
+            path, new = self.blob_path(digest, ext), True
+            full_path = self.full_path(path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            tmp_path = f'{full_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, full_path)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO blobs (digest, path, size, stored_at) VALUES (?, ?, ?, ?)",
+                (digest, path, len(body), now)
+            )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO photos (url, digest, fetched_at) VALUES (?, ?, ?)", (url, digest, now)
+        )
+        self._maybe_commit()
+        return digest, path, new
+
+    def stats(self):
+        photos, referenced = self.conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(blobs.size), 0) FROM photos JOIN blobs ON blobs.digest = photos.digest
+        """).fetchone()
+        blobs, stored = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {
+            'photos': photos,
+            'files': blobs,
+            'bytes': stored,
+            # Сколько заняли бы фотографии, если бы каждый url хранился отдельно
+            'bytes_saved': referenced - stored,
+        }
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def _maybe_commit(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+
+if __name__ == '__main__':
+    import json
+    from scrapy.utils.project import get_project_settings
+
+    parser = argparse.ArgumentParser(description='Look up stored car photos')
+    parser.add_argument('command', choices=('path', 'stats'))
+    parser.add_argument('url', nargs='*', help='Photo URLs (for path)')
+    parser.add_argument('--store', help='Photo store directory (default: AUTOSPOT_PHOTOS_STORE)')
+    args = parser.parse_args()
+
+    store = PhotoStore(args.store or get_project_settings().get('AUTOSPOT_PHOTOS_STORE'))
+    if args.command == 'stats':
+        print(json.dumps(store.stats(), indent=2))
+    else:
+        for url in args.url:
+            found = store.lookup(url)
+            print(f'{url}\t{store.full_path(found[1]) if found else "-"}')
+    store.close()
@@ -0,0 +1,537 @@
+"""Потоковая выгрузка объявлений шардами: JSON Lines и Parquet
+
+В отличие от FEEDS с одним JSON-массивом, объявления пишутся в файл сразу
+по мере разбора, по одному на строку (или группами строк в Parquet), и
+файл можно читать, не дожидаясь конца обхода и не загружая целиком.
+
+Шард пишется во временный <имя>.part и переименовывается в итоговое имя
+(os.replace) только когда он закрыт: при ротации по числу объявлений
+(AUTOSPOT_OUTPUT_SHARD_ITEMS) или размеру на диске
+(AUTOSPOT_OUTPUT_SHARD_BYTES) и в конце обхода. Все файлы без .part -
+целые.
+
+    AUTOSPOT_OUTPUT_FORMAT = 'jsonl'        # jsonl или parquet
+    AUTOSPOT_OUTPUT_PATH = 'data/%(time)s_autospot'
+    AUTOSPOT_OUTPUT_COMPRESSION = 'zstd'    # None, gzip или zstd
+
+дает data/2024-01-01_12-00-00_autospot-00001.jsonl.zst и т.д.
+
+Для Parquet нужен pyarrow; скалярные поля AutospotCarItem становятся
+типизированными колонками, фотографии - списком строк, а вложенные
+характеристики, опции и дилеры (для новых машин) - JSON-строками.
+
+С AUTOSPOT_RESUME_DIR шарды фиксируются в задании возобновляемого обхода
+(autospot_scrapy.checkpoint): префикс и номера шардов сохраняются между
+запусками, а объявления шарда помечаются выгруженными до переименования.
+
+CatalogPipeline (до выгрузки) заменяет опции и характеристики на id из
+справочника, см. autospot_scrapy.catalog. PhotosPipeline загружает
+фотографии объявлений в хранилище с адресацией по содержимому, см.
+autospot_scrapy.photos. HistoryPipeline (раньше справочника) ведет
+историю цен, пробега и наличия объявлений, см. autospot_scrapy.history.
+"""
+
+import gzip
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from itemadapter import ItemAdapter
+from scrapy import Request
+from scrapy.exceptions import NotConfigured
+from scrapy.http.request import NO_CALLBACK
+from scrapy.pipelines.files import FilesPipeline
+from scrapy.settings import Settings
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import defer
+
+from autospot_scrapy.catalog import Catalog, encode_bitmap
+from autospot_scrapy.history import HistoryStore
+from autospot_scrapy.items import AutospotCarItem, AutospotRemovedCarItem
+from autospot_scrapy.photos import Image, PhotoStore, make_thumbnails
+from autospot_scrapy.records import CarRecord
+from autospot_scrapy.utils import data_file, deferred_from_future
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+CAR_ITEMS = (AutospotCarItem, CarRecord)
+
+EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+# Сжатие колонок Parquet задается внутри файла, расширение не меняется
+PARQUET_CODECS = (None, 'snappy', 'gzip', 'zstd')
+
+STRING_FIELDS = ('url', 'brand', 'model', 'generation', 'color', 'city')
+INTEGER_FIELDS = ('price', 'year', 'mileage')
+JSON_FIELDS = ('characteristics', 'options')
+
+
+def json_line(item):
+    """Объявление одной строкой JSON (UTF-8, без экранирования кириллицы)"""
+    # Вложенные значения - обычные dict/list, рекурсивный asdict() не нужен
+    # и занимает больше времени, чем сама сериализация
+    data = dict(ItemAdapter(item))
+    if orjson is not None:
+        return orjson.dumps(data, default=str) + b'\n'
+    return json.dumps(data, ensure_ascii=False, default=str).encode('utf-8') + b'\n'
+
+
+def _json_text(value):
+    if value is None:
+        return None
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _integer(value):
+    try:
+        return int(value) if value is not None and value != '' else None
+    except (TypeError, ValueError):
+        return None
+
+
+def parquet_row(item):
+    """Плоская строка Parquet из AutospotCarItem"""
+    adapter = ItemAdapter(item)
+    row = {field: adapter.get(field) for field in STRING_FIELDS}
+    row.update((field, _integer(adapter.get(field))) for field in INTEGER_FIELDS)
+    row.update((field, _json_text(adapter.get(field))) for field in JSON_FIELDS)
+    row['photos'] = list(adapter.get('photos') or [])
+    # У подержанных машин - телефон дилера, у новых - список дилеров
+    dealer = adapter.get('dealer')
+    row['dealer'] = dealer if dealer is None or isinstance(dealer, str) else _json_text(dealer)
+    return row
+
+
+def parquet_schema():
+    fields = [(field, pyarrow.string()) for field in STRING_FIELDS]
+    fields += [(field, pyarrow.int64()) for field in INTEGER_FIELDS]
+    fields += [(field, pyarrow.string()) for field in JSON_FIELDS]
+    fields += [('photos', pyarrow.list_(pyarrow.string())), ('dealer', pyarrow.string())]
+    return pyarrow.schema(fields)
+
+
+class JsonLinesWriter:
+    """Шард JSON Lines, при необходимости сжатый gzip или zstd"""
+
+    extension = '.jsonl'
+
+    def __init__(self, path, compression=None):
+        self.raw = open(path, 'wb')
+        if compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=6)
+        elif compression == 'zstd':
+            self.stream = zstandard.ZstdCompressor(level=3).stream_writer(self.raw, closefd=False)
+        else:
+            self.stream = self.raw
+
+    def write(self, item):
+        self.stream.write(json_line(item))
+        return True
+
+    def size(self):
+        """Сколько уже на диске (сжатые данные отстают на буфер компрессора)"""
+        return self.raw.tell()
+
+    def close(self):
+        if self.stream is not self.raw:
+            self.stream.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+
+
+class ParquetWriter:
+    """Шард Parquet: объявления копятся и пишутся группами строк"""
+
+    extension = '.parquet'
+
+    def __init__(self, path, compression=None, row_group_size=1000):
+        self.raw = open(path, 'wb')
+        self.rows = []
+        self.row_group_size = row_group_size
+        self.schema = parquet_schema()
+        self.writer = pyarrow.parquet.ParquetWriter(self.raw, self.schema, compression=compression or 'none')
+
+    def write(self, item):
+        if not isinstance(item, CAR_ITEMS):
+            return False
+        self.rows.append(parquet_row(item))
+        if len(self.rows) >= self.row_group_size:
+            self._flush()
+        return True
+
+    def size(self):
+        return self.raw.tell()
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+
+    def _flush(self):
+        if self.rows:
+            self.writer.write_table(pyarrow.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+
+WRITERS = {'jsonl': JsonLinesWriter, 'parquet': ParquetWriter}
+
+
+class ShardedFeedPipeline:
+    """Пишет объявления в шарды AUTOSPOT_OUTPUT_FORMAT с атомарной финализацией"""
+
+    def __init__(self, crawler, output_format, path, compression=None, shard_items=0, shard_bytes=0):
+        if output_format not in WRITERS:
+            raise NotConfigured(f"Unknown output format: {output_format}")
+        if compression not in (PARQUET_CODECS if output_format == 'parquet' else EXTENSIONS):
+            raise NotConfigured(f"Unknown output compression: {compression}")
+        if output_format == 'parquet' and pyarrow is None:
+            raise NotConfigured("pyarrow is required for Parquet output")
+        if output_format == 'jsonl' and compression == 'zstd' and zstandard is None:
+            raise NotConfigured("zstandard is required for zstd-compressed output")
+        self.crawler = crawler
+        self.writer_class = WRITERS[output_format]
+        self.path = path % {'time': datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}
+        self.compression = compression
+        self.shard_items = shard_items
+        self.shard_bytes = shard_bytes
+        self.shard = 0
+        self.writer = None
+        self.shard_path = None
+        self.shard_count = 0
+        self.files = []
+        self.checkpoint = None
+        # Адреса объявлений текущего шарда (для задания возобновляемого обхода)
+        self.shard_urls = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        output_format = settings.get('AUTOSPOT_OUTPUT_FORMAT')
+        if not output_format:
+            raise NotConfigured
+        return cls(
+            crawler,
+            output_format,
+            settings.get('AUTOSPOT_OUTPUT_PATH', 'data/%(time)s_autospot'),
+            compression=settings.get('AUTOSPOT_OUTPUT_COMPRESSION') or None,
+            shard_items=settings.getint('AUTOSPOT_OUTPUT_SHARD_ITEMS', 0),
+            shard_bytes=settings.getint('AUTOSPOT_OUTPUT_SHARD_BYTES', 0)
+        )
+
+    def open_spider(self, spider):
+        self.checkpoint = getattr(spider, 'checkpoint', None)
+        if self.checkpoint is not None:
+            self.path = self.checkpoint.output_path(self.path)
+            self.checkpoint.recover_chunks(self.path)
+            self.shard = self.checkpoint.last_chunk()
+
+    def process_item(self, item, spider):
+        if self.writer is None:
+            self._open_shard()
+        if not self.writer.write(item):
+            self.crawler.stats.inc_value('output/skipped')
+            return item
+        if self.checkpoint is not None and isinstance(item, CAR_ITEMS):
+            self.shard_urls.append(ItemAdapter(item).get('url'))
+        self.shard_count += 1
+        self.crawler.stats.inc_value('output/items')
+        if (
+            (self.shard_items and self.shard_count >= self.shard_items)
+            or (self.shard_bytes and self.writer.size() >= self.shard_bytes)
+        ):
+            self._close_shard()
+        return item
+
+    def close_spider(self, spider):
+        if self.writer is not None:
+            self._close_shard()
+        logger.info("Wrote %d output shards: %s", len(self.files), ', '.join(self.files))
+
+    def _open_shard(self):
+        self.shard += 1
+        compression = self.compression if self.writer_class is JsonLinesWriter else None
+        self.shard_path = '%s-%05d%s%s' % (
+            self.path, self.shard, self.writer_class.extension, EXTENSIONS[compression]
+        )
+        directory = os.path.dirname(self.shard_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.writer = self.writer_class(self.shard_path + '.part', self.compression)
+        self.shard_count = 0
+        self.shard_urls = []
+
+    def _close_shard(self):
+        self.writer.close()
+        part = self.shard_path + '.part'
+        if self.shard_count:
+            if self.checkpoint is not None:
+                # Сначала фиксация в задании: шард без нее при возобновлении удаляется
+                self.checkpoint.commit_chunk(self.shard, self.shard_path, self.shard_urls, self.shard_count)
+                self.crawler.stats.inc_value('checkpoint/chunks')
+            os.replace(part, self.shard_path)
+            self.files.append(self.shard_path)
+            self.crawler.stats.inc_value('output/shards')
+            self.crawler.stats.inc_value('output/bytes', os.path.getsize(self.shard_path))
+            logger.info("Finalized output shard %s (%d items)", self.shard_path, self.shard_count)
+        else:
+            os.remove(part)
+        self.writer = None
+
+
+class HistoryPipeline:
+    """Записывает цену, пробег и наличие объявлений обхода в историю AUTOSPOT_HISTORY_FILE"""
+
+    def __init__(self, crawler, store):
+        self.crawler = crawler
+        self.store = store
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('AUTOSPOT_HISTORY_ENABLED'):
+            raise NotConfigured
+        return cls(crawler, HistoryStore(data_file(settings.get('AUTOSPOT_HISTORY_FILE', 'history.sqlite'))))
+
+    def open_spider(self, spider):
+        run_id = self.store.begin_run()
+        self.crawler.stats.set_value('history/run', run_id)
+
+    def process_item(self, item, spider):
+        if isinstance(item, AutospotRemovedCarItem):
+            self.store.remove(item['url'])
+            return item
+        if not isinstance(item, CAR_ITEMS):
+            return item
+        adapter = ItemAdapter(item)
+        self.store.observe(
+            adapter.get('url'), adapter.get('brand'), adapter.get('model'), adapter.get('city'),
+            _integer(adapter.get('price')), _integer(adapter.get('mileage'))
+        )
+        return item
+
+    def close_spider(self, spider):
+        store = self.store
+        store.end_run()
+        stats = self.crawler.stats
+        stats.set_value('history/observed', store.observed)
+        stats.set_value('history/changes', store.changes)
+        stats.set_value('history/new', store.new)
+        stats.set_value('history/cars', len(store.cars))
+        logger.info(
+            "History run %d: %d cars observed, %d changes (%d new cars)",
+            store.run_id, store.observed, store.changes, store.new
+        )
+        store.close()
+
+
+class CatalogPipeline:
+    """Заменяет опции и характеристики объявлений на id из справочника и ведет индекс"""
+
+    def __init__(self, crawler, catalog, encoding='ids', output=None):
+        if encoding not in (None, 'ids', 'bitmap'):
+            raise NotConfigured(f"Unknown catalog encoding: {encoding}")
+        self.crawler = crawler
+        self.catalog = catalog
+        self.encoding = encoding
+        self.output = output % {'time': datetime.now().strftime('%Y-%m-%d_%H-%M-%S')} if output else None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('AUTOSPOT_CATALOG_ENABLED'):
+            raise NotConfigured
+        return cls(
+            crawler,
+            Catalog(data_file(settings.get('AUTOSPOT_CATALOG_FILE', 'catalog.sqlite'))),
+            encoding=settings.get('AUTOSPOT_CATALOG_ENCODING', 'ids') or None,
+            output=settings.get('AUTOSPOT_CATALOG_OUTPUT')
+        )
+
+    def process_item(self, item, spider):
+        if isinstance(item, AutospotRemovedCarItem):
+            self.catalog.remove_car(item['url'])
+            return item
+        if not isinstance(item, CAR_ITEMS):
+            return item
+        adapter = ItemAdapter(item)
+        option_ids = self.catalog.encode_options(adapter.get('options'))
+        self.catalog.index_car(
+            adapter.get('url'), adapter.get('city'), adapter.get('brand'), adapter.get('model'),
+            _integer(adapter.get('price')), option_ids
+        )
+        if self.encoding == 'ids':
+            adapter['options'] = option_ids
+        elif self.encoding == 'bitmap':
+            adapter['options'] = encode_bitmap(option_ids)
+        if self.encoding:
+            adapter['characteristics'] = self.catalog.encode_characteristics(adapter.get('characteristics'))
+        return item
+
+    def close_spider(self, spider):
+        stats = self.crawler.stats
+        stats.set_value('catalog/options', len(self.catalog.options))
+        stats.set_value('catalog/characteristics', len(self.catalog.characteristics))
+        stats.set_value('catalog/added', self.catalog.added)
+        if self.output:
+            directory = os.path.dirname(self.output)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.output + '.part', 'w', encoding='utf-8') as f:
+                json.dump(self.catalog.export(), f, ensure_ascii=False)
+            os.replace(self.output + '.part', self.output)
+            logger.info("Wrote catalog %s", self.output)
+        self.catalog.close()
+
+
+class PhotosPipeline(FilesPipeline):
+    """Загружает фотографии объявлений через загрузчик Scrapy в PhotoStore
+
+    Запросы фотографий идут со своим типом ('photo'), поэтому у них свой
+    слот и бюджет в AdaptiveThrottleMiddleware (AUTOSPOT_THROTTLE_BUDGETS)
+    и они не кэшируются в HTTP-кэше. Объявление не меняется: файл
+    фотографии находится по url через индекс PhotoStore.
+    """
+
+    FILES_URLS_FIELD = 'photos'
+
+    def __init__(self, store_uri, download_func=None, settings=None):
+        if isinstance(settings, dict) or settings is None:
+            settings = Settings(settings)
+        super().__init__(store_uri, download_func=download_func, settings=settings)
+        self.photo_store = PhotoStore(store_uri)
+        self.per_item = settings.getint('AUTOSPOT_PHOTOS_PER_ITEM')
+        self.max_age = settings.getfloat('AUTOSPOT_PHOTOS_EXPIRES_DAYS') * 24 * 3600
+        self.thumbs = settings.getdict('AUTOSPOT_PHOTOS_THUMBS')
+        if self.thumbs and Image is None:
+            raise NotConfigured("Pillow is required for photo thumbnails")
+        self.executor = None
+        if self.thumbs:
+            self.executor = ThreadPoolExecutor(settings.getint('AUTOSPOT_PHOTOS_THUMB_WORKERS', 2) or None)
+        # Хэш -> Deferred миниатюр в работе: close_spider дожидается их
+        self.pending = {}
+        # Время первого запроса и последней загрузки фотографии - для photos/images_per_second
+        self.started = self.finished = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('AUTOSPOT_PHOTOS_ENABLED'):
+            raise NotConfigured
+        return super().from_crawler(crawler)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(os.path.abspath(settings.get('AUTOSPOT_PHOTOS_STORE', 'data/photos')), settings=settings)
+
+    def get_media_requests(self, item, info):
+        if not isinstance(item, CAR_ITEMS):
+            return []
+        urls = ItemAdapter(item).get(self.files_urls_field) or []
+        if self.per_item:
+            urls = urls[:self.per_item]
+        if urls and self.started is None:
+            self.started = time.monotonic()
+        self.crawler.stats.inc_value('photos/requested', len(urls))
+        return [Request(url, callback=NO_CALLBACK, meta={'request_kind': 'photo'}) for url in urls]
+
+    def media_to_download(self, request, info, *, item=None):
+        # Вместо stat файла по хэшу url - индекс: файл назван по хэшу содержимого
+        found = self.photo_store.lookup(request.url, max_age=self.max_age)
+        if found is None:
+            return None
+        self.crawler.stats.inc_value('photos/uptodate')
+        digest, path = found
+        return {'url': request.url, 'path': path, 'checksum': digest, 'status': 'uptodate'}
+
+    def media_downloaded(self, response, request, info, *, item=None):
+        result = super().media_downloaded(response, request, info, item=item)
+        result['path'] = request.meta.pop('photo_path', result['path'])
+        return result
+
+    def file_downloaded(self, response, request, info, *, item=None):
+        stats = self.crawler.stats
+        ext = os.path.splitext(urlparse_cached(request).path)[1].lower() or '.jpg'
+        digest, path, new = self.photo_store.put(request.url, response.body, ext)
+        stats.inc_value('photos/downloaded')
+        stats.inc_value('photos/bytes_downloaded', len(response.body))
+        self.finished = time.monotonic()
+        if new:
+            stats.inc_value('photos/stored')
+        else:
+            stats.inc_value('photos/deduplicated')
+            stats.inc_value('photos/bytes_saved', len(response.body))
+        if self.thumbs:
+            self._make_thumbnails(digest, path)
+        request.meta['photo_path'] = path
+        return digest
+
+    def item_completed(self, results, item, info):
+        failed = sum(1 for ok, _ in results if not ok)
+        if failed:
+            self.crawler.stats.inc_value('photos/failed', failed)
+        return item
+
+    def close_spider(self, spider):
+        deferred = defer.DeferredList(list(self.pending.values()))
+        deferred.addBoth(self._finish)
+        return deferred
+
+    def _make_thumbnails(self, digest, path):
+        if digest in self.pending:
+            return
+        targets = [
+            (self.photo_store.full_path(self.photo_store.thumb_path(digest, name)), tuple(size))
+            for name, size in self.thumbs.items()
+        ]
+        targets = [(target, size) for target, size in targets if not os.path.exists(target)]
+        if not targets:
+            return
+        future = self.executor.submit(make_thumbnails, self.photo_store.full_path(path), targets)
+        deferred = deferred_from_future(future)
+        self.pending[digest] = deferred
+        deferred.addCallbacks(self._thumbnails_done, self._thumbnails_failed, errbackArgs=(path,))
+        deferred.addBoth(self._thumbnails_finished, digest)
+
+    def _thumbnails_done(self, count):
+        self.crawler.stats.inc_value('photos/thumbnails', count)
+
+    def _thumbnails_failed(self, failure, path):
+        self.crawler.stats.inc_value('photos/thumbnail_errors')
+        logger.warning("Could not make thumbnails for %s: %s", path, failure.getErrorMessage())
+
+    def _thumbnails_finished(self, result, digest):
+        del self.pending[digest]
+        return result
+
+    def _finish(self, _):
+        stats = self.crawler.stats
+        if self.executor is not None:
+            self.executor.shutdown()
+        downloaded = stats.get_value('photos/downloaded', 0)
+        if downloaded and self.finished > self.started:
+            stats.set_value('photos/images_per_second', round(downloaded / (self.finished - self.started), 1))
+        store = self.photo_store.stats()
+        stats.set_value('photos/store_files', store['files'])
+        stats.set_value('photos/store_bytes_saved', store['bytes_saved'])
+        self.photo_store.close()
+        logger.info("Photo store %s: %s", self.photo_store.basedir, store)
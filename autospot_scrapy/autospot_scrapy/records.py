@@ -0,0 +1,219 @@
+"""Компактная запись объявления для обходов с ограничением памяти
+
+CarRecord заменяет AutospotCarItem при AUTOSPOT_COMPACT_ITEMS: поля лежат
+в __slots__, цена, год и пробег приводятся к int, марка, модель, цвет,
+город и названия опций и характеристик интернируются (sys.intern), а
+вложенные списки словарей хранятся плоскими кортежами:
+
+    characteristics  -> ((группа, название, значение), ...)
+    options          -> ((группа, (опция, ...)), ...)
+
+generation, совпадающий с моделью (как сейчас у всех объявлений), отдельно
+не хранится. Снаружи запись ведет себя как AutospotCarItem: item['поле']
+отдает значение в прежнем виде, а адаптер для itemadapter позволяет
+экспортерам и пайплайнам Scrapy работать с ней без изменений, так что
+выгрузка совпадает байт в байт.
+"""
+
+import sys
+from collections.abc import MutableMapping
+from types import MappingProxyType
+
+from itemadapter import ItemAdapter
+from itemadapter.adapter import AdapterInterface
+
+from autospot_scrapy.items import AutospotCarItem
+
+# Поля в порядке объявления в AutospotCarItem (и заполнения пауком) - в нем
+# они выгружаются; AutospotCarItem.fields отсортирован по алфавиту
+FIELDS = (
+    'url', 'brand', 'model', 'generation', 'price', 'year', 'mileage', 'color',
+    'characteristics', 'photos', 'city', 'dealer', 'options', 'configuration',
+)
+INTERNED_FIELDS = ('brand', 'model', 'color', 'city')
+INTEGER_FIELDS = ('price', 'year', 'mileage')
+
+# Метаданные полей для экспортеров (serializer и т.п.), как у AutospotCarItem
+FIELD_META = {field: MappingProxyType(AutospotCarItem.fields[field]) for field in FIELDS}
+
+_UNSET = object()
+_SAME_AS_MODEL = object()
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _integer(value):
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return value
+
+
+def _flatten_characteristics(groups):
+    """[{'name', 'list': [{'name', 'value'}]}] -> кортеж троек или None, если форма другая"""
+    if not isinstance(groups, list):
+        return None
+    flat = []
+    previous = _UNSET
+    for group in groups:
+        # Пустые группы и две подряд с одним названием плоский вид не передаст
+        if not isinstance(group, dict) or group.keys() != {'name', 'list'} or not group['list']:
+            return None
+        if group['name'] == previous:
+            return None
+        name = previous = _intern(group['name'])
+        for entry in group['list']:
+            if not isinstance(entry, dict) or entry.keys() != {'name', 'value'}:
+                return None
+            flat.append((name, _intern(entry['name']), _intern(entry['value'])))
+    return tuple(flat)
+
+
+def _expand_characteristics(flat):
+    groups = []
+    current = _UNSET
+    entries = None
+    for group_name, name, value in flat:
+        if group_name != current:
+            current = group_name
+            entries = []
+            groups.append({'name': group_name, 'list': entries})
+        entries.append({'name': name, 'value': value})
+    return groups
+
+
+def _pack_options(groups):
+    if not isinstance(groups, list):
+        return None
+    packed = []
+    for group in groups:
+        if not isinstance(group, dict) or group.keys() != {'name', 'list'}:
+            return None
+        packed.append((_intern(group['name']), tuple(_intern(name) for name in group['list'])))
+    return tuple(packed)
+
+
+def packed(field, value):
+    """characteristics/options в том виде, в каком их хранит CarRecord
+
+    Упакованное значение CarRecord принимает как есть, поэтому объявления с
+    общей конфигурацией (autospot_scrapy.configs) делят одну упаковку.
+    """
+    if field == 'characteristics':
+        return _flatten_characteristics(value) or value
+    if field == 'options':
+        return _pack_options(value) or value
+    return value
+
+
+class CarRecord(MutableMapping):
+    """Объявление в __slots__; item['поле'] - значение в виде AutospotCarItem"""
+
+    __slots__ = FIELDS
+
+    fields = AutospotCarItem.fields
+
+    def __init__(self, **values):
+        for field in FIELDS:
+            setattr(self, field, _UNSET)
+        for field, value in values.items():
+            self[field] = value
+
+    def __setitem__(self, field, value):
+        if field not in self.fields:
+            raise KeyError(f"CarRecord does not support field: {field}")
+        if field in INTERNED_FIELDS:
+            value = _intern(value)
+        elif field in INTEGER_FIELDS:
+            value = _integer(value)
+        elif field == 'generation':
+            if value is not None and value == self.get('model'):
+                value = _SAME_AS_MODEL
+            else:
+                value = _intern(value)
+        elif field in ('characteristics', 'options'):
+            value = packed(field, value)
+        elif field == 'photos' and isinstance(value, list):
+            value = tuple(value)
+        setattr(self, field, value)
+
+    def __getitem__(self, field):
+        if field not in self.fields:
+            raise KeyError(field)
+        value = getattr(self, field)
+        if value is _UNSET:
+            raise KeyError(field)
+        if value is _SAME_AS_MODEL:
+            return self.model if self.model is not _UNSET else None
+        if isinstance(value, tuple):
+            if field == 'characteristics':
+                return _expand_characteristics(value)
+            if field == 'options':
+                return [{'name': name, 'list': list(names)} for name, names in value]
+            return list(value)
+        return value
+
+    def __delitem__(self, field):
+        if getattr(self, field, _UNSET) is _UNSET:
+            raise KeyError(field)
+        setattr(self, field, _UNSET)
+
+    def __iter__(self):
+        return (field for field in FIELDS if getattr(self, field) is not _UNSET)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        # Метки _UNSET/_SAME_AS_MODEL не переживают pickle, поэтому по значениям
+        return (self.__class__, (), None, None, iter(list(self.items())))
+
+    def __repr__(self):
+        return f'CarRecord({dict(self)!r})'
+
+    def to_item(self):
+        return AutospotCarItem(self)
+
+
+class CarRecordAdapter(AdapterInterface):
+    """Адаптер itemadapter: экспортеры Scrapy видят CarRecord как обычное объявление"""
+
+    @classmethod
+    def is_item_class(cls, item_class):
+        return issubclass(item_class, CarRecord)
+
+    @classmethod
+    def get_field_meta_from_class(cls, item_class, field_name):
+        return FIELD_META[field_name]
+
+    @classmethod
+    def get_field_names_from_class(cls, item_class):
+        return list(FIELDS)
+
+    def field_names(self):
+        return self.item.fields.keys()
+
+    def __getitem__(self, field):
+        return self.item[field]
+
+    def __setitem__(self, field, value):
+        self.item[field] = value
+
+    def __delitem__(self, field):
+        del self.item[field]
+
+    def __iter__(self):
+        return iter(self.item)
+
+    def __len__(self):
+        return len(self.item)
+
+
+ItemAdapter.ADAPTER_CLASSES.appendleft(CarRecordAdapter)
@@ -0,0 +1,65 @@
+"""Быстрое извлечение данных из сырых байтов страницы без построения DOM
+
+Страницы autospot.ru - большой Angular SSR, а нужны из них только
+JSON serverApp-state и адреса фотографий галереи. Оба куска находятся
+поиском по байтам; если разметка не похожа на ожидаемую, вызывающий код
+возвращается к XPath.
+"""
+
+import re
+
+STATE_OPEN = b'<script id="serverApp-state" type="application/json">'
+SCRIPT_CLOSE = b'</script>'
+
+GALLERY_OPEN = b'<auto-gallery'
+IMG_SRC_RE = re.compile(rb'<img\b[^>]*?\ssrc="([^"]*)"')
+TAG_NAME_RE = re.compile(rb'<([a-z0-9-]+)')
+
+
+def find_state_json(body):
+    """Байты JSON из <script id="serverApp-state"> или None"""
+    start = body.find(STATE_OPEN)
+    if start == -1:
+        return None
+    start += len(STATE_OPEN)
+    end = body.find(SCRIPT_CLOSE, start)
+    if end == -1:
+        return None
+    return body[start:end]
+
+
+def gallery_regions(body):
+    """Диапазоны байтов элементов <auto-gallery> и <auto-gallery-image>
+
+    Вложенные элементы (auto-gallery-image внутри auto-gallery) поглощаются
+    внешним диапазоном, поэтому каждый img попадает в результат один раз.
+    """
+    regions = []
+    pos = body.find(GALLERY_OPEN)
+    while pos != -1:
+        tag = TAG_NAME_RE.match(body, pos).group(1)
+        if tag in (b'auto-gallery', b'auto-gallery-image'):
+            end = body.find(b'</' + tag + b'>', pos)
+            if end == -1:
+                return None
+            if regions and pos < regions[-1][1]:
+                regions[-1] = (regions[-1][0], max(regions[-1][1], end))
+            else:
+                regions.append((pos, end))
+        pos = body.find(GALLERY_OPEN, pos + 1)
+    return regions
+
+
+def find_gallery_sources(body):
+    """Значения src всех img в галерее в порядке документа или None"""
+    regions = gallery_regions(body)
+    if regions is None:
+        return None
+    sources = []
+    for start, end in regions:
+        for match in IMG_SRC_RE.finditer(body, start, end):
+            sources.append(match.group(1).decode('utf-8').replace('&amp;', '&'))
+    if regions and not sources:
+        # Галерея есть, а img не нашлись - разметка изменилась
+        return None
+    return sources
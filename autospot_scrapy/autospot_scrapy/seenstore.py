@@ -0,0 +1,116 @@
+"""Постоянное хранилище уже виденных объявлений для инкрементального обхода
+
+Для каждого объявления (ключ - путь страницы, не зависящий от домена)
+хранятся отпечаток карточки из списка (цена и пробег), отпечаток
+выгруженного объявления, ETag/Last-Modified страницы и время, когда
+объявление последний раз встречалось в списках.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(data):
+    """Стабильный отпечаток JSON-совместимых данных"""
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def card_fingerprint(card):
+    """Отпечаток карточки из списка: меняется только при смене цены или пробега"""
+    if not card:
+        return None
+    return fingerprint([(card.get('prices') or {}).get('price'), card.get('run')])
+
+
+class SeenStore:
+    """SQLite-хранилище объявлений, встреченных в прошлых обходах"""
+
+    def __init__(self, path, commit_every=500):
+        self.path = path
+        self.commit_every = commit_every
+        self._pending = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cars (
+                path TEXT PRIMARY KEY,
+                car_type TEXT,
+                card_fingerprint TEXT,
+                content_fingerprint TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                first_seen REAL,
+                last_seen REAL,
+                removed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS cars_last_seen ON cars (last_seen);
+        """)
+
+    def get(self, path):
+        return self.conn.execute("SELECT * FROM cars WHERE path = ?", (path,)).fetchone()
+
+    def touch(self, path, car_type, now=None):
+        """Отмечает, что объявление встретилось в списке в этом обходе"""
+        now = now or time.time()
+        self.conn.execute("""
+            INSERT INTO cars (path, car_type, first_seen, last_seen) VALUES (?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET last_seen = excluded.last_seen, removed_at = NULL
+        """, (path, car_type, now, now))
+        self._maybe_commit()
+
+    def record(self, path, car_type, card_fp, content_fp, etag=None, last_modified=None, now=None):
+        """Сохраняет результат загрузки страницы объявления"""
+        now = now or time.time()
+        self.conn.execute("""
+            INSERT INTO cars (path, car_type, card_fingerprint, content_fingerprint,
+                              etag, last_modified, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET
+                card_fingerprint = COALESCE(excluded.card_fingerprint, card_fingerprint),
+                content_fingerprint = excluded.content_fingerprint,
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                last_seen = excluded.last_seen,
+                removed_at = NULL
+        """, (path, car_type, card_fp, content_fp, etag, last_modified, now, now))
+        self._maybe_commit()
+
+    def not_modified(self, path, car_type, card_fp, now=None):
+        """Страница не изменилась (304): запоминается отпечаток карточки, с которым она проверена"""
+        now = now or time.time()
+        self.conn.execute("""
+            UPDATE cars SET card_fingerprint = COALESCE(?, card_fingerprint), car_type = ?,
+                            last_seen = ?, removed_at = NULL
+            WHERE path = ?
+        """, (card_fp, car_type, now, path))
+        self._maybe_commit()
+
+    def missing_since(self, run_started):
+        """Объявления, которые не встретились ни в одном списке с начала обхода"""
+        return self.conn.execute("""
+            SELECT * FROM cars WHERE last_seen < ? AND removed_at IS NULL
+        """, (run_started,)).fetchall()
+
+    def mark_removed(self, paths, now=None):
+        now = now or time.time()
+        self.conn.executemany(
+            "UPDATE cars SET removed_at = ? WHERE path = ?",
+            [(now, path) for path in paths]
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def _maybe_commit(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.conn.commit()
+            self._pending = 0
@@ -22,6 +22,53 @@ BOT_NAME = "autospot_scrapy"
 SPIDER_MODULES = ["autospot_scrapy.spiders"]
 NEWSPIDER_MODULE = "autospot_scrapy.spiders"
 
+# Адреса сайта и REST API (можно переопределить на локальный стаб)
+AUTOSPOT_BASE_URL = 'https://autospot.ru'
+AUTOSPOT_API_URL = 'https://api.autospot.ru/rest'
+AUTOSPOT_CITY_ID = 3
+
+# Токен API: файл в .scrapy/ переживает перезапуск, обновляется заранее
+AUTOSPOT_TOKEN_FILE = 'autospot_token.json'
+AUTOSPOT_TOKEN_REFRESH_AFTER = 22 * 3600
+AUTOSPOT_TOKEN_MAX_AGE = 23 * 3600
+
+# Инкрементальный обход: пропуск объявлений с неизменной ценой и пробегом
+AUTOSPOT_INCREMENTAL = False
+AUTOSPOT_SEEN_STORE = 'autospot_seen.sqlite'
+
+# Режим shallow: объявления собираются из карточек на страницах списков.
+# Если в карточке нет одного из полей AUTOSPOT_DEEP_FIELDS (или поле там
+# не бывает вовсе, как options), объявление загружается целиком
+AUTOSPOT_SHALLOW = False
+AUTOSPOT_DEEP_FIELDS = []
+
+# Замеры этапов обработки (статистика metrics/...). С портом, отличным
+# от 0, метрики отдаются в формате Prometheus на http://host:port/metrics;
+# AUTOSPOT_PROFILE_FRACTION - доля колбэков, выполняемых под cProfile
+AUTOSPOT_METRICS_ENABLED = True
+AUTOSPOT_METRICS_PORT = 0
+AUTOSPOT_METRICS_HOST = '127.0.0.1'
+AUTOSPOT_PROFILE_FRACTION = 0.0
+AUTOSPOT_PROFILE_DIR = 'profiles'
+
+# Режим службы (run_spider.py --daemon, autospot_scrapy.daemon): цикл
+# обхода каждые AUTOSPOT_DAEMON_INTERVAL секунд от начала предыдущего в
+# одном процессе. С портом, отличным от 0, на http://host:port/status
+# отдается состояние, а POST /trigger, /pause, /resume, /stop управляют
+# циклами. AUTOSPOT_DAEMON_WARM_POOL - один пул HTTP-соединений на все циклы
+AUTOSPOT_DAEMON_INTERVAL = 3600
+AUTOSPOT_DAEMON_CONTROL_PORT = 0
+AUTOSPOT_DAEMON_CONTROL_HOST = '127.0.0.1'
+AUTOSPOT_DAEMON_WARM_POOL = True
+AUTOSPOT_DAEMON_LOG = 'logs/daemon.log'
+
+# Архив ответов (autospot_scrapy.archive): с AUTOSPOT_ARCHIVE_FILE каждый
+# ответ дописывается в архив, с AUTOSPOT_REPLAY_ARCHIVE ответы берутся из
+# архива вместо сети (run_spider.py --record / --replay)
+AUTOSPOT_ARCHIVE_FILE = None
+AUTOSPOT_ARCHIVE_COMPRESSION = 'zstd'
+AUTOSPOT_REPLAY_ARCHIVE = None
+
 # Соблюдаем robots.txt
 ROBOTSTXT_OBEY = False
 
@@ -31,10 +78,55 @@ LOG_FILE = f'logs/{current_time}_autospot.log'
 LOG_FORMAT = '%(asctime)s [%(name)s] %(levelname)s: %(message)s'
 LOG_DATEFORMAT = '%Y-%m-%d %H:%M:%S'
 
-# Настройка параллельных запросов
-CONCURRENT_REQUESTS = 8
+# Настройка параллельных запросов. CONCURRENT_REQUESTS - общий потолок;
+# DOWNLOAD_DELAY действует только на слоты вне бюджетов регулятора ниже
+CONCURRENT_REQUESTS = 16
 DOWNLOAD_DELAY = 2
 
+# Страницы списков подаются лениво: следующая страница выдается, только
+# когда в очереди меньше AUTOSPOT_FRONTIER_MAX_PENDING запросов
+AUTOSPOT_FRONTIER_MAX_PENDING = 100
+AUTOSPOT_FRONTIER_LISTINGS_IN_FLIGHT = 4
+
+# Бюджеты обхода (autospot_scrapy.budget) по типу машин: {'used'|'new'|'*':
+# {'pages': страниц списков, 'requests': загрузок, 'bytes': байт тел,
+# 'seconds': секунд}}, и время всего обхода (0 - без ограничения).
+# AUTOSPOT_SAMPLE_PER_STRATUM > 0 - не больше стольких объявлений на страту
+# (марку, а с 'city' в AUTOSPOT_SAMPLE_STRATA - марку и город)
+AUTOSPOT_CRAWL_BUDGETS = {}
+AUTOSPOT_CRAWL_SECONDS = 0
+AUTOSPOT_SAMPLE_PER_STRATUM = 0
+AUTOSPOT_SAMPLE_STRATA = ['brand']
+
+# Адаптивный регулятор скорости (AdaptiveThrottleMiddleware): свой слот и
+# бюджет для списков, объявлений, фотографий и запроса за токеном. Задержка в секундах
+AUTOSPOT_THROTTLE_ENABLED = True
+AUTOSPOT_THROTTLE_TARGET_LATENCY = 2.0
+AUTOSPOT_THROTTLE_BUDGETS = {
+    'list': {'start_delay': 2.0, 'min_delay': 0.5, 'max_delay': 60.0, 'start_concurrency': 1, 'max_concurrency': 2},
+    'detail': {'start_delay': 1.0, 'min_delay': 0.1, 'max_delay': 60.0, 'start_concurrency': 2, 'max_concurrency': 12},
+    'token': {'start_delay': 0.0, 'min_delay': 0.0, 'max_delay': 60.0, 'start_concurrency': 1, 'max_concurrency': 1},
+    'photo': {'start_delay': 0.1, 'min_delay': 0.0, 'max_delay': 30.0, 'start_concurrency': 4, 'max_concurrency': 16},
+}
+
+# Транспорт (autospot_scrapy.transport): пул соединений на хост (0 - по
+# параллельности слотов регулятора), сколько секунд держать простаивающее
+# соединение, HTTP/2 для https (нужен пакет h2) и время жизни записей кэша DNS
+DOWNLOAD_HANDLERS = {
+    'http': 'autospot_scrapy.transport.PooledHTTP11DownloadHandler',
+    'https': 'autospot_scrapy.transport.PooledHTTP11DownloadHandler',
+}
+DNS_RESOLVER = 'autospot_scrapy.transport.CachingResolver'
+AUTOSPOT_POOL_PER_HOST = 0
+AUTOSPOT_POOL_IDLE_TIMEOUT = 240
+AUTOSPOT_HTTP2 = False
+AUTOSPOT_DNS_TTL = 300
+
+# Возобновляемый обход (autospot_scrapy.checkpoint): каталог задания с
+# состоянием обхода и объявлений в одном фиксируемом шарде выгрузки
+AUTOSPOT_RESUME_DIR = None
+AUTOSPOT_RESUME_CHUNK_ITEMS = 100
+
 # Настройка повторных попыток
 RETRY_ENABLED = True
 RETRY_TIMES = 5
@@ -54,10 +146,14 @@ FAKEUSERAGENT_PROVIDERS = [
 ]
 
 DOWNLOADER_MIDDLEWARES = {
+    'autospot_scrapy.distributed.DistributedMiddleware': 50,
+    'autospot_scrapy.budget.BudgetMiddleware': 60,
     'autospot_scrapy.middlewares.TokenMiddleware': 543,
+    'autospot_scrapy.middlewares.AdaptiveThrottleMiddleware': 570,
     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
     'scrapy.downloadermiddlewares.retry.RetryMiddleware': 560,
     'scrapy_fake_useragent.middleware.RandomUserAgentMiddleware': 545,
+    'autospot_scrapy.archive.ArchiveMiddleware': 650,
 }
 
 # Настройка feeds
@@ -70,17 +166,98 @@ FEEDS = {
     }
 }
 
+# Потоковая выгрузка шардами (autospot_scrapy.pipelines): формат jsonl или
+# parquet, None - только FEEDS. Ротация шарда по числу объявлений и/или
+# размеру файла, 0 - без ограничения
+AUTOSPOT_OUTPUT_FORMAT = None
+AUTOSPOT_OUTPUT_PATH = 'data/%(time)s_autospot'
+AUTOSPOT_OUTPUT_COMPRESSION = 'zstd'
+AUTOSPOT_OUTPUT_SHARD_ITEMS = 0
+AUTOSPOT_OUTPUT_SHARD_BYTES = 0
+
+# Компактные объявления (autospot_scrapy.records.CarRecord) вместо
+# AutospotCarItem: меньше памяти на объявление, выгрузка та же
+AUTOSPOT_COMPACT_ITEMS = False
+
+# Кэш конфигураций (autospot_scrapy.configs): характеристики и опции,
+# общие для объявлений одной комплектации, обрабатываются один раз.
+# Окупается, когда конфигурации повторяются (новые машины у разных
+# дилеров); у подержанных опции почти у всех свои, и хэш тела дороже
+# повторной обработки. Размер - тел каждого эндпоинта в LRU; ключи по
+# идентификаторам из основных данных объявления вместо хэша тела, например
+# {'car/all-characteristics': ['model_carcase_id', 'engine_type', ...]}.
+# С AUTOSPOT_CONFIG_REFS объявления ссылаются на конфигурацию по id, а
+# она выгружается один раз отдельной записью (включает и кэш)
+AUTOSPOT_CONFIG_CACHE_ENABLED = False
+AUTOSPOT_CONFIG_CACHE_SIZE = 2048
+AUTOSPOT_CONFIG_KEY_FIELDS = {}
+AUTOSPOT_CONFIG_REFS = False
+
+# Разбор страниц объявлений в пуле процессов (autospot_scrapy.parsing):
+# число процессов (0 - в потоке реактора) и задач в работе одновременно
+# (0 - вдвое больше процессов)
+AUTOSPOT_PARSE_WORKERS = 0
+AUTOSPOT_PARSE_MAX_IN_FLIGHT = 0
+
+# Фотографии объявлений (autospot_scrapy.photos): хранилище с адресацией по
+# содержимому, фотографий на объявление (0 - все), через сколько дней
+# загружать сохраненную фотографию заново (0 - никогда), миниатюры
+# {имя: [ширина, высота]} (нужен Pillow) и потоков для них
+AUTOSPOT_PHOTOS_ENABLED = False
+AUTOSPOT_PHOTOS_STORE = 'data/photos'
+AUTOSPOT_PHOTOS_PER_ITEM = 0
+AUTOSPOT_PHOTOS_EXPIRES_DAYS = 0
+AUTOSPOT_PHOTOS_THUMBS = {}
+AUTOSPOT_PHOTOS_THUMB_WORKERS = 2
+
+# Справочник опций и характеристик (autospot_scrapy.catalog): в объявлениях
+# вместо строк id ('ids') или битовая маска опций ('bitmap'), None - только
+# индекс для запросов. Справочник выгружается в AUTOSPOT_CATALOG_OUTPUT
+AUTOSPOT_CATALOG_ENABLED = False
+AUTOSPOT_CATALOG_FILE = 'catalog.sqlite'
+AUTOSPOT_CATALOG_ENCODING = 'ids'
+AUTOSPOT_CATALOG_OUTPUT = 'data/%(time)s_catalog.json'
+
+# История цен, пробега и наличия объявлений по обходам (autospot_scrapy.history):
+# HistoryPipeline дописывает изменения в AUTOSPOT_HISTORY_FILE (внутри .scrapy/)
+AUTOSPOT_HISTORY_ENABLED = False
+AUTOSPOT_HISTORY_FILE = 'history.sqlite'
+
 # Настройка кэширования
 HTTPCACHE_ENABLED = True
 HTTPCACHE_EXPIRATION_SECS = 3600
 HTTPCACHE_DIR = 'httpcache'
 HTTPCACHE_IGNORE_HTTP_CODES = [500, 502, 503, 504, 408, 429]
 
+# Кэш в одном файле SQLite (.scrapy/httpcache.sqlite) со сжатием и
+# дедупликацией тел. Срок жизни по типу запроса: None - не кэшировать,
+# 0 - бессрочно, нет в словаре - HTTPCACHE_EXPIRATION_SECS
+HTTPCACHE_STORAGE = 'autospot_scrapy.httpcache.SqliteCacheStorage'
+AUTOSPOT_HTTPCACHE_FILE = 'httpcache.sqlite'
+AUTOSPOT_HTTPCACHE_TTLS = {
+    'token': None,
+    'list': 600,
+    'detail': 24 * 3600,
+    'photo': None,
+}
+AUTOSPOT_HTTPCACHE_MAX_BYTES = 512 * 1024 * 1024
+AUTOSPOT_HTTPCACHE_COMPRESSION = 'zstd'
+
+# Распределенный обход (autospot_scrapy.distributed): файл общей очереди
+# (None - обычный обход), имя воркера (по умолчанию хост-pid), срок аренды
+# задачи, число попыток и задач, которые воркер берет за раз. Планировщик
+# autospot_scrapy.distributed.SharedQueueScheduler включает run_spider.py --queue
+AUTOSPOT_QUEUE_FILE = None
+AUTOSPOT_WORKER_NAME = None
+AUTOSPOT_QUEUE_LEASE_SECONDS = 300
+AUTOSPOT_QUEUE_MAX_ATTEMPTS = 3
+AUTOSPOT_QUEUE_LEASE_BATCH = 4
+
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "autospot_scrapy.middlewares.AutospotScrapySpiderMiddleware": 543,
-#}
+SPIDER_MIDDLEWARES = {
+    'autospot_scrapy.distributed.DistributedMiddleware': 900,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
@@ -90,9 +267,12 @@ HTTPCACHE_IGNORE_HTTP_CODES = [500, 502, 503, 504, 408, 429]
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "autospot_scrapy.pipelines.AutospotScrapyPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "autospot_scrapy.pipelines.HistoryPipeline": 650,
+    "autospot_scrapy.pipelines.CatalogPipeline": 700,
+    "autospot_scrapy.pipelines.ShardedFeedPipeline": 800,
+    "autospot_scrapy.pipelines.PhotosPipeline": 900,
+}
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -116,5 +296,6 @@ HTTPCACHE_IGNORE_HTTP_CODES = [500, 502, 503, 504, 408, 429]
 #HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
 # Set settings whose default value is deprecated to a future-proof value
+REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
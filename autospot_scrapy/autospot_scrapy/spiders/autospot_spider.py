@@ -1,39 +1,245 @@
 import scrapy
-import json
 import re
 import logging
+import time
+from datetime import datetime
+from functools import partial
+from urllib.parse import urlparse
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 from scrapy.http import Request
-from autospot_scrapy.items import AutospotCarItem
+from autospot_scrapy.budget import CrawlBudget
+from autospot_scrapy.checkpoint import CrawlCheckpoint
+from autospot_scrapy.configs import ConfigurationCache
+from autospot_scrapy.frontier import DETAIL_PRIORITY, LISTING_PRIORITY, Frontier
+from autospot_scrapy.items import AutospotCarItem, AutospotConfigurationItem, AutospotRemovedCarItem
+from autospot_scrapy.metrics import Metrics
+from autospot_scrapy.parsing import ParsePool
+from autospot_scrapy.records import CarRecord, packed
+from autospot_scrapy.scanner import find_gallery_sources, find_state_json
+from autospot_scrapy.seenstore import SeenStore, card_fingerprint, fingerprint
+from autospot_scrapy.state import ENDPOINT_HANDLERS, ServerState, endpoint_path, json_loads
+from autospot_scrapy.utils import data_file
 
 logger = logging.getLogger(__name__)
 
+# Канонический адрес REST API: по нему ищутся ключи в serverApp-state,
+# поэтому ответы API раскладываются под этими же ключами
+API_STATE_URL = "https://api.autospot.ru/rest/"
+
+# Эндпоинты, из которых в режиме API собирается объявление Б/У авто
+USED_CAR_API_PARTS = (
+    "v2/used-car/cars/{car_id}/?city_ids[0]={city_id}&radius=0",
+    "car/all-characteristics/?car_id={car_id}&car_type=used",
+    "used-car/options-two-column/{car_id}/",
+    "car/gallery/?car_id={car_id}&car_type=used",
+)
+
+# Эндпоинты конфигурации объявления: характеристики и опции по типу машин
+CHARACTERISTICS_PATH = 'car/all-characteristics'
+OPTIONS_PATHS = {'used': 'used-car/options-two-column', 'new': 'car/all-options-two-column'}
+
+# Ключ state режима API, под которым лежат незагруженные части из кэша конфигураций
+CACHED_PARTS = 'cached_parts'
+
+
+def _same_value(value):
+    return value
+
+
 class AutospotSpider(scrapy.Spider):
     name = "autospot"
     allowed_domains = ["autospot.ru"]
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, mode='html', **kwargs):
         super(AutospotSpider, self).__init__(*args, **kwargs)
-        self.used_cars_url = "https://autospot.ru/used-car/?sort=-views_count&limit=12&page="
-        self.new_cars_url = "https://autospot.ru/filters/?sort=-percent_discount&limit=12&page="
+        if mode not in ('html', 'api'):
+            raise ValueError(f"Unknown crawl mode: {mode}")
+        self.mode = mode
+        self._set_base_urls("https://autospot.ru", "https://api.autospot.ru/rest", 3)
+        self.seen_store = None
+        self.checkpoint = None
+        self.frontier = None
+        self.budget = None
+        self.metrics = Metrics()
+        self.shallow = False
+        self.deep_fields = []
+        # AutospotCarItem или компактный CarRecord (AUTOSPOT_COMPACT_ITEMS)
+        self.item_class = AutospotCarItem
+        self.parse_pool = None
+        self.configs = None
+        self.config_refs = False
+        # id конфигураций, уже выгруженных в этом обходе (AUTOSPOT_CONFIG_REFS)
+        self.emitted_configurations = set()
+        self.run_started = time.time()
+        self._listing_failed = False
+        self._tombstones_scheduled = False
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider._set_base_urls(
+            crawler.settings.get('AUTOSPOT_BASE_URL', spider.base_url),
+            crawler.settings.get('AUTOSPOT_API_URL', spider.api_url),
+            crawler.settings.getint('AUTOSPOT_CITY_ID', 3)
+        )
+        spider.frontier = Frontier.from_crawler(crawler)
+        spider.budget = CrawlBudget.from_crawler(
+            crawler, max_pages=getattr(spider, 'max_pages', None), frontier=spider.frontier
+        )
+        spider.metrics = Metrics.from_crawler(crawler)
+        spider.shallow = crawler.settings.getbool('AUTOSPOT_SHALLOW')
+        spider.deep_fields = crawler.settings.getlist('AUTOSPOT_DEEP_FIELDS')
+        if crawler.settings.getbool('AUTOSPOT_COMPACT_ITEMS'):
+            spider.item_class = CarRecord
+        spider.config_refs = crawler.settings.getbool('AUTOSPOT_CONFIG_REFS')
+        if spider.config_refs or crawler.settings.getbool('AUTOSPOT_CONFIG_CACHE_ENABLED'):
+            spider.configs = ConfigurationCache.from_crawler(crawler)
+        if crawler.settings.getint('AUTOSPOT_PARSE_WORKERS'):
+            spider.parse_pool = ParsePool.from_crawler(crawler)
+        if crawler.settings.get('AUTOSPOT_RESUME_DIR'):
+            spider.checkpoint = CrawlCheckpoint(crawler.settings.get('AUTOSPOT_RESUME_DIR'))
+            # Задание продолжается в том режиме, в котором начато
+            spider.mode = spider.checkpoint.get_value('mode', spider.mode)
+            spider.checkpoint.set_value('mode', spider.mode)
+        if crawler.settings.getbool('AUTOSPOT_INCREMENTAL'):
+            spider.seen_store = SeenStore(data_file(crawler.settings.get('AUTOSPOT_SEEN_STORE')))
+            crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    def closed(self, reason):
+        if self.seen_store is not None:
+            self.seen_store.close()
+        if self.checkpoint is not None:
+            counts = self.checkpoint.counts()
+            if reason == 'finished':
+                self.checkpoint.set_value('finished', time.time())
+            logger.info(
+                "Checkpoint: %d cars done, %d pending, %d listing pages, %d chunks",
+                counts['done'], counts['pending'], counts['listing_pages'], counts['chunks']
+            )
+            self.checkpoint.close()
+
+    def _set_base_urls(self, base_url, api_url, city_id):
+        """Настраивает адреса сайта и API (например, на локальный стаб)"""
+        self.base_url = base_url.rstrip('/')
+        self.api_url = api_url.rstrip('/') + '/'
+        self.city_id = city_id
+        self.used_cars_url = self.base_url + "/used-car/?sort=-views_count&limit=12&page="
+        self.new_cars_url = self.base_url + "/filters/?sort=-percent_discount&limit=12&page="
+        self.used_cars_api_url = (
+            self.api_url + "v2/used-car/cars/?city_ids[0]=%d&limit=12&mode=0"
+            "&options=&radius=0&sort=-views_count&page=" % city_id
+        )
+        for url in (self.base_url, self.api_url):
+            host = urlparse(url).hostname
+            if host and not any(host == d or host.endswith('.' + d) for d in self.allowed_domains):
+                self.allowed_domains = self.allowed_domains + [host]
+    
+    def _rebase_url(self, url):
+        """Переносит абсолютную ссылку сайта на настроенный AUTOSPOT_BASE_URL"""
+        parsed = urlparse(url)
+        return self.base_url + parsed.path + ('?' + parsed.query if parsed.query else '')
     
     def start_requests(self):
+        if self.checkpoint is not None and self.checkpoint.resumed:
+            yield from self._resume_requests()
+            return
         # Начинаем с первых страниц обоих типов авто
-        yield Request(
-            url=self.used_cars_url + "1",
-            callback=self.parse_cars_list,
-            meta={'needs_token': True, 'page': 1, 'car_type': 'used'}
-        )
+        if self.mode == 'api':
+            yield self._listing_request(self.used_cars_api_url, 1, 'used', self.parse_api_cars_list)
+        else:
+            yield self._listing_request(self.used_cars_url, 1, 'used', self.parse_cars_list)
         
-        yield Request(
-            url=self.new_cars_url + "1",
-            callback=self.parse_cars_list,
-            meta={'needs_token': True, 'page': 1, 'car_type': 'new'}
+        # Для новых авто в API нет известного эндпоинта списка, поэтому
+        # они всегда обходятся через HTML
+        yield self._listing_request(self.new_cars_url, 1, 'new', self.parse_cars_list)
+
+    def _resume_requests(self):
+        """Запросы продолжения задания: неразобранные страницы списков и незагруженные объявления"""
+        if self.checkpoint.get_value('finished'):
+            logger.info("Job in %s has already finished, nothing to resume", self.checkpoint.directory)
+            return
+        used_callback = self.parse_api_cars_list if self.mode == 'api' else self.parse_cars_list
+        for car_type, callback in (('used', used_callback), ('new', self.parse_cars_list)):
+            if not self.checkpoint.listing_is_done(car_type, 1):
+                yield self._listing_request(self._listing_base(car_type), 1, car_type, callback)
+        streams = 0
+        for car_type, callback, pages in self.checkpoint.streams():
+            if pages:
+                self.frontier.add_stream(
+                    f'{car_type}:{self._listing_base(car_type)}', 0,
+                    partial(self._listing_request, self._listing_base(car_type), car_type=car_type,
+                            callback=getattr(self, callback)),
+                    pages=pages
+                )
+                streams += len(pages)
+        pending = self.checkpoint.pending_cars()
+        logger.info("Resuming job in %s: %d listing pages and %d cars left",
+                    self.checkpoint.directory, streams, len(pending))
+        self.crawler.stats.set_value('checkpoint/resumed_cars', len(pending))
+        for path, car_type, callback, card_fp in pending:
+            # Пул разбора мог быть включен или выключен между запусками
+            callback = self.parse_api_car_part if callback == 'parse_api_car_part' else self._detail_callback(car_type)
+            yield self._car_request(self.base_url + path, car_type, callback, card_fp)
+
+    def _detail_callback(self, car_type):
+        if self.parse_pool is not None:
+            return self.parse_car_info_offloaded
+        return self.parse_new_car_info if car_type == 'new' else self.parse_used_car_info
+
+    def _known_car(self, url):
+        """Объявление уже выдано в загрузку в этом задании (возможно, прошлым запуском)"""
+        if self.checkpoint is None or url not in self.checkpoint:
+            return False
+        self.crawler.stats.inc_value('checkpoint/known_cars')
+        return True
+
+    def _listing_base(self, car_type):
+        if car_type == 'new':
+            return self.new_cars_url
+        return self.used_cars_api_url if self.mode == 'api' else self.used_cars_url
+
+    def _car_request(self, url, car_type, callback, card_fp):
+        """Первый запрос объявления: страница или первая часть API"""
+        if callback == self.parse_api_car_part:
+            car_id = re.search(r'/(\d+)/?$', url).group(1)
+            parts = [part.format(car_id=car_id, city_id=self.city_id) for part in USED_CAR_API_PARTS]
+            request = self._api_part_request(car_url=url, state={}, parts=parts)
+            request.meta['card_fingerprint'] = card_fp
+            return request
+        meta = {'request_kind': 'detail', 'needs_token': False, 'card_fingerprint': card_fp, 'car_type': car_type}
+        headers = self._conditional_headers(url, meta)
+        return Request(
+            url=url,
+            callback=callback,
+            headers=headers,
+            meta=meta,
+            priority=DETAIL_PRIORITY
+        )
+
+    def _listing_done(self, request):
+        """Страница списка разобрана: отметка в задании и следующая страница из фронтира"""
+        if self.checkpoint is not None:
+            self.checkpoint.listing_done(request.meta['car_type'], request.meta['page'])
+        self.frontier.page_done(request)
+
+    def _listing_request(self, base_url, page, car_type, callback):
+        """Запрос страницы списка; у каждой страницы свой словарь meta"""
+        return Request(
+            url=base_url + str(page),
+            callback=callback,
+            errback=self._listing_error,
+            meta={'request_kind': 'list', 'needs_token': True, 'page': page, 'car_type': car_type},
+            priority=LISTING_PRIORITY,
+            dont_filter=page > 1
         )
     
     def parse_cars_list(self, response):
         page = response.meta.get('page', 1)
         car_type = response.meta.get('car_type', 'new')
-        max_page = self._get_max_page(response)
+        with self.metrics.stage('max_page', car_type):
+            max_page = self._get_max_page(response)
         logger.info("Detected %d pages of %s cars", max_page, car_type)
         
         # Обрабатываем текущую страницу
@@ -41,35 +247,144 @@ class AutospotSpider(scrapy.Spider):
             response=response,
             page=page,
             car_type=car_type,
-            callback=self.parse_new_car_info if car_type == 'new' else self.parse_used_car_info
+            callback=self._detail_callback(car_type)
         )
         
-        # Запускаем параллельный парсинг остальных страниц
+        # Остальные страницы выдаются лениво, по мере разбора объявлений
         if page == 1:
             base_url = self.new_cars_url if car_type == 'new' else self.used_cars_url
-            yield from self._schedule_pagination(
-                base_url=base_url,
-                max_page=max_page,
-                callback=self.parse_cars_list,
-                meta={'car_type': car_type}
-            )
+            self._add_listing_stream(base_url, max_page, car_type, self.parse_cars_list)
+        self._listing_done(response.request)
+
+    def _add_listing_stream(self, base_url, max_page, car_type, callback):
+        pages = self.budget.listing_pages(car_type, max_page) if self.budget is not None else None
+        if self.checkpoint is not None:
+            self.checkpoint.add_stream(car_type, callback.__name__, range(2, max_page + 1) if pages is None else pages)
+        self.frontier.add_stream(
+            f'{car_type}:{base_url}', max_page,
+            lambda page: self._listing_request(base_url, page, car_type, callback),
+            pages=pages
+        )
     
+    def parse_api_cars_list(self, response):
+        """Обрабатывает страницу списка Б/У авто, полученную из REST API"""
+        page = response.meta.get('page', 1)
+        with self.metrics.stage('api_list', 'used'):
+            body = json_loads(response.body)
+        max_page = body.get('meta', {}).get('pageCount', 1)
+        cars = body.get('items', [])
+        logger.info("Found %d used cars on API page %d of %d", len(cars), page, max_page)
+
+        for car in cars:
+            car_url = car.get('url', '')
+            match = re.search(r'/(\d+)/?$', car_url)
+            if not match:
+                logger.warning("Unexpected car url in API list: %s", car_url)
+                continue
+            car_url = self._rebase_url(car_url)
+            if self._known_car(car_url):
+                continue
+            if self.budget is not None and not self.budget.take('used', car_url, car):
+                continue
+            card_fp = self._check_seen(car_url, 'used', car)
+            if card_fp is False:
+                continue
+            if self.checkpoint is not None:
+                self.checkpoint.add_car(car_url, 'used', 'parse_api_car_part', card_fp)
+            if self.shallow:
+                item = self._build_card_item(car_url, car)
+                if item is not None:
+                    yield item
+                    continue
+            yield self._car_request(car_url, 'used', self.parse_api_car_part, card_fp)
+
+        if page == 1:
+            self._add_listing_stream(self.used_cars_api_url, max_page, 'used', self.parse_api_cars_list)
+        self._listing_done(response.request)
+
+    def parse_api_car_part(self, response, car_url, state, parts):
+        """Собирает ответы API по одному авто и отдает объявление после последнего"""
+        with self.metrics.stage('api_part', 'used'):
+            state['G.' + API_STATE_URL + response.meta['api_part']] = {
+                'body': json_loads(response.body)
+            }
+        if parts and self.configs is not None and response.meta['api_part'].startswith('v2/used-car/cars'):
+            parts = self._skip_cached_parts(state, parts)
+        if parts:
+            request = self._api_part_request(car_url, state, parts)
+            request.meta['card_fingerprint'] = response.meta.get('card_fingerprint')
+            yield request
+            return
+
+        logger.info("Processing used car via API: %s", car_url)
+        with self.metrics.stage('build', 'used'):
+            state = ServerState(state)
+            item = self._build_used_item(car_url, state, state.get('car/gallery'))
+        with self.metrics.stage('store', 'used'):
+            keep = self._remember(car_url, 'used', item, response)
+        if keep:
+            yield from self._configuration_items(item)
+            yield item
+
+    def _skip_cached_parts(self, state, parts):
+        """Убирает из оставшихся частей API те, что уже есть в кэше конфигураций
+
+        Ключом служат идентификаторы из основных данных объявления
+        (AUTOSPOT_CONFIG_KEY_FIELDS), найденная запись кладется в state.
+        """
+        car_data = ServerState(state).body('v2/used-car/cars')
+        remaining = []
+        for part in parts:
+            path = endpoint_path(API_STATE_URL + part)
+            entry = None
+            if path in (CHARACTERISTICS_PATH, OPTIONS_PATHS['used']):
+                entry = self.configs.cached(path, car_data)
+            if entry is not None:
+                state.setdefault(CACHED_PARTS, {})[path] = entry
+            else:
+                remaining.append(part)
+        return remaining
+
+    def _api_part_request(self, car_url, state, parts):
+        return Request(
+            url=self.api_url + parts[0],
+            callback=self.parse_api_car_part,
+            cb_kwargs={'car_url': car_url, 'state': state, 'parts': parts[1:]},
+            meta={'request_kind': 'detail', 'needs_token': True, 'api_part': parts[0], 'car_type': 'used'},
+            priority=DETAIL_PRIORITY,
+            dont_filter=True
+        )
+
     def parse_used_car_info(self, response):
-        logger.info("Processing used car: %s", response.url)
-        
-        script_data = self._extract_script_data(response)
-        if not script_data:
-            logger.error("Failed to extract script data for %s", response.url)
+        if response.status == 304:
+            self._not_modified(response, 'used')
             return
+        logger.info("Processing used car: %s", response.url)
         
+        with self.metrics.profile('parse_used_car_info'):
+            with self.metrics.stage('state', 'used'):
+                script_data = self._extract_script_data(response)
+            if not script_data:
+                logger.error("Failed to extract script data for %s", response.url)
+                return
+            
+            with self.metrics.stage('photos', 'used'):
+                photos = self._extract_photos(response)
+            with self.metrics.stage('build', 'used'):
+                item = self._build_used_item(response.url, script_data, photos)
+            with self.metrics.stage('store', 'used'):
+                keep = self._remember(response.url, 'used', item, response)
+        if keep:
+            yield from self._configuration_items(item)
+            yield item
+
+    def _build_used_item(self, url, script_data, photos):
         car_data = self._extract_car_data(script_data, car_type='used')
-        characteristics = self._extract_characteristics(script_data)
-        options = self._extract_car_options(script_data, car_type='used')
-        photos = self._extract_photos(response)
+        configuration, characteristics, options = self._configuration(script_data, car_data, 'used')
         
         # Создаем элемент
-        item = AutospotCarItem()
-        item['url'] = response.url
+        item = self.item_class()
+        item['url'] = url
         item['brand'] = car_data.get('brand_name')
         item['model'] = car_data.get('model_name')
         item['generation'] = car_data.get('model_name')
@@ -82,27 +397,43 @@ class AutospotSpider(scrapy.Spider):
         item['city'] = car_data.get('city_name')
         item['dealer'] = car_data.get('display_dealer_phone')
         item['options'] = options
+        if self.config_refs:
+            item['configuration'] = configuration
         
-        yield item
+        return item
     
     def parse_new_car_info(self, response):
-        logger.info("Processing new car: %s", response.url)
-        
-        script_data = self._extract_script_data(response)
-        if not script_data:
-            logger.error("Failed to extract script data for %s", response.url)
+        if response.status == 304:
+            self._not_modified(response, 'new')
             return
+        logger.info("Processing new car: %s", response.url)
         
+        with self.metrics.profile('parse_new_car_info'):
+            with self.metrics.stage('state', 'new'):
+                script_data = self._extract_script_data(response)
+            if not script_data:
+                logger.error("Failed to extract script data for %s", response.url)
+                return
+            
+            with self.metrics.stage('photos', 'new'):
+                photos = self._extract_photos(response)
+            with self.metrics.stage('build', 'new'):
+                item = self._build_new_item(response.url, script_data, photos)
+            with self.metrics.stage('store', 'new'):
+                keep = self._remember(response.url, 'new', item, response)
+        if keep:
+            yield from self._configuration_items(item)
+            yield item
+
+    def _build_new_item(self, url, script_data, photos):
         car_data = self._extract_car_data(script_data, car_type='new')
         price = self._extract_price_data(script_data)
-        characteristics = self._extract_characteristics(script_data)
-        options = self._extract_car_options(script_data, car_type='new')
+        configuration, characteristics, options = self._configuration(script_data, car_data, 'new')
         dealers_list = self._extract_dealers(script_data)
-        photos = self._extract_photos(response)
         
         # Создаем элемент
-        item = AutospotCarItem()
-        item['url'] = response.url
+        item = self.item_class()
+        item['url'] = url
         item['brand'] = car_data.get('brand_name')
         item['model'] = car_data.get('model_name')
         item['generation'] = car_data.get('model_name')
@@ -115,21 +446,48 @@ class AutospotSpider(scrapy.Spider):
         item['city'] = car_data.get('city_name')
         item['dealer'] = dealers_list
         item['options'] = options
+        if self.config_refs:
+            item['configuration'] = configuration
         
-        yield item
+        return item
     
+    async def parse_car_info_offloaded(self, response):
+        """parse_used_car_info/parse_new_car_info с разбором страницы в пуле процессов"""
+        car_type = response.meta.get('car_type', 'used')
+        if response.status == 304:
+            self._not_modified(response, car_type)
+            return
+        logger.info("Processing %s car: %s", car_type, response.url)
+
+        with self.metrics.stage('parse_pool', car_type):
+            values = await self.parse_pool.parse(car_type, response)
+        if values is None:
+            logger.error("Failed to extract script data for %s", response.url)
+            return
+        if self.configs is not None:
+            values = self._shared_values(values)
+        item = self.item_class(**values)
+        with self.metrics.stage('store', car_type):
+            keep = self._remember(response.url, car_type, item, response)
+        if keep:
+            for configuration in self._configuration_items(item):
+                yield configuration
+            yield item
+
     def _extract_script_data(self, response):
         try:
+            # Сначала вырезаем JSON прямо из байтов страницы, без DOM
+            script = find_state_json(response.body)
+            if script is not None:
+                try:
+                    return ServerState(json_loads(script))
+                except ValueError:
+                    logger.debug("Fast state extraction failed on %s, falling back to XPath", response.url)
+
             # Ищем скрипт с id="serverApp-state"
             script = response.xpath('//script[@id="serverApp-state"]/text()').get()
             if script:
-                return json.loads(script)
-            else:
-                # Альтернативный способ через регулярное выражение
-                pattern = r'<script id="serverApp-state" type="application/json">(.*?)</script>'
-                match = re.search(pattern, response.text)
-                if match:
-                    return json.loads(match.group(1))
+                return ServerState(json_loads(script))
             
             logger.warning("Script serverApp-state not found on page %s", response.url)
             return None
@@ -139,86 +497,90 @@ class AutospotSpider(scrapy.Spider):
 
     def _extract_car_data(self, script_data, car_type='new'):
         """Извлекает основные данные об автомобиле"""
-        api_path = 'api.autospot.ru/rest/v2/used-car/cars' if car_type == 'used' else 'api.autospot.ru/rest/car/base-info'
-        car_key = next(
-            (key for key in script_data.keys() 
-            if api_path in key),
-            None
-        )
-        return script_data.get(car_key, {}).get('body', {}) if car_key else {}
+        return script_data.get('v2/used-car/cars' if car_type == 'used' else 'car/base-info')
 
     def _extract_price_data(self, script_data):
-        price_key = next(
-            (key for key in script_data.keys() 
-            if 'api.autospot.ru/rest/car/price-block' in key),
-            None
-        )
-        if price_key and 'body' in script_data[price_key] and 'prices' in script_data[price_key]['body']:
-            return script_data[price_key]['body']['prices']
-        return {}
+        return script_data.get('car/price-block')
 
     def _extract_characteristics(self, script_data):
-        characteristics_key = next(
-            (key for key in script_data.keys() 
-            if 'api.autospot.ru/rest/car/all-characteristics' in key),
-            None
-        )
-        return script_data.get(characteristics_key, {}).get('body', {}) if characteristics_key else {}
+        return script_data.get('car/all-characteristics')
 
     def _extract_car_options(self, script_data, car_type='new'):
         """Извлекает опции автомобиля"""
-        api_path = 'api.autospot.ru/rest/used-car/options-two-column' if car_type == 'used' else 'api.autospot.ru/rest/car/all-options-two-column'
-        options_key = next(
-            (key for key in script_data.keys() 
-            if api_path in key),
-            None
+        return script_data.get(
+            'used-car/options-two-column' if car_type == 'used' else 'car/all-options-two-column'
         )
-        return self._process_options(script_data, options_key)
 
-    def _process_options(self, script_data, options_key):
-        options = []
-        if not options_key:
-            return options
-        
-        if 'body' in script_data.get(options_key, {}) and 'columns' in script_data[options_key]['body']:
-            columns = script_data[options_key]['body']['columns']
-            for column in columns:
-                for group in column:
-                    group_name = group.get('name', '')
-                    if group_name and 'options' in group:
-                        option_list = [option['name'] for option in group['options']]
-                        options.append({
-                            'name': group_name,
-                            'list': option_list
-                        })
-        return options
+    def _configuration(self, script_data, car_data, car_type):
+        """(id конфигурации, характеристики, опции); с кэшем - общие для одинаковых тел"""
+        if self.configs is None:
+            return (
+                None,
+                self._extract_characteristics(script_data),
+                self._extract_car_options(script_data, car_type=car_type)
+            )
+        characteristics_id, characteristics = self._shared_payload(script_data, CHARACTERISTICS_PATH, car_data)
+        options_id, options = self._shared_payload(script_data, OPTIONS_PATHS[car_type], car_data)
+        return characteristics_id + options_id, characteristics, options
 
-    def _extract_dealers(self, script_data):
-        dealers_list = []
-        dealer_key = next(
-            (key for key in script_data.keys() 
-            if 'api.autospot.ru/rest/dealer/direct-offer' in key),
-            None
+    def _shared_payload(self, script_data, path, car_data):
+        """(id, значение) тела эндпоинта через кэш конфигураций"""
+        entry = script_data.data.get(CACHED_PARTS, {}).get(path)
+        if entry is not None:
+            return entry
+        field = 'characteristics' if path == CHARACTERISTICS_PATH else 'options'
+        return self.configs.get(
+            path, script_data.body(path), car_data, partial(self._build_payload, ENDPOINT_HANDLERS[path], field)
+        )
+
+    def _build_payload(self, handler, field, body):
+        value = handler(body)
+        # CarRecord хранит упакованные значения - упаковка тоже делается один раз
+        return packed(field, value) if self.item_class is CarRecord else value
+
+    def _shared_values(self, values):
+        """Объявление из пула разбора: общие значения конфигурации по хэшу уже разобранных"""
+        ids = []
+        for field in ('characteristics', 'options'):
+            build = partial(self._build_payload, _same_value, field)
+            entry_id, values[field] = self.configs.get(field, values.get(field), None, build)
+            ids.append(entry_id)
+        if self.config_refs:
+            values['configuration'] = ''.join(ids)
+        return values
+
+    def _configuration_items(self, item):
+        """AUTOSPOT_CONFIG_REFS: выносит характеристики и опции объявления в запись конфигурации
+
+        Запись отдается один раз за обход, перед первым объявлением с ней.
+        """
+        configuration = item.get('configuration')
+        if configuration is None:
+            return
+        characteristics = item.pop('characteristics', None)
+        options = item.pop('options', None)
+        if configuration in self.emitted_configurations:
+            return
+        self.emitted_configurations.add(configuration)
+        yield AutospotConfigurationItem(
+            configuration=configuration, characteristics=characteristics, options=options
         )
-        
-        if dealer_key and 'body' in script_data[dealer_key] and 'items' in script_data[dealer_key]['body']:
-            dealers = script_data[dealer_key]['body']['items']
-            for dealer in dealers:
-                dealer_info = {
-                    'name_dealer': dealer.get('dealer_group_name'),
-                    'phone_dealer': dealer.get('phone')
-                }
-                dealers_list.append(dealer_info)
-        return dealers_list
+
+    def _extract_dealers(self, script_data):
+        return script_data.get('dealer/direct-offer')
 
     def _extract_photos(self, response):
         photos = []
-        all_photos = response.xpath("//auto-gallery//img/@src | //auto-gallery-image//img/@src").getall()
+        all_photos = find_gallery_sources(response.body)
+        if all_photos is None:
+            all_photos = response.xpath("//auto-gallery//img/@src | //auto-gallery-image//img/@src").getall()
+        seen = set()
         for photo_url in all_photos:
             if "0x320" in photo_url:
                 # Заменяем 0x320 на 0x0 в URL
                 clean_url = photo_url.split('?')[0].replace('0x320', '0x0')
-                if clean_url not in photos:
+                if clean_url not in seen:
+                    seen.add(clean_url)
                     photos.append(clean_url)
         return photos
 
@@ -234,30 +596,169 @@ class AutospotSpider(scrapy.Spider):
 
     def _process_car_list(self, response, page, car_type, callback):
         """Обрабатывает список автомобилей на странице"""
-        cars_urls = response.xpath("//auto-car-card/article/div/header/h3/a/@href").getall()
+        with self.metrics.stage('cards', car_type):
+            cars_urls = response.xpath("//auto-car-card/article/div/header/h3/a/@href").getall()
         
         if not cars_urls:
             logger.warning("No data found on page %d (%s cars)", page, car_type)
             return
         
         logger.info("Found %d %s cars on page %d", len(cars_urls), car_type, page)
+        with self.metrics.stage('listing_state', car_type):
+            needs_cards = self.seen_store is not None or self.shallow or (self.budget and self.budget.needs_cards)
+            cards = self._listing_cards(response) if needs_cards else {}
         for url in cars_urls:
-            yield Request(
-                url=response.urljoin(url),
-                callback=callback,
-                meta={'needs_token': False}
-            )
+            url = self._rebase_url(response.urljoin(url))
+            if self._known_car(url):
+                continue
+            card = cards.get(urlparse(url).path)
+            if self.budget is not None and not self.budget.take(car_type, url, card):
+                continue
+            card_fp = self._check_seen(url, car_type, card)
+            if card_fp is False:
+                continue
+            if self.checkpoint is not None:
+                self.checkpoint.add_car(url, car_type, callback.__name__, card_fp)
+            if self.shallow:
+                item = self._build_card_item(url, card)
+                if item is not None:
+                    yield item
+                    continue
+            yield self._car_request(url, car_type, callback, card_fp)
 
-    def _schedule_pagination(self, base_url, max_page, callback, meta=None):
-        """Запускает параллельный парсинг страниц"""
-        meta = meta or {}
-        meta.update({'needs_token': True})
-        
-        for page_num in range(2, max_page + 1):
-            meta['page'] = page_num
-            yield Request(
-                url=base_url + str(page_num),
-                callback=callback,
-                meta=meta,
-                dont_filter=True
+    def _listing_cards(self, response):
+        """Карточки объявлений из serverApp-state страницы списка: путь -> карточка"""
+        state = self._extract_script_data(response)
+        body = state.get('v2/used-car/cars') if state else None
+        return {
+            urlparse(card.get('url', '')).path: card
+            for card in (body or {}).get('items', [])
+        }
+
+    def _build_card_item(self, url, card):
+        """Частичное объявление из карточки списка (режим shallow)
+
+        Возвращает None, если карточки нет или в ней не хватает одного из
+        полей AUTOSPOT_DEEP_FIELDS - тогда объявление загружается целиком.
+        """
+        if not card:
+            return None
+
+        item = self.item_class()
+        item['url'] = url
+        item['brand'] = card.get('brand_name')
+        item['model'] = card.get('model_name')
+        item['generation'] = card.get('model_name')
+        item['price'] = (card.get('prices') or {}).get('price')
+        item['year'] = card.get('year')
+        item['mileage'] = card.get('run')
+        item['color'] = card.get('color_name')
+        item['city'] = card.get('city_name')
+
+        if any(item.get(field) is None for field in self.deep_fields):
+            self.crawler.stats.inc_value('shallow/deep_fetch')
+            return None
+        self.crawler.stats.inc_value('shallow/items')
+        return item
+
+    def _check_seen(self, url, car_type, card):
+        """Решает, нужна ли загрузка объявления в инкрементальном режиме
+
+        Возвращает False, если цена и пробег в карточке не изменились с
+        прошлого обхода, иначе отпечаток карточки (или None без карточки).
+        """
+        if self.seen_store is None:
+            return None
+        path = urlparse(url).path
+        card_fp = card_fingerprint(card)
+        row = self.seen_store.get(path)
+        self.seen_store.touch(path, car_type)
+        if row is not None and card_fp is not None and row['card_fingerprint'] == card_fp:
+            self.crawler.stats.inc_value('incremental/skipped')
+            return False
+        return card_fp
+
+    def _conditional_headers(self, url, meta):
+        """If-None-Match/If-Modified-Since по данным прошлой загрузки страницы"""
+        if self.seen_store is None:
+            return {}
+        row = self.seen_store.get(urlparse(url).path)
+        headers = {}
+        if row is not None and row['etag']:
+            headers['If-None-Match'] = row['etag']
+        if row is not None and row['last_modified']:
+            headers['If-Modified-Since'] = row['last_modified']
+        if headers:
+            meta['handle_httpstatus_list'] = [304]
+        return headers
+
+    def _not_modified(self, response, car_type):
+        """Ответ 304 на условный запрос: объявление не изменилось
+
+        Отпечаток новой карточки сохраняется, как и после загрузки страницы,
+        иначе в следующем обходе та же карточка снова потребует запроса.
+        """
+        logger.info("%s car not modified: %s", car_type.capitalize(), response.url)
+        self.crawler.stats.inc_value('incremental/not_modified')
+        if self.seen_store is not None:
+            self.seen_store.not_modified(
+                urlparse(response.url).path, car_type, response.meta.get('card_fingerprint')
             )
+
+    def _remember(self, url, car_type, item, response):
+        """Сохраняет объявление в хранилище; False, если оно не изменилось"""
+        if self.seen_store is None:
+            return True
+        path = urlparse(url).path
+        row = self.seen_store.get(path)
+        content_fp = fingerprint({key: value for key, value in item.items() if key != 'url'})
+        # У ответов API свои заголовки, условные запросы там не используются
+        headers = response.headers if 'api_part' not in response.meta else {}
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        self.seen_store.record(
+            path, car_type, response.meta.get('card_fingerprint'), content_fp,
+            etag=etag.decode('latin-1') if etag else None,
+            last_modified=last_modified.decode('latin-1') if last_modified else None
+        )
+        if row is not None and row['content_fingerprint'] == content_fp:
+            self.crawler.stats.inc_value('incremental/unchanged')
+            return False
+        return True
+
+    def _listing_error(self, failure):
+        self._listing_failed = True
+        if failure.request.meta.get('budget_dropped'):
+            logger.info("Listing page %s dropped: crawl budget exhausted", failure.request.url)
+            self.frontier.page_done(failure.request)
+            return
+        logger.error("Failed to load listing page %s: %s", failure.request.url, failure.getErrorMessage())
+        self.frontier.page_done(failure.request)
+
+    def spider_idle(self, spider):
+        """По окончании обхода выдает объявления, пропавшие из списков"""
+        if self._tombstones_scheduled or not self.frontier.exhausted:
+            return
+        self._tombstones_scheduled = True
+        if self.budget is not None and self.budget.limited:
+            logger.warning("Crawl was limited by a budget or sampling, skipping removed cars detection")
+            return
+        if self._listing_failed:
+            logger.warning("Some listing pages failed, skipping removed cars detection")
+            return
+        # Предметы нельзя отдать из обработчика сигнала, поэтому выдаем их
+        # из колбэка служебного запроса к data: URI
+        self.crawler.engine.crawl(Request('data:,', callback=self.emit_removed_cars, dont_filter=True))
+        raise DontCloseSpider
+
+    def emit_removed_cars(self, response):
+        removed = self.seen_store.missing_since(self.run_started)
+        for row in removed:
+            item = AutospotRemovedCarItem()
+            item['url'] = self.base_url + row['path']
+            item['car_type'] = row['car_type']
+            item['last_seen'] = datetime.fromtimestamp(row['last_seen']).isoformat()
+            yield item
+        self.seen_store.mark_removed([row['path'] for row in removed])
+        logger.info("Detected %d removed cars", len(removed))
+        self.crawler.stats.set_value('incremental/removed', len(removed))
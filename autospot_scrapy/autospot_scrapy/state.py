@@ -0,0 +1,150 @@
+"""Индекс serverApp-state страницы autospot.ru
+
+Ключи serverApp-state - это адреса вызовов api.autospot.ru/rest/...
+(с префиксами G./H. и параметрами запроса). Вместо поиска подстроки по
+всем ключам для каждого поля ключи один раз раскладываются по пути
+эндпоинта, а тела ответов разбираются зарегистрированными обработчиками.
+"""
+
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+API_MARKER = 'api.autospot.ru/rest/'
+
+# Путь эндпоинта (без id и параметров) -> обработчик тела ответа
+ENDPOINT_HANDLERS = {}
+
+
+def json_loads(data):
+    """json.loads с ускорением через orjson, если он установлен"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def register_endpoint(*paths):
+    """Регистрирует обработчик тела ответа для одного или нескольких эндпоинтов
+
+    Обработчик получает тело ответа (или None, если вызова нет на странице)
+    и возвращает уже готовое значение для объявления.
+    """
+    def decorator(handler):
+        for path in paths:
+            ENDPOINT_HANDLERS[path] = handler
+        return handler
+    return decorator
+
+
+def endpoint_path(key):
+    """Путь эндпоинта из ключа state: 'G.https://api.autospot.ru/rest/car/gallery/?car_id=1' -> 'car/gallery'"""
+    start = key.find(API_MARKER)
+    if start == -1:
+        return None
+    path = key[start + len(API_MARKER):].partition('?')[0].rstrip('/')
+    # id объявления стоит последним сегментом: v2/used-car/cars/675446/
+    head, _, tail = path.rpartition('/')
+    return head if tail.isdigit() else path
+
+
+class ServerState:
+    """serverApp-state, разложенный по эндпоинтам за один проход"""
+
+    def __init__(self, data):
+        self.data = data
+        self.keys = {}
+        for key in data:
+            path = endpoint_path(key)
+            # Как и раньше, берется первый подходящий ключ
+            if path is not None and path not in self.keys:
+                self.keys[path] = key
+        self._cache = {}
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def body(self, path):
+        """Сырое тело ответа эндпоинта или None"""
+        key = self.keys.get(path)
+        if key is None:
+            return None
+        value = self.data[key]
+        return value.get('body') if isinstance(value, dict) else None
+
+    def get(self, path):
+        """Тело ответа, обработанное зарегистрированным обработчиком"""
+        if path not in self._cache:
+            handler = ENDPOINT_HANDLERS.get(path, _raw_body)
+            self._cache[path] = handler(self.body(path))
+        return self._cache[path]
+
+
+def _raw_body(body):
+    return body
+
+
+@register_endpoint('v2/used-car/cars', 'car/base-info', 'car/all-characteristics')
+def dict_body(body):
+    return body if body is not None else {}
+
+
+@register_endpoint('car/price-block')
+def price_block(body):
+    if isinstance(body, dict) and 'prices' in body:
+        return body['prices']
+    return {}
+
+
+@register_endpoint('used-car/options-two-column', 'car/all-options-two-column')
+def options_two_column(body):
+    options = []
+    if not isinstance(body, dict) or 'columns' not in body:
+        return options
+
+    for column in body['columns']:
+        for group in column:
+            group_name = group.get('name', '')
+            if group_name and 'options' in group:
+                option_list = [option['name'] for option in group['options']]
+                options.append({
+                    'name': group_name,
+                    'list': option_list
+                })
+    return options
+
+
+@register_endpoint('dealer/direct-offer')
+def direct_offer(body):
+    dealers_list = []
+    if not isinstance(body, dict) or 'items' not in body:
+        return dealers_list
+
+    for dealer in body['items']:
+        dealers_list.append({
+            'name_dealer': dealer.get('dealer_group_name'),
+            'phone_dealer': dealer.get('phone')
+        })
+    return dealers_list
+
+
+@register_endpoint('car/gallery')
+def gallery_photos(body):
+    """Фотографии в том же виде, что и из HTML-галереи (resize/0x0)"""
+    photos = []
+    for image in body or []:
+        src = image.get('src_img')
+        if image.get('type') != 'image' or not src:
+            continue
+        clean_url = re.sub(r'/resize/\d+x\d+/', '/resize/0x0/', src.split('?')[0])
+        if clean_url not in photos:
+            photos.append(clean_url)
+    return photos
+
+
+@register_endpoint('oauth2/token')
+def access_token(body):
+    return body.get('access_token') if isinstance(body, dict) else None
@@ -0,0 +1,179 @@
+"""Транспорт для хостов autospot.ru: пул соединений, HTTP/2 и кэш DNS
+
+Почти весь трафик идет на хост сайта: страницы, API и главная страница за
+токеном (TokenMiddleware качает ее тем же загрузчиком Scrapy, поэтому
+соединения у токена и страниц общие). Стандартный HTTP11DownloadHandler
+держит на хост не больше CONCURRENT_REQUESTS_PER_DOMAIN (8) свободных
+соединений, а слоты регулятора (AdaptiveThrottleMiddleware) вместе
+открывают до 15: лишнее соединение закрывается после ответа, и следующий
+запрос снова платит за TCP и TLS. PooledHTTP11DownloadHandler:
+
+- держит на хост AUTOSPOT_POOL_PER_HOST соединений (0 - сумма
+  max_concurrency бюджетов регулятора для хоста сайта, без фотографий,
+  но не больше CONCURRENT_REQUESTS);
+- закрывает простаивающее соединение через AUTOSPOT_POOL_IDLE_TIMEOUT секунд;
+- с AUTOSPOT_HTTP2 отдает https-запросы H2DownloadHandler Scrapy - все
+  запросы к хосту идут потоками одного соединения (нужен пакет h2; без
+  него остается HTTP/1.1 и в лог пишется предупреждение);
+- считает в статистике transport/requests, transport/connections_opened и
+  transport/connections_per_1000_requests.
+
+CachingResolver (DNS_RESOLVER) - кэш DNS Scrapy со временем жизни записей
+AUTOSPOT_DNS_TTL: служба живет неделями, а из стандартного кэша адрес не
+уходит никогда. CrawlerProcess ставит резолвер в реактор сам, CrawlerRunner
+службы - нет, для нее это делает install_dns_cache.
+
+    python -m benchmarks.bench_transport --items 300
+"""
+
+import logging
+import time
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.resolver import CachingThreadedResolver
+from scrapy.utils.datatypes import LocalCache
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.misc import create_instance, load_object
+from twisted.internet import defer
+from twisted.internet.base import ThreadedResolver
+from twisted.web.client import HTTPConnectionPool
+
+try:
+    from scrapy.core.downloader.handlers.http2 import H2DownloadHandler
+    from scrapy.core.http2.agent import H2ConnectionPool
+except ImportError:
+    H2DownloadHandler = None
+
+logger = logging.getLogger(__name__)
+
+# Бюджеты регулятора, запросы которых идут не на хост сайта
+OFFSITE_KINDS = ('photo',)
+
+
+def pool_size(settings):
+    """Свободных соединений на хост: AUTOSPOT_POOL_PER_HOST или по параллельности обхода"""
+    size = settings.getint('AUTOSPOT_POOL_PER_HOST')
+    if size:
+        return size
+    if settings.getbool('AUTOSPOT_THROTTLE_ENABLED'):
+        budgets = settings.getdict('AUTOSPOT_THROTTLE_BUDGETS')
+        size = sum(
+            budget.get('max_concurrency', 1) for kind, budget in budgets.items() if kind not in OFFSITE_KINDS
+        )
+    else:
+        size = settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+    return max(1, min(size, settings.getint('CONCURRENT_REQUESTS')))
+
+
+class CountingConnectionPool(HTTPConnectionPool):
+    """HTTPConnectionPool, который считает новые соединения в статистике обхода"""
+
+    stats = None
+
+    def _newConnection(self, key, endpoint):
+        if self.stats is not None:
+            self.stats.inc_value('transport/connections_opened')
+        return super()._newConnection(key, endpoint)
+
+
+if H2DownloadHandler is not None:
+    class CountingH2ConnectionPool(H2ConnectionPool):
+        """H2ConnectionPool с тем же учетом новых соединений"""
+
+        stats = None
+
+        def _new_connection(self, key, uri, endpoint):
+            if self.stats is not None:
+                self.stats.inc_value('transport/connections_opened')
+            return super()._new_connection(key, uri, endpoint)
+
+
+class PooledHTTP11DownloadHandler(HTTP11DownloadHandler):
+    """HTTP(S)-загрузчик с пулом по параллельности обхода и HTTP/2 по желанию"""
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        from twisted.internet import reactor
+
+        self.stats = crawler.stats if crawler is not None else None
+        # Пул из HTTP11DownloadHandler еще пуст, его можно просто заменить
+        self._pool = CountingConnectionPool(reactor, persistent=True)
+        self._pool.maxPersistentPerHost = pool_size(settings)
+        self._pool.cachedConnectionTimeout = settings.getint('AUTOSPOT_POOL_IDLE_TIMEOUT')
+        self._pool._factory.noisy = False
+        self._pool.stats = self.stats
+        self.h2 = None
+        if settings.getbool('AUTOSPOT_HTTP2'):
+            if H2DownloadHandler is None:
+                logger.warning("AUTOSPOT_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+            else:
+                self.h2 = H2DownloadHandler(settings, crawler)
+                self.h2._pool = CountingH2ConnectionPool(reactor, settings)
+                self.h2._pool.stats = self.stats
+
+    def download_request(self, request, spider):
+        if self.stats is not None:
+            self.stats.inc_value('transport/requests')
+        if self.h2 is not None and urlparse_cached(request).scheme == 'https':
+            return self.h2.download_request(request, spider)
+        return super().download_request(request, spider)
+
+    def record_stats(self):
+        if self.stats is None:
+            return
+        requests = self.stats.get_value('transport/requests', 0)
+        if requests:
+            opened = self.stats.get_value('transport/connections_opened', 0)
+            self.stats.set_value('transport/connections_per_1000_requests', round(opened * 1000 / requests, 1))
+
+    def close(self):
+        self.record_stats()
+        if self.h2 is not None:
+            self.h2.close()
+        return super().close()
+
+
+class CachingResolver(CachingThreadedResolver):
+    """CachingThreadedResolver, у записей которого есть время жизни"""
+
+    def __init__(self, reactor, cache_size, timeout, ttl=300):
+        super().__init__(reactor, cache_size, timeout)
+        self.ttl = ttl
+        self.enabled = bool(cache_size)
+        # Имя -> (адрес, когда запись устареет)
+        self.cache = LocalCache(cache_size or None)
+
+    @classmethod
+    def from_crawler(cls, crawler, reactor):
+        return cls.from_settings(crawler.settings, reactor)
+
+    @classmethod
+    def from_settings(cls, settings, reactor):
+        return cls(
+            reactor,
+            settings.getint('DNSCACHE_SIZE') if settings.getbool('DNSCACHE_ENABLED') else 0,
+            settings.getfloat('DNS_TIMEOUT'),
+            ttl=settings.getfloat('AUTOSPOT_DNS_TTL')
+        )
+
+    def getHostByName(self, name, timeout=None):
+        entry = self.cache.get(name)
+        if entry is not None and entry[1] > time.monotonic():
+            return defer.succeed(entry[0])
+        d = ThreadedResolver.getHostByName(self, name, (self.timeout,))
+        if self.enabled:
+            d.addCallback(self._remember, name)
+        return d
+
+    def _remember(self, address, name):
+        self.cache[name] = (address, time.monotonic() + self.ttl)
+        return address
+
+
+def install_dns_cache(settings):
+    """Ставит в реактор DNS_RESOLVER, как это делает CrawlerProcess.start"""
+    from twisted.internet import reactor
+
+    resolver = create_instance(load_object(settings['DNS_RESOLVER']), settings, None, reactor=reactor)
+    resolver.install_on_reactor()
+    return resolver
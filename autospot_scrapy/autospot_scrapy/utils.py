@@ -0,0 +1,46 @@
+import os
+
+from scrapy.utils.project import data_path
+
+
+def data_file(path):
+    """Путь к файлу данных проекта (относительные пути - внутри .scrapy/)
+
+    В отличие от data_path(..., createdir=True) создает только родительский
+    каталог, а не каталог с именем самого файла.
+    """
+    path = data_path(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return path
+
+
+def request_kind(request):
+    """Тип запроса для бюджетов и метрик: list, detail, photo или token
+
+    Паук и TokenMiddleware проставляют meta['request_kind'] сами; для
+    остальных запросов тип угадывается по meta.
+    """
+    kind = request.meta.get('request_kind')
+    if kind:
+        return kind
+    if 'dont_process_token' in request.meta:
+        return 'token'
+    if 'page' in request.meta:
+        return 'list'
+    return 'detail'
+
+
+def deferred_from_future(future):
+    """Deferred, срабатывающий в потоке реактора по готовности concurrent.futures.Future"""
+    from twisted.internet import defer, reactor
+
+    deferred = defer.Deferred()
+
+    def done(future):
+        if future.exception() is not None:
+            reactor.callFromThread(deferred.errback, future.exception())
+        else:
+            reactor.callFromThread(deferred.callback, future.result())
+
+    future.add_done_callback(done)
+    return deferred
@@ -0,0 +1,2 @@
+# Офлайн-инструменты для замеров: записанные страницы, локальный стаб
+# autospot.ru и скрипты сравнения режимов обхода.
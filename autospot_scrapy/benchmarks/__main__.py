@@ -0,0 +1,61 @@
+"""Полный набор замеров с сохранением результата в benchmarks/results/
+
+Каждый замер идет в отдельном процессе (обходы не могут перезапустить
+реактор, а пиковый RSS одного замера не должен влиять на другие).
+
+    python -m benchmarks            # полный набор
+    python -m benchmarks --quick    # меньше страниц и объявлений
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+from benchmarks.fixtures import PROJECT_DIR
+from benchmarks.results import save_result
+
+SUITE = {
+    'spider': ['benchmarks.bench_spider', '--limit', '{pages}'],
+    'state': ['benchmarks.bench_state', '--limit', '{pages}'],
+    'scanner': ['benchmarks.bench_scanner', '--limit', '{pages}'],
+    'httpcache': ['benchmarks.bench_httpcache', '--limit', '{pages}'],
+    'output': ['benchmarks.bench_output', '--limit', '{pages}'],
+    'items': ['benchmarks.bench_items', '--items', '{items}'],
+    'parse_pool': ['benchmarks.bench_parse_pool', '--limit', '{pages}', '--no-e2e'],
+    'e2e': ['benchmarks.bench_e2e', '--items', '{items}'],
+    'distributed': ['benchmarks.bench_distributed', '--workers', '2'],
+    'photos': ['benchmarks.bench_photos', '--items', '{items}'],
+    'daemon': ['benchmarks.bench_daemon', '--cycles', '3'],
+    'archive': ['benchmarks.bench_archive'],
+    'budget': ['benchmarks.bench_budget'],
+    'configs': ['benchmarks.bench_configs', '--limit', '{pages}'],
+    'transport': ['benchmarks.bench_transport', '--items', '{items}'],
+    'history': ['benchmarks.bench_history'],
+    'resume': ['benchmarks.bench_resume', '--max-pages', '{pages}'],
+    'e2e_faults': ['benchmarks.bench_e2e', '--items', '{items}', '--latency', '0.05', '--error-rate', '0.02'],
+}
+
+
+def run_benchmark(module_args, pages, items):
+    command = [sys.executable, '-m'] + [arg.format(pages=pages, items=items) for arg in module_args]
+    output = subprocess.run(command, cwd=PROJECT_DIR, check=True, capture_output=True, text=True).stdout
+    # Печатают JSON последним; до него может быть вывод библиотек
+    return json.loads(output[output.index('{'):])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the benchmark suite and save results')
+    parser.add_argument('--quick', action='store_true', help='Fewer pages and items')
+    parser.add_argument('--only', action='append', choices=sorted(SUITE), help='Run only these benchmarks')
+    parser.add_argument('--name', default='suite', help='Result file name prefix')
+    args = parser.parse_args()
+
+    pages, items = (50, 100) if args.quick else (300, 1000)
+    results = {}
+    for name in args.only or list(SUITE):
+        print(f'Running {name}...', file=sys.stderr)
+        results[name] = run_benchmark(SUITE[name], pages, items)
+    path = save_result(args.name, results)
+    print(json.dumps(results, indent=2))
+    print(f'Saved to {path}', file=sys.stderr)
@@ -0,0 +1,103 @@
+"""Запись обхода в архив и повторный разбор из него
+
+Обход локального стаба с --record (со стабом с задержкой - как по сети),
+затем повторные разборы --replay без стаба: в потоке реактора и с пулом
+процессов разбора. Для каждого прогона: время, объявлений в секунду,
+ответов в секунду и совпадение объявлений с записанным обходом.
+
+    python -m benchmarks.bench_archive --latency 0.02 --parse-workers 2
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from autospot_scrapy.archive import ResponseArchive
+from autospot_scrapy.distributed import _read_lines
+from benchmarks.bench_distributed import stub_settings
+from benchmarks.fixtures import PROJECT_DIR
+from benchmarks.mock_server import spawn_server
+
+
+def crawl(workdir, name, args, settings):
+    output = Path(workdir) / name
+    started = time.perf_counter()
+    subprocess.run([
+        sys.executable, str(PROJECT_DIR / 'run_spider.py'), '--format', 'jsonl', '--compression', 'gzip',
+        '--output', str(output), '--log', str(Path(workdir) / f'{name}.log'), *args,
+        *[arg for name, value in settings.items() for arg in ('--set', f'{name}={value}')]
+    ], cwd=PROJECT_DIR, check=True)
+    elapsed = time.perf_counter() - started
+    items = {}
+    for path in sorted(Path(workdir).glob(f'{name}-*.jsonl*')):
+        for line in _read_lines(str(path)):
+            item = json.loads(line)
+            items[item['url']] = item
+    return items, elapsed
+
+
+def log_stats(workdir, name, prefix):
+    """Статистика prefix... из дампа в конце лога обхода"""
+    stats = {}
+    for line in (Path(workdir) / f'{name}.log').read_text(encoding='utf-8').splitlines():
+        line = line.strip()
+        if line.startswith(f"'{prefix}") or line.startswith(f"{{'{prefix}"):
+            key, _, value = line.strip("{},").partition(': ')
+            stats[key.strip("'")] = float(value.strip(','))
+    return stats
+
+
+def run(latency=0.02, parse_workers=(2,), limit=None):
+    report = {'latency': latency}
+    with tempfile.TemporaryDirectory() as workdir:
+        archive_path = str(Path(workdir) / 'autospot.archive')
+        server, base_url = spawn_server(latency=latency)
+        try:
+            settings = stub_settings(base_url, workdir)
+            if limit:
+                settings['CLOSESPIDER_ITEMCOUNT'] = limit
+            recorded, elapsed = crawl(workdir, 'record', ['--record', archive_path], settings)
+        finally:
+            server.terminate()
+        archive = ResponseArchive(archive_path)
+        stats = archive.stats()
+        archive.close()
+        body_bytes = log_stats(workdir, 'record', 'archive/').get('archive/body_bytes', 0)
+        report['record'] = {
+            'items': len(recorded),
+            'seconds': round(elapsed, 1),
+            'archive_records': stats['records'],
+            'archive_bytes': stats['file_bytes'],
+            'compression_ratio': round(body_bytes / stats['file_bytes'], 1) if stats['file_bytes'] else None,
+        }
+
+        # Стаб остановлен: повторный разбор не должен ходить в сеть
+        for workers in (0,) + tuple(parse_workers):
+            name = f'replay-{workers}'
+            args = ['--replay', archive_path] + (['--parse-workers', str(workers)] if workers else [])
+            replayed, elapsed = crawl(workdir, name, args, settings)
+            replay = log_stats(workdir, name, 'replay/')
+            report[name] = {
+                'items': len(replayed),
+                'seconds': round(elapsed, 1),
+                'crawl_seconds': replay.get('replay/seconds'),
+                'items_per_second': replay.get('replay/items_per_second'),
+                'responses_per_second': replay.get('replay/responses_per_second'),
+                'missing': int(replay.get('replay/missing', 0)),
+                'same_items': replayed == recorded,
+                'speedup': round(report['record']['seconds'] / elapsed, 1),
+            }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark recording a crawl and replaying it offline')
+    parser.add_argument('--latency', type=float, default=0.02, help='Mean stub latency while recording, seconds')
+    parser.add_argument('--parse-workers', type=int, action='append', help='Parse pool sizes to replay with')
+    parser.add_argument('--limit', type=int, help='Stop the recorded crawl after this many items')
+    args = parser.parse_args()
+    print(json.dumps(run(args.latency, args.parse_workers or (2,), args.limit), indent=2))
@@ -0,0 +1,72 @@
+"""Полный обход против выборки и обходов с бюджетами на локальном стабе
+
+Для каждого прогона: время, объявлений, причина завершения, число марок
+и медиана цены - чтобы видеть, насколько выборка по маркам, разнесенная
+по пагинации, быстрее полного обхода и насколько близка к нему по ценам.
+
+    python -m benchmarks.bench_budget --sample 3 --pages 30 --latency 0.01
+"""
+
+import argparse
+import json
+import re
+import statistics
+import tempfile
+from pathlib import Path
+
+from benchmarks.bench_archive import crawl
+from benchmarks.bench_distributed import stub_settings
+from benchmarks.mock_server import spawn_server
+
+FINISH_REASON = re.compile(r"'finish_reason': '([^']+)'")
+
+
+def summary(workdir, name, items, elapsed):
+    log = (Path(workdir) / f'{name}.log').read_text(encoding='utf-8')
+    reason = FINISH_REASON.search(log)
+    prices = [item['price'] for item in items.values() if item.get('price')]
+    return {
+        'items': len(items),
+        'seconds': round(elapsed, 1),
+        'finish_reason': reason.group(1) if reason else None,
+        'brands': len({item.get('brand') for item in items.values()}),
+        'median_price': statistics.median(prices) if prices else None,
+    }
+
+
+def run(sample=3, pages=30, max_requests=200, latency=0.01):
+    report = {'sample': sample, 'pages': pages, 'latency': latency}
+    runs = {
+        'full': [],
+        'sample': ['--sample', str(sample), '--max-pages', str(pages)],
+        'pages': ['--max-pages', str(pages)],
+        'requests': ['--max-requests', str(max_requests)],
+    }
+    server, base_url = spawn_server(latency=latency)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            settings = stub_settings(base_url, workdir)
+            for name, args in runs.items():
+                items, elapsed = crawl(workdir, name, args, settings)
+                report[name] = summary(workdir, name, items, elapsed)
+    finally:
+        server.terminate()
+    full = report['full']
+    for name in runs:
+        if name != 'full' and report[name]['seconds']:
+            report[name]['speedup'] = round(full['seconds'] / report[name]['seconds'], 1)
+            if full['median_price'] and report[name]['median_price']:
+                report[name]['median_price_error'] = round(
+                    abs(report[name]['median_price'] - full['median_price']) / full['median_price'], 3
+                )
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark budgeted and sampled crawls against a full crawl')
+    parser.add_argument('--sample', type=int, default=3, help='Cars per brand in the sampled run')
+    parser.add_argument('--pages', type=int, default=30, help='Listing pages per car type in budgeted runs')
+    parser.add_argument('--max-requests', type=int, default=200, help='Request budget per car type')
+    parser.add_argument('--latency', type=float, default=0.01, help='Mean stub latency, seconds')
+    args = parser.parse_args()
+    print(json.dumps(run(args.sample, args.pages, args.max_requests, args.latency), indent=2))
@@ -0,0 +1,91 @@
+"""Кэш конфигураций на записанных страницах объявлений
+
+Сборка объявлений (_build_used_item) и их выгрузка строкой JSON Lines без
+кэша конфигураций, с кэшем, с кэшем и компактными записями, и в режиме
+ссылок (AUTOSPOT_CONFIG_REFS), где характеристики и опции выгружаются
+один раз на конфигурацию. Время - лучшее из --repeat проходов, в
+микросекундах на объявление; для кэша - доля попаданий и размер
+выгрузки.
+
+    python -m benchmarks.bench_configs --limit 1000
+"""
+
+import argparse
+import json
+import time
+
+from autospot_scrapy.configs import ConfigurationCache
+from autospot_scrapy.items import AutospotCarItem
+from autospot_scrapy.pipelines import json_line
+from autospot_scrapy.records import CarRecord
+from autospot_scrapy.spiders.autospot_spider import AutospotSpider
+from autospot_scrapy.state import ServerState
+from benchmarks.fixtures import iter_pages
+
+
+def make_spider(cache_size, item_class=AutospotCarItem, refs=False):
+    spider = AutospotSpider()
+    spider.item_class = item_class
+    if cache_size:
+        spider.configs = ConfigurationCache(max_entries=cache_size)
+        spider.config_refs = refs
+    return spider
+
+
+def crawl_pass(spider, pages):
+    """Объявления по всем страницам; байт выгрузки, включая записи конфигураций"""
+    output = 0
+    for url, data in pages:
+        item = spider._build_used_item(url, ServerState(data), [])
+        for configuration in spider._configuration_items(item):
+            output += len(json_line(configuration))
+        output += len(json_line(item))
+    return output
+
+
+def measure(cache_size, pages, repeat, **options):
+    best = None
+    for _ in range(repeat):
+        # Новый кэш на каждый проход: иначе второй проход - одни попадания
+        spider = make_spider(cache_size, **options)
+        started = time.perf_counter()
+        output = crawl_pass(spider, pages)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    result = {'us_per_item': round(best / max(len(pages), 1) * 1e6, 1), 'output_bytes': output}
+    if spider.configs is not None:
+        result.update(
+            hit_rate=round(spider.configs.hit_rate, 3),
+            configurations=len(spider.emitted_configurations) if options.get('refs') else None,
+        )
+    return result
+
+
+def run(limit, repeat, cache_size):
+    pages = [(page.url, page.state()) for page in iter_pages(kinds=('used-detail',), limit=limit)]
+    pages = [(url, data) for url, data in pages if data]
+    report = {
+        'items': len(pages),
+        'cache_size': cache_size,
+        'no_cache': measure(0, pages, repeat),
+        'cache': measure(cache_size, pages, repeat),
+        'no_cache_compact': measure(0, pages, repeat, item_class=CarRecord),
+        'cache_compact': measure(cache_size, pages, repeat, item_class=CarRecord),
+        'refs': measure(cache_size, pages, repeat, refs=True),
+    }
+    for name in ('cache', 'refs'):
+        report[name]['speedup'] = round(report['no_cache']['us_per_item'] / report[name]['us_per_item'], 2)
+    report['cache_compact']['speedup'] = round(
+        report['no_cache_compact']['us_per_item'] / report['cache_compact']['us_per_item'], 2
+    )
+    report['refs']['output_ratio'] = round(report['refs']['output_bytes'] / report['no_cache']['output_bytes'], 3)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the configuration cache on recorded detail pages')
+    parser.add_argument('--limit', type=int, default=1000, help='Number of recorded detail pages')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cache-size', type=int, default=2048, help='Configuration cache entries per endpoint')
+    args = parser.parse_args()
+    print(json.dumps(run(args.limit, args.repeat, args.cache_size), indent=2))
@@ -0,0 +1,101 @@
+"""Режим службы против запусков по cron на локальном стабе
+
+cron: --cycles отдельных процессов run_spider.py подряд, время каждого -
+от запуска процесса до выхода (старт интерпретатора, импорт Scrapy,
+холодные соединения). daemon: один процесс run_spider.py --daemon с
+нулевым интервалом, время цикла - из лога службы. Каждый обход
+останавливается на --items объявлениях; токен в обоих режимах общий
+через файл, как в рабочей установке.
+
+    python -m benchmarks.bench_daemon --cycles 3 --items 100 --latency 0.01
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.bench_distributed import stub_settings
+from benchmarks.fixtures import PROJECT_DIR
+from benchmarks.mock_server import spawn_server
+
+CYCLE_LINE = re.compile(r'Cycle (\d+) finished in ([\d.]+)s: (\S+), (\d+) items')
+
+
+def crawl_args(settings, items):
+    settings = dict(settings, CLOSESPIDER_ITEMCOUNT=items)
+    return [arg for name, value in settings.items() for arg in ('--set', f'{name}={value}')]
+
+
+def run_cron(settings, items, cycles, workdir):
+    seconds = []
+    for cycle in range(cycles):
+        started = time.perf_counter()
+        subprocess.run([
+            sys.executable, str(PROJECT_DIR / 'run_spider.py'), '--format', 'jsonl',
+            '--output', str(Path(workdir) / f'cron-{cycle}'), '--log', str(Path(workdir) / f'cron-{cycle}.log'),
+            *crawl_args(settings, items)
+        ], cwd=PROJECT_DIR, check=True)
+        seconds.append(round(time.perf_counter() - started, 2))
+    return seconds
+
+
+def run_daemon(settings, items, cycles, workdir):
+    daemon_log = Path(workdir) / 'daemon.log'
+    started = time.perf_counter()
+    subprocess.run([
+        sys.executable, str(PROJECT_DIR / 'run_spider.py'), '--daemon', '--interval', '0.001',
+        '--cycles', str(cycles), '--format', 'jsonl',
+        '--output', str(Path(workdir) / 'daemon-{time}'), '--log', str(Path(workdir) / 'daemon-{time}.log'),
+        *crawl_args(dict(settings, AUTOSPOT_DAEMON_LOG=daemon_log), items)
+    ], cwd=PROJECT_DIR, check=True)
+    elapsed = time.perf_counter() - started
+    cycles = [match.groups() for match in CYCLE_LINE.finditer(daemon_log.read_text(encoding='utf-8'))]
+    return [float(seconds) for _, seconds, _, _ in cycles], [int(count) for *_, count in cycles], elapsed
+
+
+def token_fetches(logs):
+    return sum(path.read_text(encoding='utf-8').count('Received new token') for path in logs)
+
+
+def run(cycles=3, items=100, latency=0.01):
+    report = {'cycles': cycles, 'items_per_cycle': items, 'latency': latency}
+    server, base_url = spawn_server(latency=latency)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            settings = stub_settings(base_url, workdir)
+            cron = run_cron(settings, items, cycles, workdir)
+            report['cron'] = {
+                'seconds_per_run': cron,
+                'total_seconds': round(sum(cron), 1),
+                'token_fetches': token_fetches(Path(workdir).glob('cron-*.log')),
+            }
+            Path(settings['AUTOSPOT_TOKEN_FILE']).unlink()
+            seconds, counts, elapsed = run_daemon(settings, items, cycles, workdir)
+            report['daemon'] = {
+                'seconds_per_cycle': seconds,
+                'items_per_cycle': counts,
+                'total_seconds': round(elapsed, 1),
+                'token_fetches': token_fetches(Path(workdir).glob('daemon-*.log')),
+            }
+    finally:
+        server.terminate()
+    # Первый цикл в обоих режимах холодный, сравниваются последующие
+    if cycles > 1:
+        warm_cron = sum(cron[1:]) / (cycles - 1)
+        warm_daemon = sum(seconds[1:]) / (cycles - 1)
+        report['warm_cycle_speedup'] = round(warm_cron / warm_daemon, 2)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark daemon cycles against cron-style runs')
+    parser.add_argument('--cycles', type=int, default=3, help='Crawl cycles in each mode')
+    parser.add_argument('--items', type=int, default=100, help='Stop each cycle after this many items')
+    parser.add_argument('--latency', type=float, default=0.01, help='Mean stub latency, seconds')
+    args = parser.parse_args()
+    print(json.dumps(run(args.cycles, args.items, args.latency), indent=2))
@@ -0,0 +1,100 @@
+"""Распределенный обход против обычного на локальном стабе
+
+Сначала обычный обход (run_spider.py --format jsonl), затем координатор
+autospot_scrapy.distributed с 1, 2 и 3 воркерами на одной общей очереди.
+Для каждого прогона: объявлений, время, повторы url между воркерами,
+совпадение набора url с обычным обходом и распределение по воркерам.
+Выигрыш по времени ограничен числом ядер (выводится в отчете) и
+задержкой стаба.
+
+    python -m benchmarks.bench_distributed --workers 1 --workers 3 --latency 0.05
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from autospot_scrapy.distributed import _read_lines
+from benchmarks.fixtures import PROJECT_DIR
+from benchmarks.mock_server import spawn_server
+
+WORKERS = (1, 2, 3)
+
+
+def stub_settings(base_url, workdir):
+    return {
+        'AUTOSPOT_BASE_URL': base_url,
+        'AUTOSPOT_API_URL': base_url + '/api/rest',
+        'HTTPCACHE_ENABLED': False,
+        'DOWNLOAD_DELAY': 0,
+        'AUTOSPOT_THROTTLE_ENABLED': False,
+        'AUTOSPOT_TOKEN_FILE': str(Path(workdir) / 'token.json'),
+    }
+
+
+def urls(paths):
+    return [json.loads(line)['url'] for path in paths for line in _read_lines(str(path))]
+
+
+def run_plain(settings, workdir):
+    output = Path(workdir) / 'plain'
+    started = time.perf_counter()
+    subprocess.run([
+        sys.executable, str(PROJECT_DIR / 'run_spider.py'), '--format', 'jsonl',
+        '--output', str(output), '--log', str(Path(workdir) / 'plain.log'),
+        *[arg for name, value in settings.items() for arg in ('--set', f'{name}={value}')]
+    ], cwd=PROJECT_DIR, check=True)
+    return urls(sorted(Path(workdir).glob('plain-*.jsonl*'))), time.perf_counter() - started
+
+
+def run_distributed(settings, workers, workdir):
+    directory = Path(workdir) / f'distributed-{workers}'
+    started = time.perf_counter()
+    subprocess.run([
+        sys.executable, '-m', 'autospot_scrapy.distributed', 'crawl',
+        '--workers', str(workers), '--dir', str(directory),
+        *[arg for name, value in settings.items() for arg in ('--set', f'{name}={value}')]
+    ], cwd=PROJECT_DIR, check=True, capture_output=True)
+    elapsed = time.perf_counter() - started
+    with open(directory / 'stats.json', encoding='utf-8') as f:
+        report = json.load(f)
+    return urls([directory / 'merged.jsonl']), elapsed, report
+
+
+def run(workers_list, latency=0):
+    report = {'cpus': os.cpu_count(), 'latency': latency}
+    server, base_url = spawn_server(latency=latency)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            settings = stub_settings(base_url, workdir)
+            plain, elapsed = run_plain(settings, workdir)
+            report['plain'] = {'items': len(plain), 'seconds': round(elapsed, 1)}
+            for workers in workers_list:
+                merged, elapsed, merged_report = run_distributed(settings, workers, workdir)
+                report[f'workers_{workers}'] = {
+                    'items': merged_report['items'],
+                    'seconds': round(elapsed, 1),
+                    'duplicates': merged_report['duplicates'],
+                    'same_urls': sorted(merged) == sorted(plain),
+                    'queue': merged_report['queue'],
+                    'items_per_worker': {
+                        name: (worker['stats'] or {}).get('item_scraped_count', 0)
+                        for name, worker in merged_report['workers'].items()
+                    },
+                }
+    finally:
+        server.terminate()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the distributed crawl against a plain one')
+    parser.add_argument('--workers', type=int, action='append', help='Worker counts (default: 1 2 3)')
+    parser.add_argument('--latency', type=float, default=0, help='Mean stub latency, seconds')
+    args = parser.parse_args()
+    print(json.dumps(run(args.workers or WORKERS, args.latency), indent=2))
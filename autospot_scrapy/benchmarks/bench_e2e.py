@@ -0,0 +1,106 @@
+"""Сквозной замер: AutospotCrawler против локального стаба
+
+Стаб запускается в отдельном процессе (с задержкой и ошибками по
+желанию), обход - в дочернем процессе через AutospotCrawler из
+run_spider.py. Отчет: объявлений в секунду, байт и CPU на объявление,
+пиковый RSS процесса обхода.
+
+    python -m benchmarks.bench_e2e --items 300 --latency 0.05 --error-rate 0.01
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.compare_modes import mock_settings
+from benchmarks.fixtures import PROJECT_DIR
+from benchmarks.mock_server import spawn_server
+
+
+def run_child(settings_path, result_path):
+    """Один обход в текущем процессе; вызывается из дочернего процесса"""
+    sys.path.insert(0, str(PROJECT_DIR))
+    from run_spider import AutospotCrawler
+
+    with open(settings_path, encoding='utf-8') as f:
+        config = json.load(f)
+    crawler = AutospotCrawler(output_file=config['output'], log_file=config['log'])
+    for name, value in config['settings'].items():
+        crawler.settings.set(name, value, priority='cmdline')
+
+    started = time.perf_counter()
+    success = crawler.run()
+    wall = time.perf_counter() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'success': success,
+            'wall_seconds': wall,
+            'cpu_seconds': usage.ru_utime + usage.ru_stime,
+            'peak_rss_kb': usage.ru_maxrss,
+            'stats': crawler.stats,
+        }, f, default=str)
+
+
+def summarize(result):
+    stats = result['stats'] or {}
+    items = stats.get('item_scraped_count', 0)
+    per_item = max(items, 1)
+    return {
+        'items': items,
+        'finish_reason': stats.get('finish_reason'),
+        'items_per_second': items / result['wall_seconds'],
+        'bytes_per_item': stats.get('downloader/response_bytes', 0) / per_item,
+        'cpu_ms_per_item': result['cpu_seconds'] / per_item * 1000,
+        'peak_rss_mb': result['peak_rss_kb'] / 1024,
+        'requests': stats.get('downloader/request_count', 0),
+        'retries': stats.get('retry/count', 0),
+        'wall_seconds': result['wall_seconds'],
+    }
+
+
+def run(items=300, latency=0, error_rate=0, extra_settings=None):
+    server, base_url = spawn_server(latency=latency, error_rate=error_rate)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            settings = mock_settings(base_url, workdir, 'e2e')
+            # Ленту пишет сам AutospotCrawler
+            del settings['FEEDS']
+            settings['CLOSESPIDER_ITEMCOUNT'] = items
+            settings.update(extra_settings or {})
+            config_path = Path(workdir) / 'config.json'
+            result_path = Path(workdir) / 'result.json'
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'output': str(Path(workdir) / 'items.json'),
+                    'log': settings['LOG_FILE'],
+                    'settings': settings,
+                }, f)
+            subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_e2e', '--child', str(config_path), str(result_path)],
+                cwd=PROJECT_DIR, check=True
+            )
+            with open(result_path, encoding='utf-8') as f:
+                result = json.load(f)
+    finally:
+        server.terminate()
+    return dict(summarize(result), latency=latency, error_rate=error_rate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end crawl benchmark against the local stub')
+    parser.add_argument('--items', type=int, default=300, help='Stop the crawl after N items')
+    parser.add_argument('--latency', type=float, default=0, help='Mean stub latency, seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of 503 answers from the stub')
+    parser.add_argument('--child', nargs=2, metavar=('CONFIG', 'RESULT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        sys.exit(0)
+    print(json.dumps(run(args.items, args.latency, args.error_rate), indent=2))
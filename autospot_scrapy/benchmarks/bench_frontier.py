@@ -0,0 +1,50 @@
+"""Ленивая подача страниц списков против выдачи всех страниц сразу
+
+Обе конфигурации обходят локальный стаб целиком. "eager" снимает
+ограничения Frontier, что повторяет прежнее поведение паука.
+Сравниваются время до первого объявления, пик очереди и пик RSS
+(стаб работает в отдельном процессе и в RSS обхода не попадает).
+
+    python -m benchmarks.bench_frontier
+"""
+
+import argparse
+import json
+import tempfile
+from pathlib import Path
+
+from benchmarks.compare_modes import mock_settings, summarize
+from benchmarks.crawl import run_crawl_subprocess
+from benchmarks.mock_server import spawn_server
+
+PROFILES = {
+    'eager': {'AUTOSPOT_FRONTIER_MAX_PENDING': 10 ** 9, 'AUTOSPOT_FRONTIER_LISTINGS_IN_FLIGHT': 10 ** 9},
+    'frontier': {},
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark lazy listing pagination')
+    parser.add_argument('--items', type=int, help='Stop each crawl after N items')
+    parser.add_argument('--mode', choices=('html', 'api'), default='html')
+    args = parser.parse_args()
+
+    server, base_url = spawn_server()
+    report = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, overrides in PROFILES.items():
+            settings = mock_settings(base_url, workdir, name)
+            settings.update(overrides)
+            if args.items:
+                settings['CLOSESPIDER_ITEMCOUNT'] = args.items
+            result = run_crawl_subprocess(settings, {'mode': args.mode}, Path(workdir) / f'{name}.stats.json')
+            stats = result['stats']
+            report[name] = dict(
+                summarize(result),
+                first_item_seconds=stats.get('frontier/first_item_seconds'),
+                peak_pending=stats.get('frontier/peak_pending'),
+                peak_rss_mb=result['peak_rss_kb'] / 1024,
+            )
+    server.terminate()
+
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,119 @@
+"""История объявлений на миллионе строк
+
+Синтетические обходы: --cars объявлений (марки, модели и города из
+небольших словарей), в каждом из --runs обходов каждое объявление
+встречается снова, а с вероятностью --change-rate меняет цену (пробег -
+реже); 1% объявлений снимается с продажи. Строк истории в итоге около
+cars * (1 + (runs - 1) * change_rate).
+
+Отчет: наблюдений в секунду при записи (через HistoryStore.observe, как в
+HistoryPipeline), p50/p99 запросов истории объявления, поиска по марке с
+моделью и по городу, время выгрузки изменений за последний обход и
+размер файла.
+
+    python -m benchmarks.bench_history --cars 50000 --runs 21 --change-rate 1.0
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from autospot_scrapy.history import HistoryStore
+from benchmarks.crawl import percentile
+
+BRANDS = ['brand%02d' % i for i in range(40)]
+MODELS = ['model%d' % i for i in range(10)]
+CITIES = ['city%02d' % i for i in range(30)]
+
+
+def make_cars(count, rng):
+    return [
+        ['/used-car/%d/' % car_id, rng.choice(BRANDS), rng.choice(MODELS), rng.choice(CITIES),
+         rng.randrange(500_000, 5_000_000, 1000), rng.randrange(0, 200_000, 100)]
+        for car_id in range(count)
+    ]
+
+
+def ingest(store, cars, runs, change_rate, rng):
+    observed = 0
+    started = time.perf_counter()
+    for run in range(runs):
+        store.begin_run()
+        for car in cars:
+            if run and rng.random() < change_rate:
+                car[4] -= rng.randrange(0, 50_000, 1000) or 1000
+                if rng.random() < 0.3:
+                    car[5] += rng.randrange(100, 3000, 100)
+            if run and rng.random() < 0.01:
+                store.remove(car[0])
+            else:
+                store.observe(*car)
+            observed += 1
+        store.end_run()
+    return observed, time.perf_counter() - started
+
+
+def latency(queries, function):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        function(*query)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+    }
+
+
+def run(cars_count, runs, change_rate, queries, seed=0):
+    rng = random.Random(seed)
+    cars = make_cars(cars_count, rng)
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'history.sqlite')
+        store = HistoryStore(path)
+        observed, elapsed = ingest(store, cars, runs, change_rate, rng)
+        stats = store.stats()
+        store.close()
+
+        # Запросы - на заново открытом файле, как из CLI
+        started = time.perf_counter()
+        store = HistoryStore(path)
+        open_seconds = time.perf_counter() - started
+        sample = rng.sample(cars, min(queries, len(cars)))
+        pairs = [(rng.choice(BRANDS), rng.choice(MODELS)) for _ in range(queries)]
+        report = {
+            'cars': cars_count,
+            'runs': runs,
+            'history_rows': stats['snapshots'],
+            'file_mb': round(stats['file_bytes'] / 1024 / 1024, 1),
+            'ingest': {
+                'observations': observed,
+                'seconds': round(elapsed, 2),
+                'observations_per_second': round(observed / elapsed),
+                'rows_per_second': round(stats['snapshots'] / elapsed),
+            },
+            'open_seconds': round(open_seconds, 3),
+            'car_history': latency([(car[0],) for car in sample], store.history),
+            'brand_model': latency(pairs, lambda brand, model: store.find(brand, model)),
+            'city': latency([(rng.choice(CITIES),) for _ in range(max(queries // 10, 1))],
+                            lambda city: store.find(city=city)),
+        }
+        started = time.perf_counter()
+        delta_rows = store.export_delta(runs - 1, os.path.join(workdir, 'delta.jsonl'))
+        report['delta_last_run'] = {'cars': delta_rows, 'seconds': round(time.perf_counter() - started, 3)}
+        store.close()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the car history store ingest and queries')
+    parser.add_argument('--cars', type=int, default=50000)
+    parser.add_argument('--runs', type=int, default=21)
+    parser.add_argument('--change-rate', type=float, default=1.0, help='Share of cars changing price per run')
+    parser.add_argument('--queries', type=int, default=1000, help='Queries of each kind')
+    args = parser.parse_args()
+    print(json.dumps(run(args.cars, args.runs, args.change_rate, args.queries), indent=2))
@@ -0,0 +1,112 @@
+"""Место на диске и время попадания: FilesystemCacheStorage против SqliteCacheStorage
+
+Записанный кэш (.scrapy/httpcache/autospot) переносится в SQLite с
+каждым доступным сжатием, после чего для тех же запросов замеряется
+retrieve_response обоих хранилищ.
+
+    python -m benchmarks.bench_httpcache --limit 500
+"""
+
+import argparse
+import json
+import pickle
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from scrapy.http import Request
+from scrapy.settings import Settings
+from scrapy.extensions.httpcache import FilesystemCacheStorage
+from scrapy.utils.request import fingerprint
+
+from autospot_scrapy import httpcache
+from benchmarks.fixtures import CACHE_DIR
+
+
+def filesystem_footprint(entries):
+    """Размер файлов и занятые блоки диска для записей FilesystemCacheStorage"""
+    apparent = allocated = 0
+    for entry in entries:
+        for path in entry.iterdir():
+            stat = path.stat()
+            apparent += stat.st_size
+            allocated += stat.st_blocks * 512
+        allocated += entry.stat().st_blocks * 512
+    return apparent, allocated
+
+
+def measure_hits(storage, spider, requests, repeat):
+    """Время попадания вместе со снятием gzip, которое иначе сделал бы HttpCompressionMiddleware"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for request in requests:
+            response = storage.retrieve_response(spider, request)
+            if response is None:
+                raise RuntimeError(f'Cache miss for {request.url}')
+            httpcache.decode_body(response.headers, response.body)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(requests) * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark HTTP cache storages')
+    parser.add_argument('--limit', type=int, default=500, help='Number of recorded responses')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    entries = [path.parent for path in sorted(CACHE_DIR.glob('*/*/pickled_meta'))[:args.limit]]
+    requests = []
+    for entry in entries:
+        with open(entry / 'pickled_meta', 'rb') as f:
+            requests.append(Request(pickle.load(f)['url']))
+
+    # Записанный кэш старый: сроки жизни отключены, иначе все будет промахом
+    settings = Settings({
+        'HTTPCACHE_DIR': str(CACHE_DIR.parent),
+        'HTTPCACHE_EXPIRATION_SECS': 0,
+        'AUTOSPOT_HTTPCACHE_TTLS': {},
+        'AUTOSPOT_HTTPCACHE_MAX_BYTES': 0,
+    })
+    spider = SimpleNamespace(
+        name=CACHE_DIR.name,
+        crawler=SimpleNamespace(request_fingerprinter=SimpleNamespace(fingerprint=fingerprint))
+    )
+
+    apparent, allocated = filesystem_footprint(entries)
+    fs_storage = FilesystemCacheStorage(settings)
+    fs_storage.open_spider(spider)
+    report = {
+        'responses': len(entries),
+        'filesystem': {
+            'files': sum(1 for entry in entries for _ in entry.iterdir()),
+            'apparent_bytes': apparent,
+            'disk_bytes': allocated,
+            'hit_us': measure_hits(fs_storage, spider, requests, args.repeat),
+        },
+    }
+
+    codecs = ['zlib', 'none'] + (['zstd'] if httpcache.zstandard is not None else [])
+    with tempfile.TemporaryDirectory() as workdir:
+        for codec in codecs:
+            settings.set('AUTOSPOT_HTTPCACHE_COMPRESSION', codec)
+            storage = httpcache.SqliteCacheStorage(settings)
+            storage._fingerprinter = spider.crawler.request_fingerprinter
+            path = Path(workdir) / f'{codec}.sqlite'
+            storage.open(str(path))
+            started = time.perf_counter()
+            httpcache.import_filesystem_cache(storage, CACHE_DIR, limit=args.limit)
+            import_seconds = time.perf_counter() - started
+            storage.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            stats = httpcache.cache_stats(storage)
+            report[f'sqlite_{codec}'] = {
+                'bodies': stats['bodies'],
+                'disk_bytes': path.stat().st_size,
+                'import_seconds': import_seconds,
+                'hit_us': measure_hits(storage, spider, requests, args.repeat),
+            }
+            storage.close()
+
+    print(json.dumps(report, indent=2))
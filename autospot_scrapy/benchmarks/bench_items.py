@@ -0,0 +1,122 @@
+"""Замер памяти и сериализации: AutospotCarItem против CarRecord
+
+Объявления строятся пауком из записанных страниц (страницы идут по кругу,
+serverApp-state разбирается заново для каждого объявления, как при
+обходе), и все держатся в памяти; прирост считается через tracemalloc.
+Каждый класс замеряется в отдельном процессе. Сериализация - строка
+JSON Lines (как в ShardedFeedPipeline) и JsonLinesItemExporter Scrapy.
+
+    python -m benchmarks.bench_items --items 10000
+"""
+
+import argparse
+import gc
+import hashlib
+import io
+import json
+import logging
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from scrapy.exporters import JsonLinesItemExporter
+from scrapy.http import HtmlResponse, Request
+
+from benchmarks.fixtures import PROJECT_DIR, iter_pages
+
+CLASSES = ('item', 'record')
+
+
+def build(item_class, count, pages):
+    from autospot_scrapy.spiders.autospot_spider import AutospotSpider
+
+    spider = AutospotSpider()
+    spider.item_class = item_class
+    responses = [
+        HtmlResponse(page.url, body=page.body, encoding='utf-8', request=Request(page.url))
+        for page in iter_pages(kinds=('used-detail',), limit=pages)
+    ]
+    # Время разбора - отдельным проходом по страницам, без tracemalloc
+    started = time.perf_counter()
+    built = sum(1 for response in responses for _ in spider.parse_used_car_info(response.replace()))
+    build_us = (time.perf_counter() - started) / max(built, 1) * 1e6
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    items = []
+    while len(items) < count:
+        for response in responses:
+            items.extend(spider.parse_used_car_info(response.replace()))
+            if len(items) >= count:
+                break
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return items, memory, build_us
+
+
+def serialize(items, repeat):
+    from autospot_scrapy.pipelines import json_line
+
+    best_line = best_exporter = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            json_line(item)
+        elapsed = time.perf_counter() - started
+        best_line = elapsed if best_line is None else min(best_line, elapsed)
+
+        exporter = JsonLinesItemExporter(io.BytesIO(), ensure_ascii=False)
+        started = time.perf_counter()
+        for item in items:
+            exporter.export_item(item)
+        elapsed = time.perf_counter() - started
+        best_exporter = elapsed if best_exporter is None else min(best_exporter, elapsed)
+    return best_line, best_exporter
+
+
+def run_class(name, count, pages, repeat):
+    logging.disable(logging.CRITICAL)
+    from autospot_scrapy.items import AutospotCarItem
+    from autospot_scrapy.records import CarRecord
+
+    items, memory, build_us = build({'item': AutospotCarItem, 'record': CarRecord}[name], count, pages)
+    line, exporter = serialize(items, repeat)
+    per_item = max(len(items), 1)
+    return {
+        'items': len(items),
+        'memory_mb_per_10k': round(memory / per_item * 10000 / 2 ** 20, 1),
+        'build_us_per_item': round(build_us, 1),
+        'jsonl_us_per_item': round(line / per_item * 1e6, 1),
+        'exporter_us_per_item': round(exporter / per_item * 1e6, 1),
+        # Проверка, что выгрузка совпадает: хэш всех объявлений в JSON
+        'output_hash': hashlib.sha1(b''.join(
+            json.dumps(dict(item), ensure_ascii=False).encode('utf-8') for item in items
+        )).hexdigest(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark item memory and serialization')
+    parser.add_argument('--items', type=int, default=10000, help='Number of items to keep in memory')
+    parser.add_argument('--pages', type=int, default=300, help='Number of recorded detail pages to cycle')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--class', dest='item_class', choices=CLASSES, help='Run one class in this process')
+    args = parser.parse_args()
+
+    if args.item_class:
+        print(json.dumps(run_class(args.item_class, args.items, args.pages, args.repeat)))
+        sys.exit(0)
+
+    report = {}
+    for name in CLASSES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_items', '--class', name,
+             '--items', str(args.items), '--pages', str(args.pages), '--repeat', str(args.repeat)],
+            cwd=PROJECT_DIR, check=True, capture_output=True, text=True
+        ).stdout
+        report[name] = json.loads(output)
+    report['same_output'] = report['item'].pop('output_hash') == report['record'].pop('output_hash')
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,107 @@
+"""Замер форматов выгрузки: размер файла и время записи на объявление
+
+Объявления строятся пауком из записанных страниц один раз, затем
+записываются каждым способом во временный каталог: JSON-массив с
+отступами (как в FEEDS сейчас), JSON Lines без сжатия, с gzip и zstd и
+Parquet (если установлен pyarrow). Время - лучшее из --repeat проходов,
+включая закрытие и финализацию шарда.
+
+    python -m benchmarks.bench_output --limit 500
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+from scrapy.exporters import JsonItemExporter
+from scrapy.http import HtmlResponse, Request
+
+from autospot_scrapy import pipelines
+from autospot_scrapy.spiders.autospot_spider import AutospotSpider
+from benchmarks.fixtures import iter_pages
+
+MODES = {
+    'json_indent': ('json', None),
+    'jsonl': ('jsonl', None),
+    'jsonl_gzip': ('jsonl', 'gzip'),
+    'jsonl_zstd': ('jsonl', 'zstd'),
+    'parquet_snappy': ('parquet', 'snappy'),
+    'parquet_zstd': ('parquet', 'zstd'),
+}
+
+
+class _Stats:
+    def inc_value(self, key, count=1, start=0):
+        pass
+
+
+class _Crawler:
+    stats = _Stats()
+
+
+def build_items(limit):
+    spider = AutospotSpider()
+    items = []
+    for page in iter_pages(kinds=('used-detail',), limit=limit):
+        response = HtmlResponse(page.url, body=page.body, encoding='utf-8', request=Request(page.url))
+        items.extend(spider.parse_used_car_info(response))
+    return items
+
+
+def write_json(items, directory):
+    path = os.path.join(directory, 'items.json')
+    with open(path, 'wb') as f:
+        exporter = JsonItemExporter(f, encoding='utf-8', indent=2, ensure_ascii=False)
+        exporter.start_exporting()
+        for item in items:
+            exporter.export_item(item)
+        exporter.finish_exporting()
+    return [path]
+
+
+def write_shards(items, directory, output_format, compression):
+    pipeline = pipelines.ShardedFeedPipeline(
+        _Crawler(), output_format, os.path.join(directory, 'items'), compression=compression
+    )
+    for item in items:
+        pipeline.process_item(item, None)
+    pipeline.close_spider(None)
+    return pipeline.files
+
+
+def run(limit, repeat):
+    logging.disable(logging.CRITICAL)
+    items = build_items(limit)
+    report = {'items': len(items), 'modes': {}}
+    for name, (output_format, compression) in MODES.items():
+        if output_format == 'parquet' and pipelines.pyarrow is None:
+            report['modes'][name] = 'skipped: pyarrow is not installed'
+            continue
+        best = None
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as directory:
+                started = time.perf_counter()
+                if output_format == 'json':
+                    files = write_json(items, directory)
+                else:
+                    files = write_shards(items, directory, output_format, compression)
+                elapsed = time.perf_counter() - started
+                size = sum(os.path.getsize(path) for path in files)
+            best = elapsed if best is None else min(best, elapsed)
+        report['modes'][name] = {
+            'bytes': size,
+            'bytes_per_item': round(size / max(len(items), 1), 1),
+            'us_per_item': round(best / max(len(items), 1) * 1e6, 1),
+        }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark output formats')
+    parser.add_argument('--limit', type=int, default=500, help='Number of recorded detail pages')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.limit, args.repeat), indent=2))
@@ -0,0 +1,76 @@
+"""Масштабирование разбора объявлений по числу процессов пула
+
+Два замера для 0 (разбор в текущем процессе) и 1/2/4/8 процессов:
+
+- direct: записанные страницы объявлений прогоняются через parse_detail
+  в ProcessPoolExecutor (запуск процессов не считается), проверяется,
+  что объявления совпадают с разбором в текущем процессе;
+- e2e: обход стаба через AutospotCrawler с AUTOSPOT_PARSE_WORKERS
+  (как bench_e2e).
+
+Выигрыш ограничен числом ядер: оно выводится в отчете.
+
+    python -m benchmarks.bench_parse_pool --limit 500 --items 500
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from autospot_scrapy.parsing import parse_detail
+from benchmarks import bench_e2e
+from benchmarks.fixtures import iter_pages
+
+WORKERS = (0, 1, 2, 4, 8)
+
+
+def run_direct(pages, workers):
+    jobs = [('used', page.url, page.body, 'utf-8') for page in pages]
+    if not workers:
+        started = time.perf_counter()
+        results = [parse_detail(*job) for job in jobs]
+        return results, time.perf_counter() - started
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        # Прогрев: запуск процессов и импорт паука в каждом
+        list(executor.map(parse_detail, *zip(*jobs[:workers * 2])))
+        started = time.perf_counter()
+        results = list(executor.map(parse_detail, *zip(*jobs), chunksize=4))
+        return results, time.perf_counter() - started
+
+
+def run(limit, items, workers_list, e2e=True):
+    logging.disable(logging.CRITICAL)
+    report = {'cpus': os.cpu_count(), 'direct': {}, 'e2e': {}}
+    # Обходы - до загрузки страниц: пиковый RSS наследуется дочерним процессом
+    if e2e:
+        for workers in workers_list:
+            result = bench_e2e.run(items, extra_settings={'AUTOSPOT_PARSE_WORKERS': workers})
+            report['e2e'][workers] = {
+                key: result[key] for key in ('items', 'items_per_second', 'cpu_ms_per_item', 'peak_rss_mb')
+            }
+    pages = list(iter_pages(kinds=('used-detail',), limit=limit))
+    report['pages'] = len(pages)
+    reference = None
+    for workers in workers_list:
+        results, elapsed = run_direct(pages, workers)
+        if reference is None:
+            reference = results
+        report['direct'][workers] = {
+            'pages_per_second': round(len(pages) / elapsed, 1),
+            'same_items': results == reference,
+        }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the parse process pool')
+    parser.add_argument('--limit', type=int, default=500, help='Number of recorded detail pages (direct)')
+    parser.add_argument('--items', type=int, default=500, help='Stop each crawl after N items (e2e)')
+    parser.add_argument('--workers', type=int, action='append', help='Worker counts (default: 0 1 2 4 8)')
+    parser.add_argument('--no-e2e', action='store_true', help='Only the direct measurement')
+    args = parser.parse_args()
+    print(json.dumps(run(args.limit, args.items, args.workers or WORKERS, e2e=not args.no_e2e), indent=2))
@@ -0,0 +1,213 @@
+"""Загрузка фотографий через PhotosPipeline против локального сервера картинок
+
+Фотографии берутся из записанных страниц объявлений, а url переносятся на
+локальный сервер, который отдает синтетические PNG. Доля --duplicates
+url отдает одну из немногих "стоковых" картинок, как фото дилеров на
+разных объявлениях. Два обхода над одним хранилищем: первый загружает
+все, второй (как повторный обход) должен все пропустить по индексу.
+
+    python -m benchmarks.bench_photos --items 200 --duplicates 0.3 --latency 0.02
+"""
+
+import argparse
+import io
+import json
+import logging
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+from benchmarks.fixtures import PROJECT_DIR, iter_pages
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+STOCK_IMAGES = 20
+
+
+def make_image(seed, size=(800, 600), block=4):
+    """Детерминированная картинка из цветных блоков: PNG порядка 100 КБ, как фото на сайте"""
+    rng = random.Random(seed)
+    if Image is None:
+        return rng.randbytes(100 * 1024)
+    small = (size[0] // block, size[1] // block)
+    blocks = Image.frombytes('RGB', small, rng.randbytes(small[0] * small[1] * 3))
+    buffer = io.BytesIO()
+    blocks.resize(size, Image.NEAREST).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ImageServer:
+    """HTTP-сервер картинок: /images/<имя>.png, доля duplicates отдает стоковые"""
+
+    def __init__(self, duplicates=0.3, latency=0):
+        self.duplicates = duplicates
+        self.latency = latency
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def body(self, name):
+        digest = zlib.crc32(name.encode())
+        key = ('stock', digest % STOCK_IMAGES) if digest % 1000 < self.duplicates * 1000 else ('own', name)
+        with self.lock:
+            self.requests += 1
+            body = self.cache.get(key)
+        if body is None:
+            body = make_image(str(key))
+            with self.lock:
+                self.cache[key] = body
+        return body
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                body = server.body(self.path.rsplit('/', 1)[-1])
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+
+def load_items(items, base_url):
+    """Объявления с записанных страниц, фотографии - на локальном сервере"""
+    from scrapy.http import HtmlResponse, Request
+
+    from autospot_scrapy.spiders.autospot_spider import AutospotSpider
+
+    spider = AutospotSpider()
+    result = []
+    for page in iter_pages(kinds=('used-detail',), limit=items):
+        response = HtmlResponse(page.url, body=page.body, encoding='utf-8', request=Request(page.url))
+        for item in spider.parse_used_car_info(response):
+            item = dict(item)
+            item['photos'] = [
+                f'{base_url}/images/{Path(urlparse(url).path).name}' for url in item.get('photos') or []
+            ]
+            result.append(item)
+    return result
+
+
+def run_child(config_path, result_path):
+    """Один обход: паук отдает готовые объявления, PhotosPipeline загружает фотографии"""
+    import scrapy
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    from autospot_scrapy.items import AutospotCarItem
+
+    with open(config_path, encoding='utf-8') as f:
+        config = json.load(f)
+
+    class PhotoItemsSpider(scrapy.Spider):
+        name = 'photo_items'
+
+        def start_requests(self):
+            yield scrapy.Request(config['base_url'] + '/images/start.png', callback=self.parse)
+
+        def parse(self, response):
+            for values in config['items']:
+                yield AutospotCarItem(**values)
+
+    settings = get_project_settings()
+    settings.setdict(config['settings'], priority='cmdline')
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(PhotoItemsSpider)
+    started = time.perf_counter()
+    process.crawl(crawler)
+    process.start()
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump({'wall_seconds': time.perf_counter() - started, 'stats': crawler.stats.get_stats()}, f, default=str)
+
+
+def run_crawl(workdir, name, base_url, items, settings):
+    config_path = Path(workdir) / f'{name}.config.json'
+    result_path = Path(workdir) / f'{name}.result.json'
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({'base_url': base_url, 'items': items, 'settings': settings}, f)
+    subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_photos', '--child', str(config_path), str(result_path)],
+        cwd=PROJECT_DIR, check=True
+    )
+    with open(result_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def summarize(result):
+    stats = result['stats']
+    return {
+        'requested': stats.get('photos/requested', 0),
+        'downloaded': stats.get('photos/downloaded', 0),
+        'uptodate': stats.get('photos/uptodate', 0),
+        'failed': stats.get('photos/failed', 0),
+        'stored_files': stats.get('photos/stored', 0),
+        'deduplicated': stats.get('photos/deduplicated', 0),
+        'bytes_downloaded': stats.get('photos/bytes_downloaded', 0),
+        'bytes_saved': stats.get('photos/bytes_saved', 0),
+        'thumbnails': stats.get('photos/thumbnails', 0),
+        'images_per_second': stats.get('photos/images_per_second'),
+        'wall_seconds': round(result['wall_seconds'], 2),
+    }
+
+
+def run(items=200, duplicates=0.3, latency=0, thumbs=True, throttle=True):
+    logging.disable(logging.CRITICAL)
+    server = ImageServer(duplicates=duplicates, latency=latency)
+    base_url = server.start()
+    loaded = load_items(items, base_url)
+    report = {'items': len(loaded), 'duplicates': duplicates, 'latency': latency}
+    with tempfile.TemporaryDirectory() as workdir:
+        settings = {
+            'AUTOSPOT_PHOTOS_ENABLED': True,
+            'AUTOSPOT_PHOTOS_STORE': str(Path(workdir) / 'photos'),
+            'AUTOSPOT_PHOTOS_THUMBS': {'small': [320, 240]} if thumbs and Image is not None else {},
+            'AUTOSPOT_THROTTLE_ENABLED': throttle,
+            'HTTPCACHE_ENABLED': False,
+            'ITEM_PIPELINES': {'autospot_scrapy.pipelines.PhotosPipeline': 900},
+            'FEEDS': {},
+            'LOG_FILE': str(Path(workdir) / 'photos.log'),
+        }
+        for name in ('first', 'second'):
+            report[name] = summarize(run_crawl(workdir, name, base_url, loaded, settings))
+    report['server_requests'] = server.requests
+    server.httpd.shutdown()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the photo download pipeline')
+    parser.add_argument('--items', type=int, default=200, help='Number of recorded detail pages')
+    parser.add_argument('--duplicates', type=float, default=0.3, help='Fraction of photo URLs serving stock images')
+    parser.add_argument('--latency', type=float, default=0, help='Image server latency, seconds')
+    parser.add_argument('--no-thumbs', action='store_true', help='Do not make thumbnails')
+    parser.add_argument('--no-throttle', action='store_true', help='Disable AdaptiveThrottleMiddleware')
+    parser.add_argument('--child', nargs=2, metavar=('CONFIG', 'RESULT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        sys.exit(0)
+    print(json.dumps(run(args.items, args.duplicates, args.latency, not args.no_thumbs, not args.no_throttle), indent=2))
@@ -0,0 +1,134 @@
+"""Возобновляемый обход: kill посреди обхода и продолжение с --resume
+
+Против локального стаба (с задержкой --latency) идут три обхода
+run_spider.py с одинаковыми --max-pages:
+
+1. эталонный, без задания;
+2. с --resume DIR, убитый SIGKILL, как только зафиксировано --kill-after
+   шардов выгрузки;
+3. тот же --resume DIR до конца.
+
+Проверка: объединение шардов задания совпадает с эталоном по адресам
+объявлений, без повторов; ни одно объявление из шардов, зафиксированных
+до kill, не загружается снова (по строкам "Processing ... car" лога
+второго запуска). В отчете также время обходов и сколько объявлений
+второй запуск взял из очереди задания.
+
+    python -m benchmarks.bench_resume --max-pages 20 --kill-after 3
+"""
+
+import argparse
+import collections
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from autospot_scrapy.checkpoint import car_key
+from autospot_scrapy.distributed import _read_lines
+from benchmarks.bench_archive import log_stats
+from benchmarks.bench_distributed import stub_settings
+from benchmarks.fixtures import PROJECT_DIR
+from benchmarks.mock_server import spawn_server
+
+PROCESSED = re.compile(r'Processing (?:used|new) car(?: via API)?: (\S+)')
+
+
+def command(workdir, name, max_pages, settings, resume=None):
+    args = [
+        sys.executable, str(PROJECT_DIR / 'run_spider.py'), '--format', 'jsonl', '--max-pages', str(max_pages),
+        '--output', str(Path(workdir) / name), '--log', str(Path(workdir) / f'{name}.log'),
+        *[arg for key, value in settings.items() for arg in ('--set', f'{key}={value}')]
+    ]
+    if resume:
+        args += ['--resume', resume]
+    return args
+
+
+def shard_urls(pattern):
+    """Адреса объявлений (ключи задания) из целых шардов"""
+    urls = []
+    for path in sorted(Path(pattern).parent.glob(Path(pattern).name)):
+        if path.name.endswith('.part'):
+            continue
+        urls.extend(car_key(json.loads(line)['url']) for line in _read_lines(str(path)) if line)
+    return urls
+
+
+def committed_shards(directory, prefix):
+    return [name for name in os.listdir(directory) if name.startswith(prefix + '-') and not name.endswith('.part')]
+
+
+def run(max_pages, kill_after, latency, chunk_items):
+    with tempfile.TemporaryDirectory() as workdir:
+        server, base_url = spawn_server(latency=latency)
+        try:
+            settings = stub_settings(base_url, workdir)
+            settings['AUTOSPOT_RESUME_CHUNK_ITEMS'] = chunk_items
+
+            started = time.perf_counter()
+            subprocess.run(command(workdir, 'reference', max_pages, settings), cwd=PROJECT_DIR, check=True)
+            reference_seconds = time.perf_counter() - started
+            reference = shard_urls(Path(workdir) / 'reference-*.jsonl*')
+
+            job = str(Path(workdir) / 'job')
+            started = time.perf_counter()
+            process = subprocess.Popen(command(workdir, 'job', max_pages, settings, resume=job), cwd=PROJECT_DIR)
+            while len(committed_shards(workdir, 'job')) < kill_after and process.poll() is None:
+                time.sleep(0.05)
+            process.send_signal(signal.SIGKILL)
+            process.wait()
+            first_seconds = time.perf_counter() - started
+            before_kill = set(shard_urls(Path(workdir) / 'job-*.jsonl*'))
+            left_parts = len(list(Path(workdir).glob('job-*.part')))
+
+            started = time.perf_counter()
+            # Второй запуск пишет в тот же префикс: --output здесь ни на что не влияет
+            subprocess.run(command(workdir, 'resumed', max_pages, settings, resume=job), cwd=PROJECT_DIR, check=True)
+            resumed_seconds = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait()
+
+        resumed_log = (Path(workdir) / 'resumed.log').read_text(encoding='utf-8')
+        processed = [car_key(url) for url in PROCESSED.findall(resumed_log)]
+        final = shard_urls(Path(workdir) / 'job-*.jsonl*')
+        counts = collections.Counter(final)
+        stats = log_stats(workdir, 'resumed', 'checkpoint/')
+    return {
+        'max_pages': max_pages,
+        'reference': {'items': len(reference), 'seconds': round(reference_seconds, 1)},
+        'killed': {
+            'seconds': round(first_seconds, 1),
+            'committed_items': len(before_kill),
+            'uncommitted_parts': left_parts,
+        },
+        'resumed': {
+            'seconds': round(resumed_seconds, 1),
+            'cars_processed': len(processed),
+            'resumed_cars': int(stats.get('checkpoint/resumed_cars', 0)),
+            'known_cars_skipped': int(stats.get('checkpoint/known_cars', 0)),
+            'refetched_committed': len(before_kill.intersection(processed)),
+        },
+        'result': {
+            'items': len(final),
+            'duplicates': sum(count - 1 for count in counts.values() if count > 1),
+            'missing': len(set(reference) - set(final)),
+            'extra': len(set(final) - set(reference)),
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Kill a resumable crawl against the local stub and resume it')
+    parser.add_argument('--max-pages', type=int, default=20, help='Listing pages per car type')
+    parser.add_argument('--kill-after', type=int, default=3, help='Kill the first run after this many shards')
+    parser.add_argument('--latency', type=float, default=0.05, help='Mean stub response latency, seconds')
+    parser.add_argument('--chunk-items', type=int, default=25, help='Items per committed output shard')
+    args = parser.parse_args()
+    print(json.dumps(run(args.max_pages, args.kill_after, args.latency, args.chunk_items), indent=2))
@@ -0,0 +1,80 @@
+"""Замер извлечения serverApp-state и фотографий: XPath по DOM против поиска по байтам
+
+Каждый способ запускается в отдельном процессе, чтобы пиковый RSS одного
+не влиял на другой. Страницы распаковываются по одной, так что в памяти
+одновременно лежит только текущая.
+
+    python -m benchmarks.bench_scanner --limit 300
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.fixtures import PROJECT_DIR, RecordedPage, iter_pages
+
+XPATH_PHOTOS = "//auto-gallery//img/@src | //auto-gallery-image//img/@src"
+
+
+def extract_xpath(url, body):
+    from scrapy.http import HtmlResponse
+    response = HtmlResponse(url, body=body, encoding='utf-8')
+    script = response.xpath('//script[@id="serverApp-state"]/text()').get()
+    state = json.loads(script) if script else None
+    photos = response.xpath(XPATH_PHOTOS).getall()
+    return state, photos
+
+
+def extract_scan(url, body):
+    from autospot_scrapy.scanner import find_gallery_sources, find_state_json
+    from autospot_scrapy.state import json_loads
+    script = find_state_json(body)
+    return (json_loads(script) if script else None), find_gallery_sources(body)
+
+
+def run_method(method, limit):
+    extract = {'xpath': extract_xpath, 'scan': extract_scan}[method]
+    pages = [page.path for page in iter_pages(kinds=('used-detail',), limit=limit)]
+    # Прогрев импортов и аллокатора на одной странице
+    first = next(iter_pages(kinds=('used-detail',), limit=1))
+    extract(first.url, first.body)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    cpu = 0.0
+    for path in pages:
+        page = RecordedPage(path)
+        body = page.body
+        started = time.process_time()
+        extract(page.url, body)
+        cpu += time.process_time() - started
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'pages': len(pages),
+        'cpu_ms_per_page': cpu / max(len(pages), 1) * 1000,
+        'peak_rss_kb': peak_rss,
+        'rss_growth_kb': peak_rss - baseline_rss,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark page data extraction')
+    parser.add_argument('--limit', type=int, default=200, help='Number of recorded detail pages')
+    parser.add_argument('--method', choices=('xpath', 'scan'), help='Run one method in this process')
+    args = parser.parse_args()
+
+    if args.method:
+        print(json.dumps(run_method(args.method, args.limit)))
+        sys.exit(0)
+
+    report = {}
+    for method in ('xpath', 'scan'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_scanner', '--method', method, '--limit', str(args.limit)],
+            cwd=PROJECT_DIR, check=True, capture_output=True, text=True
+        ).stdout
+        report[method] = json.loads(output)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,68 @@
+"""Микробенчмарки горячих методов паука на записанных страницах
+
+Замеряются _extract_script_data и _extract_photos на страницах
+объявлений, _get_max_page на страницах списков и разбор опций
+(обработчик used-car/options-two-column, заменивший _process_options).
+Время - лучшее из --repeat проходов, в микросекундах на вызов.
+
+    python -m benchmarks.bench_spider --limit 200
+"""
+
+import argparse
+import json
+import time
+
+from scrapy.http import HtmlResponse
+
+from autospot_scrapy.spiders.autospot_spider import AutospotSpider
+from autospot_scrapy.state import options_two_column
+from benchmarks.fixtures import iter_pages
+
+
+def measure(func, inputs, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for value in inputs:
+            func(value)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / max(len(inputs), 1) * 1e6
+
+
+def load_responses(kind, limit):
+    return [
+        HtmlResponse(page.url, body=page.body, encoding='utf-8')
+        for page in iter_pages(kinds=(kind,), limit=limit)
+    ]
+
+
+def run(limit, repeat):
+    spider = AutospotSpider()
+    details = load_responses('used-detail', limit)
+    listings = load_responses('used-list', limit)
+    options = [
+        state.body('used-car/options-two-column')
+        for state in map(spider._extract_script_data, details) if state
+    ]
+    return {
+        'detail_pages': len(details),
+        'listing_pages': len(listings),
+        'us_per_call': {
+            # Новый объект ответа на каждый вызов: селектор lxml кэшируется в ответе
+            '_extract_script_data': measure(
+                lambda r: spider._extract_script_data(r.replace()), details, repeat
+            ),
+            '_extract_photos': measure(lambda r: spider._extract_photos(r.replace()), details, repeat),
+            '_get_max_page': measure(lambda r: spider._get_max_page(r.replace()), listings, repeat),
+            'options_two_column': measure(options_two_column, options, repeat),
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-benchmark spider hot paths')
+    parser.add_argument('--limit', type=int, default=200, help='Number of recorded pages of each kind')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.limit, args.repeat), indent=2))
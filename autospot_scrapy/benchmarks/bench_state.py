@@ -0,0 +1,96 @@
+"""Микробенчмарк разбора serverApp-state: поиск подстрок по ключам против индекса
+
+Для каждой записанной страницы Б/У авто сравнивается время на одно
+объявление: json.loads + пять-шесть проходов next(key for key in ...)
+(как было в пауке) против json_loads + одного прохода ServerState.
+
+    python -m benchmarks.bench_state --limit 300
+"""
+
+import argparse
+import json
+import time
+
+from autospot_scrapy.state import ServerState, json_loads, orjson
+from benchmarks.fixtures import STATE_RE, iter_pages
+
+USED_PATHS = (
+    'api.autospot.ru/rest/v2/used-car/cars',
+    'api.autospot.ru/rest/car/all-characteristics',
+    'api.autospot.ru/rest/used-car/options-two-column',
+)
+NEW_PATHS = (
+    'api.autospot.ru/rest/car/base-info',
+    'api.autospot.ru/rest/car/price-block',
+    'api.autospot.ru/rest/car/all-options-two-column',
+    'api.autospot.ru/rest/dealer/direct-offer',
+)
+
+
+def legacy_extract(script):
+    """Разбор в том виде, в котором он был в пауке до индекса"""
+    script_data = json.loads(script)
+    found = []
+    for api_path in USED_PATHS + NEW_PATHS:
+        key = next((key for key in script_data.keys() if api_path in key), None)
+        found.append(script_data.get(key, {}).get('body', {}) if key else {})
+    return found
+
+
+def indexed_extract(script):
+    state = ServerState(json_loads(script))
+    return [
+        state.get(path) for path in (
+            'v2/used-car/cars', 'car/all-characteristics', 'used-car/options-two-column',
+            'car/base-info', 'car/price-block', 'car/all-options-two-column', 'dealer/direct-offer',
+        )
+    ]
+
+
+def route_only(data, indexed):
+    if indexed:
+        state = ServerState(data)
+        return [state.body(path.split('/rest/', 1)[1]) for path in USED_PATHS + NEW_PATHS]
+    return [next((key for key in data.keys() if path in key), None) for path in USED_PATHS + NEW_PATHS]
+
+
+def measure(func, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for script in corpus:
+            func(script)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(corpus) * 1e6
+
+
+def load_corpus(limit):
+    corpus = []
+    for page in iter_pages(kinds=('used-detail',), limit=limit):
+        match = STATE_RE.search(page.body)
+        if match:
+            corpus.append(match.group(1).decode('utf-8'))
+    return corpus
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark serverApp-state routing')
+    parser.add_argument('--limit', type=int, default=200, help='Number of recorded detail pages')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.limit)
+    decoded = [json.loads(script) for script in corpus]
+    report = {
+        'pages': len(corpus),
+        'avg_state_bytes': sum(len(s) for s in corpus) // max(len(corpus), 1),
+        'json_decoder': 'orjson' if orjson is not None else 'json',
+        'us_per_item': {
+            'legacy_total': measure(legacy_extract, corpus, args.repeat),
+            'indexed_total': measure(indexed_extract, corpus, args.repeat),
+            'legacy_routing': measure(lambda data: route_only(data, False), decoded, args.repeat),
+            'indexed_routing': measure(lambda data: route_only(data, True), decoded, args.repeat),
+        },
+    }
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,53 @@
+"""Фиксированная задержка против адаптивного регулятора на стабе с ограничением частоты
+
+Стаб отвечает 429 с Retry-After сверх --rate запросов в секунду. Каждый
+обход останавливается после одинакового числа объявлений; сравниваются
+время, число 429 и итоговые решения регулятора.
+
+    python -m benchmarks.bench_throttle --items 150 --rate 10
+"""
+
+import argparse
+import json
+import tempfile
+from pathlib import Path
+
+from benchmarks.compare_modes import mock_settings, summarize
+from benchmarks.crawl import run_crawl_subprocess
+from benchmarks.mock_server import start_server
+
+PROFILES = {
+    # Как было: задержка 2 секунды на весь домен
+    'fixed': {'AUTOSPOT_THROTTLE_ENABLED': False, 'CONCURRENT_REQUESTS': 8, 'DOWNLOAD_DELAY': 2},
+    # Без задержки: упирается в 429 и повторы
+    'unthrottled': {'AUTOSPOT_THROTTLE_ENABLED': False, 'CONCURRENT_REQUESTS': 8, 'DOWNLOAD_DELAY': 0},
+    'adaptive': {'AUTOSPOT_THROTTLE_ENABLED': True},
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark adaptive rate control')
+    parser.add_argument('--items', type=int, default=100, help='Stop each crawl after N items')
+    parser.add_argument('--rate', type=float, default=10, help='Stub rate limit, requests per second')
+    parser.add_argument('--limit', type=int, help='Load only first N recorded pages into the stub')
+    parser.add_argument('--profile', action='append', choices=sorted(PROFILES), help='Run only these profiles')
+    args = parser.parse_args()
+
+    server, base_url = start_server(limit=args.limit, rate=args.rate)
+    report = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.profile or list(PROFILES):
+            settings = mock_settings(base_url, workdir, name)
+            settings.update(PROFILES[name])
+            settings['CLOSESPIDER_ITEMCOUNT'] = args.items
+            result = run_crawl_subprocess(settings, {}, Path(workdir) / f'{name}.stats.json')
+            stats = result['stats']
+            report[name] = dict(
+                summarize(result),
+                responses_429=stats.get('downloader/response_status_count/429', 0),
+                retries_exhausted=stats.get('retry/max_reached', 0),
+                throttle={key: value for key, value in stats.items() if key.startswith('throttle/')},
+            )
+    server.shutdown()
+
+    print(json.dumps(report, indent=2))
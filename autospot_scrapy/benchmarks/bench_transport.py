@@ -0,0 +1,141 @@
+"""Транспорт: стандартный загрузчик Scrapy против PooledHTTP11DownloadHandler
+
+Стаб отвечает по HTTPS с самоподписанным сертификатом (создается на время
+замера) и задержкой --latency. Регулятор включен без задержек, так что
+слоты держат до 15 параллельных запросов к хосту - больше, чем 8
+свободных соединений стандартного пула. Соединения считает сам стаб
+(/__stub/stats): отчет - новых соединений на 1000 запросов, p50/p99
+download_latency и объявлений в секунду.
+
+HTTP/2 здесь не замеряется: стаб (http.server) говорит только HTTP/1.1, а
+для H2DownloadHandler нужен пакет h2 - в отчете причина пропуска.
+
+    python -m benchmarks.bench_transport --items 300 --latency 0.02
+"""
+
+import argparse
+import datetime
+import json
+import ssl
+import tempfile
+import urllib.request
+from pathlib import Path
+
+from benchmarks.compare_modes import mock_settings
+from benchmarks.crawl import run_crawl_subprocess
+from benchmarks.mock_server import STATS_PATH, spawn_server
+
+STOCK_HANDLER = 'scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler'
+STOCK_RESOLVER = 'scrapy.resolver.CachingThreadedResolver'
+
+
+def make_certificate(directory):
+    """Самоподписанный сертификат для 127.0.0.1: (cert.pem, key.pem)"""
+    import ipaddress
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]), False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = Path(directory) / 'cert.pem', Path(directory) / 'key.pem'
+    cert_path.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    return str(cert_path), str(key_path)
+
+
+def stub_stats(base_url):
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    with urllib.request.urlopen(base_url + STATS_PATH, context=context) as response:
+        return json.load(response)
+
+
+def crawl(base_url, workdir, name, items, overrides):
+    settings = mock_settings(base_url, workdir, name)
+    budgets = {
+        kind: {'start_delay': 0.0, 'min_delay': 0.0, 'max_delay': 5.0, 'start_concurrency': concurrency,
+               'max_concurrency': concurrency}
+        for kind, concurrency in (('list', 2), ('detail', 12), ('token', 1), ('photo', 16))
+    }
+    settings.update({
+        'AUTOSPOT_THROTTLE_ENABLED': True,
+        'AUTOSPOT_THROTTLE_BUDGETS': budgets,
+        'CLOSESPIDER_ITEMCOUNT': items,
+        **overrides,
+    })
+    before = stub_stats(base_url)
+    result = run_crawl_subprocess(settings, {}, Path(workdir) / f'{name}.stats.json')
+    after = stub_stats(base_url)
+    stats = result['stats']
+    # Запрос к /__stub/stats тоже соединение и запрос
+    connections = after['connections'] - before['connections'] - 1
+    requests = after['requests'] - before['requests']
+    items_done = stats.get('item_scraped_count', 0)
+    return {
+        'items': items_done,
+        'requests': requests,
+        'connections': connections,
+        'connections_per_1000_requests': round(connections * 1000 / max(requests, 1), 1),
+        'client_connections_per_1000_requests': stats.get('transport/connections_per_1000_requests'),
+        'latency_ms': result['latency_ms'],
+        'items_per_second': round(items_done / result['wall_seconds'], 1),
+    }
+
+
+def http2_status():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return 'skipped: the h2 package is not installed'
+    return 'skipped: the stub server speaks HTTP/1.1 only'
+
+
+def run(items, latency, limit):
+    with tempfile.TemporaryDirectory() as workdir:
+        tls = make_certificate(workdir)
+        process, base_url = spawn_server(limit=limit, latency=latency, tls=tls)
+        try:
+            report = {
+                'items': items,
+                'latency': latency,
+                'stock': crawl(base_url, workdir, 'stock', items, {
+                    'DOWNLOAD_HANDLERS': {'http': STOCK_HANDLER, 'https': STOCK_HANDLER},
+                    'DNS_RESOLVER': STOCK_RESOLVER,
+                }),
+                'pooled': crawl(base_url, workdir, 'pooled', items, {}),
+                'http2': http2_status(),
+            }
+        finally:
+            process.terminate()
+            process.wait()
+    stock, pooled = report['stock'], report['pooled']
+    report['connection_ratio'] = round(
+        pooled['connections_per_1000_requests'] / max(stock['connections_per_1000_requests'], 0.1), 3
+    )
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the tuned HTTP transport against a local TLS stub')
+    parser.add_argument('--items', type=int, default=300, help='Stop each crawl after this many items')
+    parser.add_argument('--latency', type=float, default=0.02, help='Mean stub response latency, seconds')
+    parser.add_argument('--limit', type=int, help='Load only first N recorded pages into the stub')
+    args = parser.parse_args()
+    print(json.dumps(run(args.items, args.latency, args.limit), indent=2))
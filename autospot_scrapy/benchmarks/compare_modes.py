@@ -0,0 +1,61 @@
+"""Сравнение обхода через HTML-страницы и напрямую через REST API
+
+Оба режима идут против локального стаба и останавливаются после
+одинакового числа объявлений. Сравниваются байты на проводе и время
+на одно объявление.
+
+    python -m benchmarks.compare_modes --items 200
+"""
+
+import argparse
+import json
+import tempfile
+from pathlib import Path
+
+from benchmarks.crawl import run_crawl_subprocess
+from benchmarks.mock_server import start_server
+
+
+def mock_settings(base_url, workdir, name):
+    return {
+        'AUTOSPOT_BASE_URL': base_url,
+        'AUTOSPOT_API_URL': base_url + '/api/rest',
+        'HTTPCACHE_ENABLED': False,
+        'DOWNLOAD_DELAY': 0,
+        'AUTOSPOT_THROTTLE_ENABLED': False,
+        'AUTOSPOT_TOKEN_FILE': str(Path(workdir) / f'{name}.token.json'),
+        'LOG_FILE': str(Path(workdir) / f'{name}.log'),
+        'FEEDS': {str(Path(workdir) / f'{name}.json'): {'format': 'json', 'overwrite': True}},
+    }
+
+
+def summarize(result):
+    stats = result['stats']
+    items = stats.get('item_scraped_count', 0) or 1
+    return {
+        'items': stats.get('item_scraped_count', 0),
+        'requests': stats.get('downloader/request_count', 0),
+        'response_bytes': stats.get('downloader/response_bytes', 0),
+        'bytes_per_item': stats.get('downloader/response_bytes', 0) / items,
+        'requests_per_item': stats.get('downloader/request_count', 0) / items,
+        'seconds_per_item': result['wall_seconds'] / items,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare HTML and API crawl modes')
+    parser.add_argument('--items', type=int, default=100, help='Stop each crawl after N items')
+    parser.add_argument('--limit', type=int, help='Load only first N recorded pages into the stub')
+    args = parser.parse_args()
+
+    server, base_url = start_server(limit=args.limit)
+    report = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in ('html', 'api'):
+            settings = mock_settings(base_url, workdir, mode)
+            settings['CLOSESPIDER_ITEMCOUNT'] = args.items
+            result = run_crawl_subprocess(settings, {'mode': mode}, Path(workdir) / f'{mode}.stats.json')
+            report[mode] = summarize(result)
+    server.shutdown()
+
+    print(json.dumps(report, indent=2))
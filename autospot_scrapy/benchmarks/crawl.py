@@ -0,0 +1,97 @@
+"""Запуск одного обхода паука с переопределенными настройками и выгрузкой статистики
+
+Каждый обход идет в отдельном процессе (реактор Twisted нельзя
+перезапустить), поэтому скрипты замеров вызывают этот модуль через
+run_crawl_subprocess().
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.fixtures import PROJECT_DIR
+
+
+def percentile(values, q):
+    """q-квантиль по отсортированному списку (ближайший ранг)"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_crawl(settings_overrides, spider_kwargs, stats_path):
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+    from autospot_scrapy.spiders.autospot_spider import AutospotSpider
+
+    settings = get_project_settings()
+    for name, value in settings_overrides.items():
+        settings.set(name, value, priority='cmdline')
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(AutospotSpider)
+    result = {}
+    latencies = []
+
+    def spider_closed(spider, reason):
+        result['finish_reason'] = reason
+
+    def response_received(response, request, spider):
+        # Ответы HTTP-кэша и архива сети не касались
+        if 'cached' not in response.flags and 'download_latency' in request.meta:
+            latencies.append(request.meta['download_latency'])
+
+    crawler.signals.connect(spider_closed, signal=signals.spider_closed)
+    crawler.signals.connect(response_received, signal=signals.response_received)
+    started = time.perf_counter()
+    process.crawl(crawler, **spider_kwargs)
+    process.start()
+    result['wall_seconds'] = time.perf_counter() - started
+    # Статистика после остановки: часть значений пишется в spider_closed
+    result['stats'] = {
+        key: (value.isoformat() if hasattr(value, 'isoformat') else value)
+        for key, value in crawler.stats.get_stats().items()
+    }
+    latencies.sort()
+    result['latency_ms'] = {
+        name: round(percentile(latencies, q) * 1000, 2) if latencies else None
+        for name, q in (('p50', 0.5), ('p99', 0.99))
+    }
+    # memusage/max обновляется раз в минуту и на коротких обходах не растет
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with open(stats_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2, default=str)
+    return result
+
+
+def run_crawl_subprocess(settings_overrides, spider_kwargs, stats_path):
+    """Запускает обход в дочернем процессе и возвращает его результат"""
+    command = [sys.executable, '-m', 'benchmarks.crawl', '--stats', str(stats_path)]
+    for name, value in settings_overrides.items():
+        command += ['--set', f'{name}={json.dumps(value)}']
+    for name, value in spider_kwargs.items():
+        command += ['--arg', f'{name}={value}']
+    subprocess.run(command, cwd=PROJECT_DIR, check=True)
+    with open(stats_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run one benchmark crawl')
+    parser.add_argument('--stats', required=True, help='Where to write crawl stats (JSON)')
+    parser.add_argument('--set', action='append', default=[], help='NAME=JSON setting override')
+    parser.add_argument('--arg', action='append', default=[], help='NAME=VALUE spider argument')
+    args = parser.parse_args()
+
+    overrides = {}
+    for pair in args.set:
+        name, _, value = pair.partition('=')
+        overrides[name] = json.loads(value)
+    spider_kwargs = dict(pair.split('=', 1) for pair in args.arg)
+
+    run_crawl(overrides, spider_kwargs, args.stats)
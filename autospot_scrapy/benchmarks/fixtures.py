@@ -0,0 +1,77 @@
+"""Доступ к записанным страницам autospot.ru из HTTP-кэша Scrapy"""
+
+import ast
+import gzip
+import json
+import re
+from pathlib import Path
+from urllib.parse import urlparse
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+CACHE_DIR = PROJECT_DIR / '.scrapy' / 'httpcache' / 'autospot'
+
+STATE_RE = re.compile(rb'<script id="serverApp-state" type="application/json">(.*?)</script>', re.S)
+
+
+class RecordedPage:
+    """Одна записанная страница: адрес, статус, заголовки и тело как на проводе"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = ast.literal_eval((self.path / 'meta').read_text())
+        self.url = meta['response_url']
+        self.status = meta['status']
+        self.headers = _parse_headers((self.path / 'response_headers').read_bytes())
+        self.raw_body = (self.path / 'response_body').read_bytes()
+
+    @property
+    def kind(self):
+        return page_kind(self.url)
+
+    @property
+    def body(self):
+        """Тело страницы без Content-Encoding"""
+        if self.headers.get('content-encoding', '').lower() == 'gzip':
+            return gzip.decompress(self.raw_body)
+        return self.raw_body
+
+    def state(self):
+        """serverApp-state страницы или None"""
+        match = STATE_RE.search(self.body)
+        return json.loads(match.group(1)) if match else None
+
+
+def page_kind(url):
+    """Тип страницы: home, used-list, new-list, used-detail, new-detail или other"""
+    path = urlparse(url).path
+    if path in ('', '/'):
+        return 'home'
+    if path.startswith('/used-car/'):
+        return 'used-list'
+    if path.startswith('/filters/'):
+        return 'new-list'
+    if path.startswith('/brands/'):
+        return 'used-detail' if '/used/' in path else 'new-detail'
+    return 'other'
+
+
+def iter_pages(kinds=None, limit=None, cache_dir=CACHE_DIR):
+    """Перебирает записанные страницы в стабильном порядке"""
+    count = 0
+    for meta_path in sorted(Path(cache_dir).glob('*/*/meta')):
+        page = RecordedPage(meta_path.parent)
+        if kinds and page.kind not in kinds:
+            continue
+        yield page
+        count += 1
+        if limit and count >= limit:
+            return
+
+
+def _parse_headers(raw):
+    headers = {}
+    for line in raw.decode('latin-1').splitlines():
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
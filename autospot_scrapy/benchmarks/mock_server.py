@@ -0,0 +1,269 @@
+"""Локальный стаб autospot.ru поверх записанных страниц
+
+HTML-страницы отдаются байт в байт, как были записаны (вместе с
+Content-Encoding). Ответы REST API восстанавливаются из serverApp-state
+тех же страниц и доступны по префиксу /api/rest/ с обязательным
+Bearer-токеном с главной страницы.
+
+С --rate стаб изображает ограничение частоты: запросы сверх N в секунду
+получают 429 с заголовком Retry-After. --latency добавляет к каждому
+ответу задержку (среднее в секундах, разброс +-50%), --error-rate
+отвечает 503 на указанную долю запросов. С --tls-cert и --tls-key стаб
+отвечает по HTTPS. Число принятых соединений и запросов стаб отдает по
+/__stub/stats - так считают соединения для сравнения загрузчиков.
+
+Запуск из каталога проекта:
+
+    python -m benchmarks.mock_server --port 8000
+
+и обход паука против стаба:
+
+    scrapy crawl autospot -s AUTOSPOT_BASE_URL=http://127.0.0.1:8000 \\
+        -s AUTOSPOT_API_URL=http://127.0.0.1:8000/api/rest
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import logging
+import random
+import socket
+import ssl
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlencode, urlparse
+
+from benchmarks.fixtures import PROJECT_DIR, iter_pages
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = '/api/rest/'
+REAL_API_PREFIX = '/rest/'
+STATS_PATH = '/__stub/stats'
+
+
+def route_key(path, query):
+    """Нормализованный ключ маршрута: путь без хвостового / и отсортированный query"""
+    params = sorted(parse_qsl(unquote(query), keep_blank_values=True))
+    return path.rstrip('/') + '?' + urlencode(params)
+
+
+class MockAutospot:
+    """Таблица маршрутов стаба, собранная из записанного кэша"""
+
+    def __init__(self, limit=None, rate=None, retry_after=1, latency=0, error_rate=0, seed=0):
+        self.pages = {}
+        self.rate = rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.throttled = 0
+        self.errors = 0
+        self.connections = 0
+        self.requests = 0
+        self._bucket = rate
+        self._bucket_time = time.monotonic()
+        self._lock = threading.Lock()
+        self.api = {}
+        self.token = None
+        # Главная нужна всегда: с нее берется токен
+        for page in itertools.chain(iter_pages(kinds=('home',)), iter_pages(limit=limit)):
+            url = urlparse(page.url)
+            self.pages[route_key(url.path, url.query)] = page
+            state = page.state() or {}
+            for key, value in state.items():
+                if page.kind == 'home' and 'rest/oauth2/token' in key:
+                    self.token = value.get('body', {}).get('access_token')
+                if not key.startswith('G.') or not isinstance(value, dict) or 'url' not in value:
+                    continue
+                api_url = urlparse(value['url'])
+                if not api_url.path.startswith(REAL_API_PREFIX):
+                    continue
+                api_path = api_url.path[len(REAL_API_PREFIX):]
+                self.api.setdefault(
+                    route_key(api_path, api_url.query),
+                    json.dumps(value.get('body'), ensure_ascii=False).encode('utf-8')
+                )
+        logger.info("Mock site loaded %d pages and %d API responses", len(self.pages), len(self.api))
+
+    def handler_class(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                with site._lock:
+                    site.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                if self.path == STATS_PATH:
+                    body = json.dumps({'connections': site.connections, 'requests': site.requests}).encode()
+                    return site.send(self, 200, body, 'application/json')
+                site.handle(self)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+    def allow(self):
+        """Корзина токенов на rate запросов в секунду с запасом в одну секунду"""
+        if not self.rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._bucket = min(self.rate, self._bucket + (now - self._bucket_time) * self.rate)
+            self._bucket_time = now
+            if self._bucket >= 1:
+                self._bucket -= 1
+                return True
+            self.throttled += 1
+            return False
+
+    def handle(self, handler):
+        url = urlparse(handler.path)
+        if not self.allow():
+            handler.send_response(429)
+            handler.send_header('Retry-After', str(self.retry_after))
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        with self._lock:
+            self.requests += 1
+            delay = self.latency * self.random.uniform(0.5, 1.5) if self.latency else 0
+            failed = self.error_rate and self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if failed:
+            self.errors += 1
+            return self.send(handler, 503, b'Service Unavailable', 'text/html')
+        if url.path.startswith(API_PREFIX):
+            if handler.headers.get('Authorization', '') != f'Bearer {self.token}':
+                return self.send(handler, 401, b'{"message": "Unauthorized"}', 'application/json')
+            body = self.api.get(route_key(url.path[len(API_PREFIX):], url.query))
+            if body is None:
+                return self.send(handler, 404, b'{"message": "Not found"}', 'application/json')
+            return self.send(handler, 200, body, 'application/json; charset=UTF-8')
+
+        page = self.pages.get(route_key(url.path, url.query))
+        if page is None:
+            return self.send(handler, 404, b'Not found', 'text/html')
+        etag = page.headers.get('etag')
+        if etag and handler.headers.get('If-None-Match') == etag:
+            handler.send_response(304)
+            handler.send_header('ETag', etag)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        handler.send_response(page.status)
+        for name in ('content-type', 'content-encoding', 'etag'):
+            if name in page.headers:
+                handler.send_header(name, page.headers[name])
+        handler.send_header('Content-Length', str(len(page.raw_body)))
+        handler.end_headers()
+        handler.wfile.write(page.raw_body)
+
+    def send(self, handler, status, body, content_type):
+        if 'gzip' in handler.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            handler.send_response(status)
+            handler.send_header('Content-Encoding', 'gzip')
+        else:
+            handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def make_server(site, host, port, tls=None):
+    """HTTP-сервер стаба; tls - (сертификат, ключ) для HTTPS"""
+    server = ThreadingHTTPServer((host, port), site.handler_class())
+    server.daemon_threads = True
+    server.site = site
+    if tls:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*tls)
+        # Рукопожатие в потоке соединения, а не в потоке accept
+        server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    return server
+
+
+def start_server(host='127.0.0.1', port=0, limit=None, rate=None, retry_after=1, latency=0, error_rate=0,
+                 tls=None):
+    """Запускает стаб в фоновом потоке и возвращает (server, base_url)"""
+    site = MockAutospot(limit=limit, rate=rate, retry_after=retry_after, latency=latency, error_rate=error_rate)
+    server = make_server(site, host, port, tls)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'{"https" if tls else "http"}://{host}:{server.server_address[1]}'
+
+
+def spawn_server(host='127.0.0.1', limit=None, rate=None, latency=0, error_rate=0, tls=None, timeout=120):
+    """Запускает стаб в отдельном процессе и возвращает (process, base_url)
+
+    Нужен замерам памяти: ru_maxrss наследуется дочерними процессами через
+    exec, и стаб со всеми страницами в памяти испортил бы пик RSS обхода.
+    """
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        port = sock.getsockname()[1]
+    command = [sys.executable, '-m', 'benchmarks.mock_server', '--host', host, '--port', str(port)]
+    if limit:
+        command += ['--limit', str(limit)]
+    if rate:
+        command += ['--rate', str(rate)]
+    if latency:
+        command += ['--latency', str(latency)]
+    if error_rate:
+        command += ['--error-rate', str(error_rate)]
+    if tls:
+        command += ['--tls-cert', tls[0], '--tls-key', tls[1]]
+    process = subprocess.Popen(command, cwd=PROJECT_DIR)
+    base_url = f'{"https" if tls else "http"}://{host}:{port}'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return process, base_url
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'Mock server did not start on {base_url}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run local autospot.ru stub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--limit', type=int, help='Load only first N recorded pages')
+    parser.add_argument('--rate', type=float, help='Answer 429 above N requests per second')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After value for 429 responses')
+    parser.add_argument('--latency', type=float, default=0, help='Mean added response latency, seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests answered with 503')
+    parser.add_argument('--tls-cert', help='Serve HTTPS with this PEM certificate')
+    parser.add_argument('--tls-key', help='Private key for --tls-cert')
+    args = parser.parse_args()
+    if bool(args.tls_cert) != bool(args.tls_key):
+        parser.error('--tls-cert and --tls-key go together')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(name)s] %(levelname)s: %(message)s')
+    site = MockAutospot(
+        limit=args.limit, rate=args.rate, retry_after=args.retry_after,
+        latency=args.latency, error_rate=args.error_rate
+    )
+    tls = (args.tls_cert, args.tls_key) if args.tls_cert else None
+    server = make_server(site, args.host, args.port, tls)
+    logger.info("Serving on %s://%s:%d", 'https' if tls else 'http', args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
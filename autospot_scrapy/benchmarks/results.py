@@ -0,0 +1,103 @@
+"""Сохранение результатов замеров в JSON и сравнение двух прогонов
+
+Результат пишется в benchmarks/results/<имя>-<коммит>.json вместе с
+коммитом, версиями Python и Scrapy. Сравнение выводит все числовые
+поля обоих файлов и относительное изменение:
+
+    python -m benchmarks.results results/suite-1c10b71.json results/suite-7b912a1.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+from pathlib import Path
+
+from benchmarks.fixtures import PROJECT_DIR
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+def git_revision():
+    """Короткий хеш HEAD с пометкой -dirty при незакоммиченных изменениях"""
+    def git(*args):
+        return subprocess.run(
+            ['git', *args], cwd=PROJECT_DIR, capture_output=True, text=True
+        ).stdout.strip()
+
+    revision = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    if git('status', '--porcelain', '--untracked-files=no'):
+        revision += '-dirty'
+    return revision
+
+
+def save_result(name, data, results_dir=RESULTS_DIR):
+    import scrapy
+
+    revision = git_revision()
+    payload = {
+        'name': name,
+        'revision': revision,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'scrapy': scrapy.__version__,
+        'results': data,
+    }
+    results_dir.mkdir(parents=True, exist_ok=True)
+    path = results_dir / f'{name}-{revision}.json'
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def flatten(data, prefix=''):
+    """Числовые листья вложенного словаря: 'a.b.c' -> значение"""
+    values = {}
+    for key, value in data.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            values.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(old, new):
+    """Строки (метрика, было, стало, изменение в процентах)"""
+    old_values = flatten(old['results'])
+    new_values = flatten(new['results'])
+    rows = []
+    for name in sorted(old_values.keys() | new_values.keys()):
+        before, after = old_values.get(name), new_values.get(name)
+        change = None
+        if before and after is not None:
+            change = (after - before) / abs(before) * 100
+        rows.append((name, before, after, change))
+    return rows
+
+
+def _format(value):
+    if value is None:
+        return '-'
+    return f'{value:.4g}' if isinstance(value, float) else str(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two saved benchmark results')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0, help='Only show changes above N percent')
+    args = parser.parse_args()
+
+    with open(args.old, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+
+    print(f"{old['revision']} -> {new['revision']}")
+    for name, before, after, change in compare(old, new):
+        if args.threshold and (change is None or abs(change) < args.threshold):
+            continue
+        change_text = '' if change is None else f'{change:+.1f}%'
+        print(f'{name:60} {_format(before):>12} {_format(after):>12} {change_text:>9}')
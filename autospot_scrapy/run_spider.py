@@ -9,20 +9,160 @@ from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
 from autospot_scrapy.spiders.autospot_spider import AutospotSpider
 
+def crawl_settings(output_file, output_format='json', incremental=False, shallow=False, deep_fields=None,
+                   compression=None, shard_items=0, shard_bytes=0, catalog=None, compact=False, parse_workers=0,
+                   queue=None, worker=None, photos=False, thumbnails=None, record=None, replay=None,
+                   budgets=None, max_seconds=0, sample=0, strata=None, config_cache=False, config_refs=False,
+                   history=False, resume=None, extra_settings=None):
+    """Настройки Scrapy для одного обхода с выгрузкой в output_file (аргументы - как у AutospotCrawler)"""
+    settings = get_project_settings()
+    
+    if incremental:
+        settings.set('AUTOSPOT_INCREMENTAL', True)
+    
+    if shallow:
+        settings.set('AUTOSPOT_SHALLOW', True)
+    if deep_fields:
+        settings.set('AUTOSPOT_DEEP_FIELDS', deep_fields)
+    
+    if output_format != 'json':
+        # Для шардов output_file - префикс имени, к нему добавятся номер и расширение
+        prefix, ext = os.path.splitext(output_file)
+        settings.set('AUTOSPOT_OUTPUT_FORMAT', output_format)
+        settings.set('AUTOSPOT_OUTPUT_PATH', prefix if ext == '.json' else output_file)
+        settings.set('AUTOSPOT_OUTPUT_COMPRESSION', compression)
+        settings.set('AUTOSPOT_OUTPUT_SHARD_ITEMS', shard_items)
+        settings.set('AUTOSPOT_OUTPUT_SHARD_BYTES', shard_bytes)
+    
+    if compact:
+        settings.set('AUTOSPOT_COMPACT_ITEMS', True)
+    if config_cache:
+        settings.set('AUTOSPOT_CONFIG_CACHE_ENABLED', True)
+    if config_refs:
+        settings.set('AUTOSPOT_CONFIG_REFS', True)
+    if history:
+        settings.set('AUTOSPOT_HISTORY_ENABLED', True)
+    if parse_workers:
+        settings.set('AUTOSPOT_PARSE_WORKERS', parse_workers)
+    
+    if photos:
+        settings.set('AUTOSPOT_PHOTOS_ENABLED', True)
+        if thumbnails:
+            settings.set('AUTOSPOT_PHOTOS_THUMBS', {f'{w}x{h}': [w, h] for w, h in thumbnails})
+    
+    if queue:
+        settings.set('AUTOSPOT_QUEUE_FILE', queue)
+        settings.set('AUTOSPOT_WORKER_NAME', worker)
+        settings.set('SCHEDULER', 'autospot_scrapy.distributed.SharedQueueScheduler')
+        # Страницы списков разбирают разные воркеры, поэтому Frontier
+        # не дождется их page_done: все страницы сразу уходят в общую очередь
+        settings.set('AUTOSPOT_FRONTIER_MAX_PENDING', 10 ** 9)
+        settings.set('AUTOSPOT_FRONTIER_LISTINGS_IN_FLIGHT', 10 ** 9)
+    
+    if budgets:
+        settings.set('AUTOSPOT_CRAWL_BUDGETS', budgets)
+    if max_seconds:
+        settings.set('AUTOSPOT_CRAWL_SECONDS', max_seconds)
+    if sample:
+        settings.set('AUTOSPOT_SAMPLE_PER_STRATUM', sample)
+        if strata:
+            settings.set('AUTOSPOT_SAMPLE_STRATA', strata)
+    
+    if record:
+        settings.set('AUTOSPOT_ARCHIVE_FILE', record)
+    if replay:
+        # Ответы из архива: без задержек, троттлинга, повторов и HTTP-кэша.
+        # Токен тоже из архива, поэтому файл токена не читается и не перезаписывается
+        handler = 'autospot_scrapy.archive.ArchiveDownloadHandler'
+        settings.set('AUTOSPOT_REPLAY_ARCHIVE', replay)
+        settings.set('DOWNLOAD_HANDLERS', {'http': handler, 'https': handler})
+        settings.set('DOWNLOAD_DELAY', 0)
+        settings.set('AUTOSPOT_THROTTLE_ENABLED', False)
+        settings.set('RETRY_ENABLED', False)
+        settings.set('HTTPCACHE_ENABLED', False)
+        settings.set('AUTOSPOT_TOKEN_FILE', None)
+        settings.set('CONCURRENT_REQUESTS', 64)
+        settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', 64)
+    
+    if catalog:
+        settings.set('AUTOSPOT_CATALOG_ENABLED', True)
+        settings.set('AUTOSPOT_CATALOG_ENCODING', None if catalog == 'index' else catalog)
+        settings.set('AUTOSPOT_CATALOG_OUTPUT', os.path.splitext(output_file)[0] + '_catalog.json')
+    
+    if resume:
+        # Массив JSON дописать нельзя - задание пишет фиксируемые шарды
+        if output_format == 'json':
+            raise ValueError("Resumable crawls need jsonl or parquet output")
+        settings.set('AUTOSPOT_RESUME_DIR', resume)
+        settings.set('AUTOSPOT_TOKEN_FILE', os.path.abspath(os.path.join(resume, 'token.json')))
+    
+    for name, value in (extra_settings or {}).items():
+        settings.set(name, value, priority='cmdline')
+    
+    if resume and not settings.getint('AUTOSPOT_OUTPUT_SHARD_ITEMS') and not settings.getint('AUTOSPOT_OUTPUT_SHARD_BYTES'):
+        # Размер фиксируемого шарда - после --set, его можно переопределить
+        settings.set('AUTOSPOT_OUTPUT_SHARD_ITEMS', settings.getint('AUTOSPOT_RESUME_CHUNK_ITEMS'))
+    
+    if output_format == 'json':
+        settings.set('FEEDS', {
+            output_file: {
+                'format': 'json',
+                'encoding': 'utf-8',
+                'indent': 2,
+                'ensure_ascii': False
+            }
+        })
+    else:
+        # Объявления пишет ShardedFeedPipeline
+        settings.set('FEEDS', {})
+    return settings
+
+
 class AutospotCrawler:
     """Обертка для запуска и управления пауком Autospot"""
     
-    def __init__(self, output_file=None, log_file=None, max_pages=None):
+    def __init__(self, output_file=None, log_file=None, max_pages=None, mode='html', incremental=False,
+                 shallow=False, deep_fields=None, output_format='json', compression=None,
+                 shard_items=0, shard_bytes=0, catalog=None, compact=False, parse_workers=0,
+                 queue=None, worker=None, photos=False, thumbnails=None, record=None, replay=None,
+                 budgets=None, max_seconds=0, sample=0, strata=None, config_cache=False, config_refs=False,
+                 history=False, resume=None, extra_settings=None):
         """
         Инициализация обертки
         
         Args:
             output_file (str): Путь к файлу для сохранения результатов
             log_file (str): Путь к файлу для логов
-            max_pages (int): Максимальное количество страниц для обработки
+            max_pages (int): Максимальное количество страниц списков каждого типа машин
+            mode (str): html (страницы объявлений) или api (Б/У авто через REST API)
+            incremental (bool): Пропускать объявления, не изменившиеся с прошлого обхода
+            shallow (bool): Собирать объявления из карточек списков без загрузки страниц
+            deep_fields (list): Поля, отсутствие которых в карточке требует загрузки страницы
+            output_format (str): json (один массив), jsonl или parquet (шарды)
+            compression (str): Сжатие шардов: gzip или zstd
+            shard_items (int): Объявлений в одном шарде (0 - без ограничения)
+            shard_bytes (int): Размер шарда в байтах (0 - без ограничения)
+            catalog (str): Опции и характеристики как id справочника: ids, bitmap
+                или index (объявления не меняются, ведется только индекс)
+            compact (bool): Компактные объявления CarRecord (меньше памяти)
+            parse_workers (int): Процессов для разбора страниц объявлений (0 - без пула)
+            queue (str): Файл общей очереди распределенного обхода (воркер)
+            worker (str): Имя воркера в общей очереди
+            photos (bool): Загружать фотографии объявлений в хранилище
+            thumbnails (list): Размеры миниатюр фотографий [(ширина, высота)]
+            record (str): Дописывать ответы в этот архив
+            replay (str): Брать ответы из этого архива вместо сети
+            budgets (dict): Бюджеты по типу машин {'used'|'new'|'*': {'requests': ..., 'bytes': ...}}
+            max_seconds (float): Время всего обхода, секунд
+            sample (int): Объявлений на страту в режиме выборки
+            strata (list): Поля страты выборки: brand, city
+            config_cache (bool): Обрабатывать общие характеристики и опции один раз
+            config_refs (bool): Выгружать конфигурации отдельными записями со ссылками на них
+            history (bool): Дописывать цены, пробег и наличие в историю объявлений
+            resume (str): Каталог задания: обход сохраняет в нем состояние и
+                продолжается с места падения (см. autospot_scrapy.checkpoint)
+            extra_settings (dict): Дополнительные настройки Scrapy
         """
-        self.settings = get_project_settings()
-        
         os.makedirs('logs', exist_ok=True)
         os.makedirs('data', exist_ok=True)
         
@@ -39,6 +179,18 @@ class AutospotCrawler:
             self.log_file = f'logs/{current_time}_autospot.log'
         
         self.max_pages = max_pages
+        self.mode = mode
+        self.output_format = output_format
+        self.stats = None
+        
+        self.settings = crawl_settings(
+            self.output_file, output_format, incremental=incremental, shallow=shallow, deep_fields=deep_fields,
+            compression=compression, shard_items=shard_items, shard_bytes=shard_bytes, catalog=catalog,
+            compact=compact, parse_workers=parse_workers, queue=queue, worker=worker, photos=photos,
+            thumbnails=thumbnails, record=record, replay=replay, budgets=budgets, max_seconds=max_seconds,
+            sample=sample, strata=strata, config_cache=config_cache, config_refs=config_refs,
+            history=history, resume=resume, extra_settings=extra_settings
+        )
         
         self.setup_logging()
         
@@ -57,20 +209,15 @@ class AutospotCrawler:
         try:
             self.logger.info("Starting Autospot crawler")
 
-            self.settings.set('FEEDS', {
-                self.output_file: {
-                    'format': 'json',
-                    'encoding': 'utf-8',
-                    'indent': 2,
-                    'ensure_ascii': False
-                }
-            })
-            
+            crawler = self.process.create_crawler(AutospotSpider)
             self.process.crawl(
-                AutospotSpider,
-                max_pages=self.max_pages
+                crawler,
+                max_pages=self.max_pages,
+                mode=self.mode
             )
             self.process.start()
+            # Статистика последнего обхода (для замеров и отчетов)
+            self.stats = crawler.stats.get_stats()
             
             self.logger.info("Crawler finished successfully")
             return True
@@ -78,21 +225,170 @@ class AutospotCrawler:
             self.logger.exception(f"Error running crawler: {e}")
             return False
 
+def run_daemon(output_file=None, log_file=None, max_pages=None, interval=None, control_port=None,
+               cycles=0, mode='html', **options):
+    """
+    Режим службы: обход каждые interval секунд в одном процессе (см. autospot_scrapy.daemon)
+    
+    Args:
+        output_file (str): Выгрузка цикла; {time} заменяется временем начала
+            цикла, без {time} оно добавляется перед расширением
+        log_file (str): Лог цикла, так же с {time}
+        max_pages (int): Максимальное количество страниц в цикле
+        interval (float): Секунд между началами циклов (по умолчанию AUTOSPOT_DAEMON_INTERVAL)
+        control_port (int): Порт управления (по умолчанию AUTOSPOT_DAEMON_CONTROL_PORT)
+        cycles (int): Остановиться после стольких циклов (0 - работать до остановки)
+        mode (str): Режим обхода паука: html или api
+        options: Остальные аргументы crawl_settings
+    """
+    from scrapy.utils.log import configure_logging
+    from scrapy.utils.reactor import install_reactor
+    from autospot_scrapy.daemon import CrawlDaemon
+    from autospot_scrapy.transport import install_dns_cache
+    
+    output_pattern = _cycle_pattern(output_file or 'data/{time}_autospot.json')
+    log_pattern = _cycle_pattern(log_file or 'logs/{time}_autospot.log')
+    
+    def cycle_settings(stamp):
+        settings = crawl_settings(output_pattern.format(time=stamp), **options)
+        settings.set('LOG_FILE', log_pattern.format(time=stamp), priority='cmdline')
+        return settings
+    
+    settings = crawl_settings(output_pattern, **options)
+    daemon_log = settings.get('AUTOSPOT_DAEMON_LOG')
+    for path in (output_pattern, log_pattern, daemon_log):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    
+    install_reactor(settings.get('TWISTED_REACTOR'), settings.get('ASYNCIO_EVENT_LOOP'))
+    install_dns_cache(settings)
+    # До первого цикла корневой обработчик Scrapy пишет в лог службы, затем
+    # каждый Crawler переключает его на свой LOG_FILE; сообщения самой
+    # службы всегда идут в ее лог
+    settings.set('LOG_FILE', daemon_log, priority='cmdline')
+    configure_logging(settings)
+    handler = logging.FileHandler(daemon_log, encoding='utf-8')
+    handler.setFormatter(logging.Formatter(settings.get('LOG_FORMAT'), settings.get('LOG_DATEFORMAT')))
+    daemon_logger = logging.getLogger('autospot_scrapy.daemon')
+    daemon_logger.addHandler(handler)
+    daemon_logger.propagate = False
+    
+    daemon = CrawlDaemon(
+        AutospotSpider, cycle_settings,
+        interval=interval or settings.getfloat('AUTOSPOT_DAEMON_INTERVAL'),
+        control_port=settings.getint('AUTOSPOT_DAEMON_CONTROL_PORT') if control_port is None else control_port,
+        control_host=settings.get('AUTOSPOT_DAEMON_CONTROL_HOST'),
+        max_cycles=cycles,
+        warm_pool=settings.getbool('AUTOSPOT_DAEMON_WARM_POOL'),
+        spider_kwargs={'max_pages': max_pages, 'mode': mode}
+    )
+    daemon.run()
+    return all('error' not in cycle for cycle in daemon.history)
+
+
+def _cycle_pattern(path):
+    if '{time}' in path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}_{{time}}{ext}'
+
+
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description='Run Autospot crawler')
     parser.add_argument('--output', '-o', help='Output file path')
     parser.add_argument('--log', '-l', help='Log file path')
-    parser.add_argument('--max-pages', '-m', type=int, help='Maximum number of pages to process')
+    parser.add_argument('--max-pages', '-m', type=int, help='Maximum number of listing pages per car type')
+    parser.add_argument('--mode', choices=('html', 'api'), default='html',
+                        help='Fetch used cars from detail pages (html) or straight from the REST API (api)')
+    parser.add_argument('--max-requests', type=int, help='Stop crawling a car type after this many downloads')
+    parser.add_argument('--max-mb', type=float, help='Stop crawling a car type after this many megabytes of bodies')
+    parser.add_argument('--max-minutes', type=float, help='Stop the whole crawl after this many minutes')
+    parser.add_argument('--sample', type=int, default=0, metavar='N',
+                        help='Take at most N cars per stratum, spreading --max-pages across pagination')
+    parser.add_argument('--strata', default='brand', help='Comma-separated sampling strata: brand, city')
+    parser.add_argument('--incremental', action='store_true', help='Skip cars unchanged since the previous run')
+    parser.add_argument('--shallow', action='store_true', help='Build items from listing cards without detail pages')
+    parser.add_argument('--deep-fields', help='Comma-separated fields that trigger a detail fetch when missing from a card')
+    parser.add_argument('--format', choices=('json', 'jsonl', 'parquet'), default='json',
+                        help='Output format: one JSON array, or JSON Lines / Parquet shards')
+    parser.add_argument('--compression', choices=('gzip', 'zstd'), help='Compress JSON Lines shards (Parquet: column codec)')
+    parser.add_argument('--shard-items', type=int, default=0, help='Rotate shards after this many items')
+    parser.add_argument('--shard-size', type=float, default=0, help='Rotate shards after this many megabytes on disk')
+    parser.add_argument('--catalog', choices=('ids', 'bitmap', 'index'),
+                        help='Replace options and characteristics with catalog ids, or only update the query index')
+    parser.add_argument('--compact', action='store_true', help='Keep items as compact slotted records')
+    parser.add_argument('--config-cache', action='store_true',
+                        help='Process characteristics and options shared by several cars once')
+    parser.add_argument('--config-refs', action='store_true',
+                        help='Write shared characteristics and options once as configuration records referenced by id')
+    parser.add_argument('--history', action='store_true',
+                        help='Record price, mileage and availability changes in the history store')
+    parser.add_argument('--parse-workers', type=int, default=0, help='Parse detail pages in N worker processes')
+    parser.add_argument('--queue', help='Run as a distributed worker on this shared queue file')
+    parser.add_argument('--worker', help='Worker name in the shared queue (default: host-pid)')
+    parser.add_argument('--photos', action='store_true', help='Download car photos into the content-addressed store')
+    parser.add_argument('--thumbnail', action='append', default=[], metavar='WxH',
+                        help='Also make photo thumbnails of this size (may be repeated, needs Pillow)')
+    parser.add_argument('--record', metavar='ARCHIVE', help='Append every response to this archive')
+    parser.add_argument('--replay', metavar='ARCHIVE',
+                        help='Serve responses from this archive instead of the network')
+    parser.add_argument('--resume', metavar='JOBDIR',
+                        help='Checkpoint the crawl into JOBDIR and continue the job saved there, if any')
+    parser.add_argument('--set', '-s', action='append', default=[], metavar='NAME=VALUE',
+                        help='Override a Scrapy setting (may be repeated)')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and start a crawl cycle every --interval seconds')
+    parser.add_argument('--interval', type=float, help='Seconds between cycle starts (default: AUTOSPOT_DAEMON_INTERVAL)')
+    parser.add_argument('--control-port', type=int,
+                        help='Daemon control endpoint port (default: AUTOSPOT_DAEMON_CONTROL_PORT)')
+    parser.add_argument('--cycles', type=int, default=0, help='Stop the daemon after N cycles (default: never)')
     
     args = parser.parse_args()
+    if args.config_refs and (args.format == 'parquet' or args.catalog):
+        parser.error('--config-refs works with JSON and JSON Lines output without --catalog')
+    if args.resume and (args.format == 'json' or args.daemon):
+        parser.error('--resume needs --format jsonl or parquet and does not work with --daemon')
+    
+    limits = {}
+    if args.max_requests:
+        limits['requests'] = args.max_requests
+    if args.max_mb:
+        limits['bytes'] = int(args.max_mb * 1024 * 1024)
     
-    crawler = AutospotCrawler(
-        output_file=args.output,
-        log_file=args.log,
-        max_pages=args.max_pages
+    options = dict(
+        incremental=args.incremental,
+        shallow=args.shallow,
+        deep_fields=args.deep_fields.split(',') if args.deep_fields else None,
+        output_format=args.format,
+        compression=args.compression,
+        shard_items=args.shard_items,
+        shard_bytes=int(args.shard_size * 1024 * 1024),
+        catalog=args.catalog,
+        compact=args.compact,
+        parse_workers=args.parse_workers,
+        queue=args.queue,
+        worker=args.worker,
+        photos=args.photos,
+        thumbnails=[tuple(int(x) for x in size.split('x')) for size in args.thumbnail],
+        record=args.record,
+        replay=args.replay,
+        budgets={'*': limits} if limits else None,
+        max_seconds=(args.max_minutes or 0) * 60,
+        sample=args.sample,
+        strata=args.strata.split(','),
+        config_cache=args.config_cache,
+        config_refs=args.config_refs,
+        history=args.history,
+        resume=args.resume,
+        extra_settings=dict(setting.split('=', 1) for setting in args.set)
     )
     
-    success = crawler.run()
+    if args.daemon:
+        success = run_daemon(args.output, args.log, args.max_pages, args.interval, args.control_port,
+                             args.cycles, mode=args.mode, **options)
+    else:
+        crawler = AutospotCrawler(output_file=args.output, log_file=args.log, max_pages=args.max_pages,
+                                  mode=args.mode, **options)
+        success = crawler.run()
     sys.exit(0 if success else 1) 
\ No newline at end of file
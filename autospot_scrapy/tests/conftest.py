@@ -0,0 +1,27 @@
+"""Общие фикстуры тестов: локальный стаб autospot.ru
+
+Стаб собирается из записанного HTTP-кэша (.scrapy/httpcache); без него
+тесты со стабом пропускаются.
+"""
+
+import pytest
+
+from benchmarks.fixtures import CACHE_DIR
+from benchmarks.mock_server import start_server
+
+
+def pytest_collection_modifyitems(config, items):
+    if any(CACHE_DIR.glob('*/*/meta')):
+        return
+    skip = pytest.mark.skip(reason=f'no recorded pages in {CACHE_DIR}')
+    for item in items:
+        if 'mock_site' in item.fixturenames:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope='session')
+def mock_site():
+    """Базовый адрес стаба, общего для всех тестов сессии"""
+    server, base_url = start_server()
+    yield base_url
+    server.shutdown()
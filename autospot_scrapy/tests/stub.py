@@ -0,0 +1,56 @@
+"""Обходы run_spider.py против локального стаба и разбор их результатов
+
+Обходы идут в дочерних процессах - реактор Twisted нельзя перезапустить.
+"""
+
+import ast
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from autospot_scrapy.distributed import _read_lines
+from benchmarks.bench_distributed import stub_settings
+from benchmarks.fixtures import PROJECT_DIR
+
+
+def spider_command(workdir, name, base_url, *args, settings=None):
+    """Команда run_spider.py: JSON Lines в workdir/name-*.jsonl, лог в workdir/name.log"""
+    overrides = dict(stub_settings(base_url, workdir), **(settings or {}))
+    # Лог Scrapy по умолчанию пишется в logs/ каталога проекта
+    overrides.setdefault('LOG_FILE', str(Path(workdir) / f'{name}.scrapy.log'))
+    return [
+        sys.executable, str(PROJECT_DIR / 'run_spider.py'), '--format', 'jsonl',
+        '--output', str(Path(workdir) / name), '--log', str(Path(workdir) / f'{name}.log'), *args,
+        *[arg for key, value in overrides.items() for arg in ('--set', f'{key}={value}')]
+    ]
+
+
+def run_spider(workdir, name, base_url, *args, settings=None):
+    """Обход до конца; возвращает статистику из дампа в конце лога"""
+    subprocess.run(spider_command(workdir, name, base_url, *args, settings=settings), cwd=PROJECT_DIR, check=True)
+    return crawl_stats(workdir, name)
+
+
+def crawl_stats(workdir, name):
+    """Числа и строки из дампа статистики Scrapy в логе обхода"""
+    stats = {}
+    for line in (Path(workdir) / f'{name}.log').read_text(encoding='utf-8').splitlines():
+        line = line.strip()
+        if not line.startswith(("'", "{'")):
+            continue
+        key, _, value = line.strip('{},').partition(': ')
+        try:
+            stats[key.strip("'")] = ast.literal_eval(value.rstrip(','))
+        except (ValueError, SyntaxError):
+            continue
+    return stats
+
+
+def read_items(workdir, name):
+    """Записи из целых шардов name-*.jsonl* (без .part) в порядке шардов"""
+    return [
+        json.loads(line)
+        for path in sorted(Path(workdir).glob(f'{name}-*.jsonl*')) if not path.name.endswith('.part')
+        for line in _read_lines(str(path)) if line
+    ]
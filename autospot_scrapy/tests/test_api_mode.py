@@ -0,0 +1,42 @@
+"""Режим API (--mode api) против HTML-страниц на локальном стабе"""
+
+import pytest
+
+from tests.stub import read_items, run_spider
+
+
+@pytest.fixture(scope='module')
+def crawls(mock_site, tmp_path_factory):
+    """Обход первой страницы списка в обоих режимах: {режим: (статистика, объявления по url)}"""
+    result = {}
+    for mode in ('html', 'api'):
+        # Свой каталог - и свой файл токена: режим API получает токен сам
+        workdir = tmp_path_factory.mktemp(mode)
+        stats = run_spider(workdir, mode, mock_site, '--mode', mode, '--max-pages', '1')
+        result[mode] = stats, {item['url']: item for item in read_items(workdir, mode)}
+    return result
+
+
+def test_api_mode_builds_the_same_items_as_html(crawls):
+    _, html = crawls['html']
+    _, api = crawls['api']
+
+    assert len(html) == 12
+    assert api == html
+
+
+def test_api_mode_skips_detail_pages(crawls):
+    html_stats, _ = crawls['html']
+    api_stats, api = crawls['api']
+
+    # Четыре запроса к API на объявление вместо одной страницы, но байт меньше
+    assert api_stats['downloader/request_count'] > html_stats['downloader/request_count']
+    assert api_stats['downloader/response_bytes'] < html_stats['downloader/response_bytes']
+    assert api_stats['item_scraped_count'] == len(api)
+
+
+def test_api_mode_uses_one_token(crawls):
+    api_stats, _ = crawls['api']
+
+    assert api_stats['token/fetch_count'] == 1
+    assert 'downloader/response_status_count/401' not in api_stats
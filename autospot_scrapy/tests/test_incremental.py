@@ -0,0 +1,65 @@
+"""Инкрементальный обход: хранилище виденных объявлений и условные запросы"""
+
+import asyncio
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from autospot_scrapy.seenstore import card_fingerprint
+from autospot_scrapy.spiders.autospot_spider import AutospotSpider
+
+URL = 'https://autospot.ru/brands/kia/rio/used/sedan/12345/'
+PATH = '/brands/kia/rio/used/sedan/12345/'
+
+
+@pytest.fixture
+def spider(tmp_path):
+    crawler = get_crawler(AutospotSpider, {
+        'AUTOSPOT_INCREMENTAL': True,
+        'AUTOSPOT_SEEN_STORE': str(tmp_path / 'seen.sqlite'),
+    })
+    spider = crawler._create_spider()
+    yield spider
+    spider.seen_store.close()
+
+
+async def collect(results):
+    return [result async for result in results]
+
+
+def card(price, run=10000):
+    return {'prices': {'price': price}, 'run': run}
+
+
+@pytest.mark.parametrize('callback, car_type', [
+    ('parse_used_car_info', 'used'),
+    ('parse_new_car_info', 'new'),
+    ('parse_car_info_offloaded', 'used'),
+])
+def test_not_modified_page_keeps_the_new_card(spider, callback, car_type):
+    # Прошлый обход: страница загружена с карточкой по старой цене
+    spider.seen_store.record(PATH, car_type, card_fingerprint(card(1000000)), 'content', etag='"v1"')
+
+    card_fp = spider._check_seen(URL, car_type, card(990000))
+    assert card_fp == card_fingerprint(card(990000))
+    meta = {'card_fingerprint': card_fp, 'car_type': car_type}
+    assert spider._conditional_headers(URL, meta) == {'If-None-Match': '"v1"'}
+
+    response = HtmlResponse(URL, status=304, request=Request(URL, meta=meta))
+    result = getattr(spider, callback)(response)
+    assert (asyncio.run(collect(result)) if callback == 'parse_car_info_offloaded' else list(result)) == []
+
+    # Следующий обход с той же карточкой страницу не запрашивает
+    assert spider._check_seen(URL, car_type, card(990000)) is False
+    row = spider.seen_store.get(PATH)
+    assert row['content_fingerprint'] == 'content'
+    assert row['etag'] == '"v1"'
+    assert spider.crawler.stats.get_value('incremental/not_modified') == 1
+
+
+def test_changed_card_is_fetched(spider):
+    spider.seen_store.record(PATH, 'used', card_fingerprint(card(1000000)), 'content')
+
+    assert spider._check_seen(URL, 'used', card(1000000)) is False
+    assert spider._check_seen(URL, 'used', card(1000000, run=12000)) == card_fingerprint(card(1000000, run=12000))
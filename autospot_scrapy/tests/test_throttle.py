@@ -0,0 +1,84 @@
+"""AdaptiveThrottleMiddleware: AIMD-решения и обход стаба, отвечающего 429"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+
+from autospot_scrapy.middlewares import AdaptiveThrottleMiddleware
+from autospot_scrapy.spiders.autospot_spider import AutospotSpider
+from benchmarks.mock_server import start_server
+from tests.stub import read_items, run_spider
+
+BUDGETS = {
+    'list': {'start_delay': 0.0, 'min_delay': 0.0, 'start_concurrency': 1, 'max_concurrency': 2},
+    'detail': {'start_delay': 0.0, 'min_delay': 0.0, 'start_concurrency': 8, 'max_concurrency': 8},
+    'token': {'start_delay': 0.0, 'min_delay': 0.0, 'start_concurrency': 1, 'max_concurrency': 1},
+}
+
+
+@pytest.fixture
+def middleware():
+    crawler = get_crawler(AutospotSpider, {'AUTOSPOT_THROTTLE_BUDGETS': BUDGETS})
+    crawler.engine = SimpleNamespace(downloader=SimpleNamespace(slots={}))
+    return AdaptiveThrottleMiddleware.from_crawler(crawler)
+
+
+def respond(middleware, status=200, latency=0.1, headers=None):
+    request = Request('https://autospot.ru/brands/kia/rio/used/sedan/1/', meta={'request_kind': 'detail'})
+    middleware.process_request(request, None)
+    request.meta['download_latency'] = latency
+    return middleware.process_response(request, Response(request.url, status=status, headers=headers), None)
+
+
+def test_throttled_response_halves_concurrency_and_honours_retry_after(middleware):
+    respond(middleware, status=429, headers={'Retry-After': '3'})
+    state = middleware.slots['autospot.ru:detail']
+    slot = middleware.crawler.engine.downloader.slots['autospot.ru:detail']
+
+    assert state['concurrency'] == 4
+    assert state['delay'] == 3.0
+    assert (slot.concurrency, slot.delay) == (4, 3.0)
+    stats = middleware.crawler.stats
+    assert stats.get_value('throttle/detail/decrease') == 1
+    assert stats.get_value('throttle/detail/retry_after') == 1
+
+
+def test_fast_responses_ramp_back_up(middleware):
+    respond(middleware, status=503)
+    for _ in range(20):
+        respond(middleware)
+    state = middleware.slots['autospot.ru:detail']
+
+    assert state['delay'] == 0.0
+    assert state['concurrency'] == 8
+    assert middleware.crawler.stats.get_value('throttle/detail/max_concurrency') == 8
+
+
+def test_slow_responses_release_concurrency(middleware):
+    respond(middleware, latency=5.0)
+
+    assert middleware.slots['autospot.ru:detail']['concurrency'] == 7
+
+
+@pytest.fixture(scope='module')
+def throttled_site(mock_site):
+    """Стаб, отвечающий 429 с Retry-After: 1 сверх 5 запросов в секунду"""
+    server, base_url = start_server(rate=5)
+    yield base_url
+    server.shutdown()
+
+
+def test_crawl_backs_off_on_429(throttled_site, tmp_path):
+    stats = run_spider(tmp_path, 'throttled', throttled_site, '--max-pages', '1', settings={
+        'AUTOSPOT_THROTTLE_ENABLED': True,
+        'AUTOSPOT_THROTTLE_BUDGETS': json.dumps(BUDGETS),
+    })
+
+    assert stats['downloader/response_status_count/429'] > 0
+    assert stats['throttle/detail/decrease'] > 0
+    assert stats['throttle/detail/max_delay'] >= 1.0
+    assert 'retry/max_reached' not in stats
+    assert len(read_items(tmp_path, 'throttled')) == 12
@@ -0,0 +1,79 @@
+"""TokenMiddleware: повторная авторизация и повтор запроса на 401/403"""
+
+import datetime
+import json
+
+import pytest
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+
+from autospot_scrapy.middlewares import TokenMiddleware
+from autospot_scrapy.spiders.autospot_spider import AutospotSpider
+from tests.stub import read_items, run_spider
+
+
+@pytest.fixture
+def middleware(monkeypatch):
+    # token_info - атрибут класса, общий для всех экземпляров
+    monkeypatch.setattr(TokenMiddleware, 'token_info', {'token': 'old', 'timestamp': datetime.datetime.now()})
+    return TokenMiddleware.from_crawler(get_crawler(AutospotSpider))
+
+
+def api_request():
+    request = Request('https://api.autospot.ru/rest/v2/used-car/cars/1/', meta={'needs_token': True, 'token': 'old'})
+    request.headers['Authorization'] = 'Bearer old'
+    return request
+
+
+@pytest.mark.parametrize('status', [401, 403])
+def test_rejected_token_is_dropped_and_request_replayed(middleware, status):
+    request = api_request()
+    retry = middleware.process_response(request, Response(request.url, status=status, request=request), None)
+
+    assert isinstance(retry, Request)
+    assert retry.url == request.url
+    assert retry.dont_filter
+    assert retry.meta['token_retried']
+    assert 'Authorization' not in retry.headers
+    assert middleware.token_info['token'] is None
+    assert middleware.crawler.stats.get_value('token/rejected') == 1
+
+
+def test_token_refreshed_by_another_request_is_kept(middleware):
+    request = api_request()
+    middleware.token_info['token'] = 'new'
+    retry = middleware.process_response(request, Response(request.url, status=401, request=request), None)
+
+    assert isinstance(retry, Request)
+    assert middleware.token_info['token'] == 'new'
+
+
+def test_replayed_request_is_not_retried_twice(middleware):
+    request = api_request()
+    request.meta['token_retried'] = True
+    response = Response(request.url, status=401, request=request)
+
+    assert middleware.process_response(request, response, None) is response
+
+
+def test_stale_saved_token_is_replaced_on_401(mock_site, tmp_path):
+    token_file = tmp_path / 'token.json'
+    token_file.write_text(json.dumps({'token': 'stale', 'timestamp': datetime.datetime.now().isoformat()}))
+
+    stats = run_spider(tmp_path, 'api', mock_site, '--mode', 'api', '--max-pages', '1')
+
+    # Одна загрузка главной на все отклоненные запросы, каждый повторен с новым токеном
+    assert stats['token/fetch_count'] == 1
+    assert stats['token/rejected'] >= 1
+    assert stats['downloader/response_status_count/401'] == stats['token/rejected']
+    assert len(read_items(tmp_path, 'api')) == 12
+    assert json.loads(token_file.read_text())['token'] != 'stale'
+
+
+def test_saved_token_needs_no_homepage(mock_site, tmp_path):
+    run_spider(tmp_path, 'first', mock_site, '--mode', 'api', '--max-pages', '1')
+    stats = run_spider(tmp_path, 'second', mock_site, '--mode', 'api', '--max-pages', '1')
+
+    assert 'token/fetch_count' not in stats
+    assert 'downloader/response_status_count/401' not in stats
+    assert len(read_items(tmp_path, 'second')) == 12